@@ -45,6 +45,10 @@ def init_config(filepath=None, enable_boto=True, enable_botocore=False):
                 return botocore.credentials.Credentials(access_key, secret_key)
             botocore.credentials.get_credentials = get_credentials
 
+        # The cached session may hold the previous credentials
+        from opslib.icsutils.misc import reset_botocore_cache
+        reset_botocore_cache()
+
     if access_key and secret_key:
         return access_key, secret_key
 
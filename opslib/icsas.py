@@ -7,6 +7,8 @@ IcsAS: Library for Auto Scaling
 +--------------------+------------+--+
 """
 
+from itertools import islice
+
 from boto.ec2.autoscale import regions
 from boto.ec2.autoscale import AutoScaleConnection
 from opslib.icsutils.misc import dict_merge
@@ -14,10 +16,14 @@ from opslib.icsutils.misc import gen_timestamp
 from opslib.icsutils.misc import user_data_decode
 from opslib.icsutils.misc import clean_empty_items
 from opslib.icsutils.misc import init_botocore_service, operate
-from opslib.icsutils.misc import filter_resource_from_json
+from opslib.icsutils.misc import iter_resource_from_json
 from opslib.icsutils.misc import keyname_formatd
 from opslib.icsutils.misc import fetch_used_params
-from opslib.icsexception import IcsASException
+from opslib.icsutils.misc import Retry
+from opslib.icsutils.cache import TTLCache
+from opslib.icsutils.parallel import RateLimiter
+from opslib.icsutils.parallel import run_parallel, run_ordered
+from opslib.icsexception import IcsException, IcsASException
 
 import logging
 log = logging.getLogger(__name__)
@@ -47,8 +53,17 @@ class IcsAS(object):
     ICS Library for AutoScale
     """
 
-    def __init__(self, region, **kwargs):
+    def __init__(self, region, cache_ttl=300, **kwargs):
+        """
+        :type region: string
+        :param region: the region name
+
+        :type cache_ttl: int
+        :param cache_ttl: how many seconds the cached instance to group
+            mapping is kept
+        """
         self.conn = AutoScaleConnection(region=get_region(region), **kwargs)
+        self.cache = TTLCache(cache_ttl)
 
     def to_list(self, input):
         """
@@ -74,39 +89,201 @@ class IcsAS(object):
         :rtype: string
         :return: name of the ASG, this instance belongs to
         """
-        instances = self.conn.get_all_autoscaling_instances(
-            instance_ids=self.to_list(instance_id))
-        if instances:
-            return instances[0].group_name
-        else:
+        instance_ids = self.to_list(instance_id)
+        if not instance_ids:
             return None
+        return self.get_group_names_for_instances(
+            instance_ids[:1]).get(instance_ids[0])
+
+    def iter_autoscaling_instances(self, instance_ids=None, page_size=50):
+        """
+        Iterate the Auto Scaling instances, following the next token
+
+        :type instance_ids: list
+        :param instance_ids: EC2 instance ids, all the instances by default
+
+        :type page_size: int
+        :param page_size: the maximum number of instances in each page
+
+        :rtype: generator
+        :return: a generator of boto Instance objects
+        """
+        next_token = None
+        while True:
+            page = self.conn.get_all_autoscaling_instances(
+                instance_ids=instance_ids, max_records=page_size,
+                next_token=next_token)
+            for instance in page:
+                yield instance
+            next_token = page.next_token
+            if not next_token:
+                break
+
+    def load_instance_groups(self):
+        """
+        List all the Auto Scaling instances in the region
+
+        :rtype: dict
+        :return: a dict of instance id to the ASG name
+        """
+        return dict((instance.instance_id, instance.group_name)
+                    for instance in self.iter_autoscaling_instances())
+
+    def get_group_names_for_instances(self, instance_ids, cache=False,
+                                      chunk_size=50):
+        """
+        Get the ASG names of many instances
+
+        :type instance_ids: list
+        :param instance_ids: EC2 instance ids startwith 'i-xxxxxxx'
+
+        :type cache: bool
+        :param cache: whether to look up in the cached mapping of all
+            the instances, which is refreshed from a full listing
+            when it expires; the instances missing from it, e.g. launched
+            since, are still looked up by their ids
+
+        :type chunk_size: int
+        :param chunk_size: the number of instance ids in each request
+
+        :rtype: dict
+        :return: a dict of instance id to the ASG name,
+            or None if the instance is not in any ASG
+        """
+        instance_ids = self.to_list(instance_ids) or []
+        results = dict.fromkeys(instance_ids)
+        mapping = {}
+        if cache:
+            mapping = self.cache.get_or_load('instance_groups',
+                                             self.load_instance_groups)
+            for instance_id in instance_ids:
+                results[instance_id] = mapping.get(instance_id)
+            instance_ids = [instance_id for instance_id in instance_ids
+                            if instance_id not in mapping]
+
+        for i in xrange(0, len(instance_ids), chunk_size):
+            chunk = instance_ids[i:i + chunk_size]
+            for instance in self.iter_autoscaling_instances(chunk):
+                results[instance.instance_id] = instance.group_name
+                mapping[instance.instance_id] = instance.group_name
+        return results
+
+    def iter_all_groups(self, names=None, page_size=100):
+        """
+        Iterate the ASGs, following the next token
+
+        :type names: list
+        :param names: the ASG names, all the ASGs by default
 
-    def get_instances_from_group_name(self, name):
+        :type page_size: int
+        :param page_size: the maximum number of ASGs in each page
+
+        :rtype: generator
+        :return: a generator of boto AutoScalingGroup objects
+        """
+        next_token = None
+        while True:
+            page = self.conn.get_all_groups(names=names,
+                                            max_records=page_size,
+                                            next_token=next_token)
+            for group in page:
+                yield group
+            next_token = page.next_token
+            if not next_token:
+                break
+
+    def load_groups(self):
+        """
+        List all the ASGs in the region
+
+        :rtype: dict
+        :return: a dict of ASG name to the boto AutoScalingGroup object
+        """
+        return dict((group.name, group) for group in self.iter_all_groups())
+
+    def get_groups(self, names=None, cache=False):
+        """
+        Get the ASGs from their names
+
+        :type names: list
+        :param names: the ASG names, all the ASGs by default
+
+        :type cache: bool
+        :param cache: whether to look up in the cached state of all the
+            ASGs, which is refreshed from a full listing when it expires,
+            or after any change made through this object
+
+        :rtype: dict
+        :return: a dict of ASG name to the boto AutoScalingGroup object
+        """
+        if not cache:
+            return dict((group.name, group)
+                        for group in self.iter_all_groups(names))
+        groups = self.cache.get_or_load('groups', self.load_groups)
+        if names is None:
+            return dict(groups)
+        return dict((name, groups[name]) for name in names if name in groups)
+
+    def invalidate(self):
+        """
+        Drop the cached state of the ASGs and their instances
+        """
+        self.cache.invalidate('groups')
+        self.cache.invalidate('instance_groups')
+
+    def get_instances_from_groups(self, names=None, cache=False):
+        """
+        Get the instances of many ASGs at once
+
+        :type names: list
+        :param names: the ASG names, all the ASGs by default
+
+        :type cache: bool
+        :param cache: whether to look up in the cached state of the ASGs
+
+        :rtype: dict
+        :return: a dict of ASG name to the list of its instances
+        """
+        groups = self.get_groups(self.to_list(names), cache=cache)
+        return dict((name, list(group.instances))
+                    for name, group in groups.iteritems())
+
+    def get_instances_from_group_name(self, name, cache=False):
         """
         Get the instance from the specific ASG name
 
         :type name: string
         :param name: the specific ASG name
 
+        :type cache: bool
+        :param cache: whether to look up in the cached state of the ASGs
+
         :rtype: list
         :return: a list contains all the instances
         """
         instances = []
-        for group in self.conn.get_all_groups(names=self.to_list(name)):
+        for group in self.get_group_from_name(name, cache=cache):
             instances.extend(group.instances)
         return instances
 
-    def get_group_from_name(self, name):
+    def get_group_from_name(self, name, cache=False):
         """
         Get the ASG from its name
 
         :type name: string
         :param name: the ASG name
 
+        :type cache: bool
+        :param cache: whether to look up in the cached state of the ASGs
+
         :rtype: list
         :return: a list represents the specific ASG(s)
         """
-        return self.conn.get_all_groups(names=self.to_list(name))
+        names = self.to_list(name)
+        groups = self.get_groups(names, cache=cache)
+        if names is None:
+            return groups.values()
+        return [groups[n] for n in names if n in groups]
 
     def get_launch_config_from_name(self, name):
         """
@@ -172,6 +349,7 @@ class IcsAS(object):
         new_lc_name = launch_config.name
         group.__dict__["launch_config_name"] = launch_config.name
         group.update()
+        self.invalidate()
 
         if self.get_launch_config_from_name(new_lc_name):
             group = self.get_group_from_name(name)[0]
@@ -207,6 +385,7 @@ class IcsAS(object):
         if not isinstance(name, basestring):
             return None
         group = self.get_group_from_name(self.to_list(name))[0]
+        self.invalidate()
         return group.suspend_processes(self.to_list(scaling_processes))
 
     def resume_scaling_group(self, name, scaling_processes=None):
@@ -231,6 +410,7 @@ class IcsAS(object):
         if not isinstance(name, basestring):
             return None
         group = self.get_group_from_name(self.to_list(name))[0]
+        self.invalidate()
         return group.resume_processes(self.to_list(scaling_processes))
 
     def terminate_group_instance(self, instance_id, decrement_capacity=True):
@@ -245,6 +425,7 @@ class IcsAS(object):
         :param decrement_capacity: Whether to decrement the size of the
             autoscaling group or not.
         """
+        self.invalidate()
         return self.conn.terminate_instance(
             instance_id=instance_id,
             decrement_capacity=decrement_capacity)
@@ -269,6 +450,7 @@ class IcsAS(object):
             the grace period associated with the group.
         """
 
+        self.invalidate()
         self.conn.set_instance_health(instance_id, health_status,
                                       should_respect_grace_period=grace_period)
 
@@ -288,18 +470,81 @@ class RawAS(object):
         self.service, self.endpoint = init_botocore_service(
             self.name, self.region)
 
+    def iter_group_pages(self, names=None, page_size=100):
+        """
+        Fetch the Auto-Scaling Groups page by page, following NextToken
+
+        :type names: list
+        :param names: the names of groups to fetch, all groups by default
+
+        :type page_size: int
+        :param page_size: the maximum number of groups in each page
+
+        :rtype: generator
+        :return: a generator of (http_response, data) for each page
+        """
+        cmd = "DescribeAutoScalingGroups"
+        params = {'MaxRecords': page_size}
+        if names:
+            params['AutoScalingGroupNames'] = names
+        while True:
+            kwargs = keyname_formatd(params)
+            kwargs.update({'endpoint': self.endpoint})
+            response = operate(self.service, cmd, kwargs)
+            data = self.handle_response(response)
+            yield response[0], data
+            token = data.get('NextToken')
+            if not token:
+                break
+            params['NextToken'] = token
+
+    def iter_groups(self, names=None, page_size=100):
+        """
+        Iterate the Auto-Scaling Groups one at a time, across all pages
+
+        :type names: list
+        :param names: the names of groups to fetch, all groups by default
+
+        :type page_size: int
+        :param page_size: the maximum number of groups in each page
+
+        :rtype: generator
+        :return: a generator of JSON objects for each Auto-Scaling Group
+        """
+        for status, data in self.iter_group_pages(names, page_size):
+            for group in data.get('AutoScalingGroups', []):
+                yield group
+
     def fetch_all_groups(self):
         """
         Fetch all the Auto-Scaling Groups
 
-        :rtype: dict
-        :return: JSON object for all the Auto-Scaling Groups
+        :rtype: tuple
+        :return: a tuple containing (http_response, data), where data is
+            the JSON object for all the Auto-Scaling Groups of all pages
         """
-        endpoint = {'endpoint': self.endpoint}
-        cmd = "DescribeAutoScalingGroups"
-        return operate(self.service, cmd, endpoint)
+        status, groups = None, []
+        for status, data in self.iter_group_pages():
+            groups.extend(data.get('AutoScalingGroups', []))
+        return status, {'AutoScalingGroups': groups}
+
+    def iter_find_groups(self, filter={}):
+        """
+        Find the names of Auto-Scaling Groups in the filters, streaming
+        over all the groups page by page
+
+        :type filter: dict
+        :param filter: a dictionary to used for resource filtering,
+            see :meth:`find_groups`
 
-    def find_groups(self, filter={}):
+        :rtype: generator
+        :return: a generator of the names of filtered groups
+        """
+        names = ["AutoScalingGroupName", "LaunchConfigurationName"]
+        return iter_resource_from_json(names, filter=filter,
+                                       items=self.iter_groups())
+
+    def find_groups(self, filter={}, limit=None):
         """
         Find the names of Auto-Scaling Groups in the filters
 
@@ -318,13 +563,28 @@ class RawAS(object):
               ]
             }
 
+        :type limit: int
+        :param limit: stop fetching once this number of groups found
+
         :rtype: list
         :return: a list containing all the names of filtered groups
         """
-        names = ["AutoScalingGroupName", "LaunchConfigurationName"]
-        status, raw_data = self.fetch_all_groups()
-        return filter_resource_from_json(names, filter=filter,
-                                         raw_data=raw_data)
+        return list(islice(self.iter_find_groups(filter), limit))
+
+    def find_group(self, filter={}):
+        """
+        Find the name of the first Auto-Scaling Group in the filters
+
+        :type filter: dict
+        :param filter: a dictionary to used for resource filtering,
+            see :meth:`find_groups`
+
+        :rtype: tuple
+        :return: the names of the first filtered group, or None
+        """
+        for names in self.iter_find_groups(filter):
+            return names
+        return None
 
     def handle_response(self, response):
         """
@@ -670,54 +930,179 @@ class RawAS(object):
         else:
             return False
 
-    def new_scaling_policy(self, scaling_policy, metric_alarm):
+    def launch_groups(self, groups, depends=None, workers=4):
         """
-        Create a new Scaling Policy
+        Launch many new Auto-Scaling Groups concurrently
+
+        :type groups: list
+        :param groups: a list of (group_config, launch_config) tuples
+
+        :type depends: dict
+        :param depends: a dict of group name to the list of group names
+            it depends on, which have to be launched first
+
+        :type workers: int
+        :param workers: the number of groups launched at the same time
+
+        :rtype: dict
+        :return: a dict of group name to the
+            :class:`opslib.icsutils.parallel.TaskResult`, which records
+            the error and the time taken for this group
+        """
+        configs = {}
+        for group_config, launch_config in groups:
+            configs[group_config['AutoScalingGroupName']] = (group_config,
+                                                             launch_config)
+
+        def launch(name):
+            if not self.launch_group(*configs[name]):
+                raise IcsASException(
+                    "failed to launch auto-scaling group '%s'" % name)
+            return True
+
+        return run_ordered(launch, configs.keys(), depends=depends,
+                           workers=workers)
+
+    def kill_groups(self, names, force=False, depends=None, workers=4):
+        """
+        Delete many Auto-Scaling Groups concurrently
+
+        :type names: list
+        :param names: a list of auto-scaling group names
+
+        :type force: boolean
+        :param force: whether to delete the auto-scaling groups forcely
+
+        :type depends: dict
+        :param depends: a dict of group name to the list of group names
+            it depends on, as in :meth:`launch_groups`; a group is only
+            deleted after all the groups depending on it
+
+        :type workers: int
+        :param workers: the number of groups deleted at the same time
+
+        :rtype: dict
+        :return: a dict of group name to the
+            :class:`opslib.icsutils.parallel.TaskResult`
+        """
+        dependents = {}
+        for name, deps in (depends or {}).iteritems():
+            for dep in deps:
+                dependents.setdefault(dep, []).append(name)
+
+        def kill(name):
+            if not self.kill_group(name, force=force):
+                raise IcsASException(
+                    "failed to delete auto-scaling group '%s'" % name)
+            return True
+
+        return run_ordered(kill, names, depends=dependents, workers=workers)
+
+    def get_cloudwatch(self):
+        """
+        Get the botocore cloudwatch service and endpoint in this region
+        """
+        # FIXME: special here, just for cloudwatch service
+        return init_botocore_service("cloudwatch", self.region)
+
+    def put_scaling_policy(self, scaling_policy):
+        """
+        Create or update a Scaling Policy
 
         :type scaling_policy: dict
         :param scaling_policy: scaling policy configuration
 
+        :rtype: string
+        :return: the ARN of this scaling policy
+        """
+        endpoint = {'endpoint': self.endpoint}
+        cmd = "PutScalingPolicy"
+        params = fetch_used_params(self.name, cmd, scaling_policy)
+        params.update(endpoint)
+        data = self.handle_response(operate(self.service, cmd, params))
+        return data['PolicyARN']
+
+    def put_metric_alarm(self, metric_alarm, policy_arn=None):
+        """
+        Create or update a Metric Alarm
+
         :type metric_alarm: dict
         :param metric_alarm: metric alarm configuration
+
+        :type policy_arn: string
+        :param policy_arn: the ARN of the scaling policy to add
+            in the alarm actions
+        """
+        name = "cloudwatch"
+        service, endpoint = self.get_cloudwatch()
+        endpoint = {'endpoint': endpoint}
+        cmd = "PutMetricAlarm"
+        if policy_arn is not None:
+            metric_alarm = dict(metric_alarm)
+            actions = list(metric_alarm.get('AlarmActions', []))
+            if policy_arn not in actions:
+                actions.append(policy_arn)
+            metric_alarm['AlarmActions'] = actions
+        params = fetch_used_params(name, cmd, metric_alarm)
+        params.update(endpoint)
+        self.handle_response(operate(service, cmd, params))
+
+    def remove_scaling_policy(self, scaling_policy):
+        """
+        Delete a Scaling Policy
+
+        :type scaling_policy: dict
+        :param scaling_policy: scaling policy configuration
         """
-        result = 0
         endpoint = {'endpoint': self.endpoint}
-        cmd = "PutScalingPolicy"
+        cmd = "DeletePolicy"
         params = fetch_used_params(self.name, cmd, scaling_policy)
         params.update(endpoint)
+        self.handle_response(operate(self.service, cmd, params))
+
+    def delete_metric_alarms(self, alarm_names):
+        """
+        Delete the Metric Alarms in one request (at most 100)
+
+        :type alarm_names: list
+        :param alarm_names: the names of metric alarms
+        """
+        name = "cloudwatch"
+        service, endpoint = self.get_cloudwatch()
+        endpoint = {'endpoint': endpoint}
+        cmd = "DeleteAlarms"
+        params = fetch_used_params(name, cmd, {'AlarmNames': alarm_names})
+        params.update(endpoint)
+        self.handle_response(operate(service, cmd, params))
+
+    def new_scaling_policy(self, scaling_policy, metric_alarm):
+        """
+        Create a new Scaling Policy
+
+        :type scaling_policy: dict
+        :param scaling_policy: scaling policy configuration
+
+        :type metric_alarm: dict
+        :param metric_alarm: metric alarm configuration
+        """
         log.info("create the scaling policy")
         log.info(">> %s" % scaling_policy["PolicyName"])
         try:
-            data = self.handle_response(operate(self.service, cmd, params))
+            policy_arn = self.put_scaling_policy(scaling_policy)
         except Exception, e:
             log.error(e)
-        else:
-            log.info("OK")
-            result += 1
+            return False
+        log.info("OK")
 
-        policy_arn = data['PolicyARN']
-        # FIXME: special here, just for cloudwatch service
-        name = "cloudwatch"
-        service, endpoint = init_botocore_service(name, self.region)
-        endpoint = {'endpoint': endpoint}
-        cmd = "PutMetricAlarm"
-        metric_alarm['AlarmActions'].append(policy_arn)
-        params = fetch_used_params(name, cmd, metric_alarm)
-        params.update(endpoint)
         log.info("create the associated metric alarm")
         log.info(">> %s" % metric_alarm["AlarmName"])
         try:
-            self.handle_response(operate(service, cmd, params))
+            self.put_metric_alarm(metric_alarm, policy_arn)
         except Exception, e:
             log.error(e)
-        else:
-            log.info("OK")
-            result += 1
-
-        if result == 2:
-            return True
-        else:
             return False
+        log.info("OK")
+        return True
 
     def delete_scaling_policy(self, scaling_policy, metric_alarm):
         """
@@ -730,32 +1115,20 @@ class RawAS(object):
         :param metric_alarm: metric alarm configuration
         """
         result = 0
-        endpoint = {'endpoint': self.endpoint}
-        cmd = "DeletePolicy"
-        params = fetch_used_params(self.name, cmd, scaling_policy)
-        params.update(endpoint)
         log.info("delete the scaling policy")
         log.info(">> %s" % scaling_policy["PolicyName"])
         try:
-            self.handle_response(operate(self.service, cmd, params))
+            self.remove_scaling_policy(scaling_policy)
         except Exception, e:
             log.error(e)
         else:
             log.info("OK")
             result += 1
 
-        # FIXME: special here, just for cloudwatch service
-        name = "cloudwatch"
-        service, endpoint = init_botocore_service(name, self.region)
-        endpoint = {'endpoint': endpoint}
-        cmd = "DeleteAlarms"
-        metric_alarm['AlarmNames'] = [metric_alarm['AlarmName']]
-        params = fetch_used_params(name, cmd, metric_alarm)
-        params.update(endpoint)
         log.info("delete the associated metric alarm")
         log.info(">> %s" % metric_alarm["AlarmName"])
         try:
-            self.handle_response(operate(service, cmd, params))
+            self.delete_metric_alarms([metric_alarm['AlarmName']])
         except Exception, e:
             log.error(e)
         else:
@@ -767,4 +1140,99 @@ class RawAS(object):
         else:
             return False
 
+    def new_scaling_policies(self, policies, workers=4, rate=5, tries=3):
+        """
+        Create many Scaling Policies with their Metric Alarms concurrently
+
+        All the requests share one rate limit, and a request is retried
+        with backoff when it fails, e.g. throttled.
+
+        :type policies: list
+        :param policies: a list of (scaling_policy, metric_alarm) tuples
+
+        :type workers: int
+        :param workers: the number of concurrent requests
+
+        :type rate: float
+        :param rate: the maximum number of requests per second
+
+        :type tries: int
+        :param tries: how many times to try each request
+
+        :rtype: list
+        :return: a list of :class:`opslib.icsutils.parallel.TaskResult`
+            in the order of the policies, with the policy ARN as result
+        """
+        limiter = RateLimiter(rate)
+        retry = Retry(tries, exceptions=IcsException)
+        put_policy = retry(limiter.wrap(self.put_scaling_policy))
+        put_alarm = retry(limiter.wrap(self.put_metric_alarm))
+
+        def create(policy):
+            scaling_policy, metric_alarm = policy
+            policy_arn = put_policy(scaling_policy)
+            put_alarm(metric_alarm, policy_arn)
+            return policy_arn
+
+        results = run_parallel(create, policies, workers=workers)
+        for result in results:
+            if not result.ok:
+                log.error("failed to create the scaling policy '%s': %s" %
+                          (result.item[0]["PolicyName"], result.error))
+        log.info("%s of %s scaling policies created" %
+                 (len([r for r in results if r.ok]), len(results)))
+        return results
+
+    def delete_scaling_policies(self, policies, workers=4, rate=5, tries=3,
+                                batch_size=100):
+        """
+        Delete many Scaling Policies concurrently, and their Metric Alarms
+        in batches
+
+        :type policies: list
+        :param policies: a list of (scaling_policy, metric_alarm) tuples
+
+        :type workers: int
+        :param workers: the number of concurrent requests
+
+        :type rate: float
+        :param rate: the maximum number of requests per second
+
+        :type tries: int
+        :param tries: how many times to try each request
+
+        :type batch_size: int
+        :param batch_size: the number of alarms deleted in each request
+
+        :rtype: list
+        :return: a list of :class:`opslib.icsutils.parallel.TaskResult`
+            in the order of the policies
+        """
+        limiter = RateLimiter(rate)
+        retry = Retry(tries, exceptions=IcsException)
+        delete_policy = retry(limiter.wrap(self.remove_scaling_policy))
+        delete_alarms = retry(limiter.wrap(self.delete_metric_alarms))
+
+        results = run_parallel(lambda policy: delete_policy(policy[0]),
+                               policies, workers=workers)
+
+        names = [policy[1]['AlarmName'] for policy in policies]
+        batches = [names[i:i + batch_size]
+                   for i in xrange(0, len(names), batch_size)]
+        errors = {}
+        for batch in run_parallel(delete_alarms, batches, workers=workers):
+            if not batch.ok:
+                errors.update((name, batch.error) for name in batch.item)
+
+        for result in results:
+            scaling_policy, metric_alarm = result.item
+            if result.ok and metric_alarm['AlarmName'] in errors:
+                result.error = errors[metric_alarm['AlarmName']]
+            if not result.ok:
+                log.error("failed to delete the scaling policy '%s': %s" %
+                          (scaling_policy["PolicyName"], result.error))
+        log.info("%s of %s scaling policies deleted" %
+                 (len([r for r in results if r.ok]), len(results)))
+        return results
+
 # vim: tabstop=4 shiftwidth=4 softtabstop=4
@@ -258,6 +258,27 @@ class IcsEc2(EC2Connection):
         else:
             return False
 
+    def get_instances_status(self, instance_ids):
+        """
+        Get the instance status and system status
+            of the specified instances in one request
+
+        :type instance_ids: list
+        :param instance_ids: a list of EC2 instance ids
+
+        :rtype: dict
+        :return: a dict of instance id to (instance_status, system_status),
+            instances without status are missing in this dict
+        """
+        results = {}
+        if not instance_ids:
+            return results
+        for status in self.get_all_instance_status(
+                instance_ids=instance_ids):
+            results[status.id] = (status.instance_status.status,
+                                  status.system_status.status)
+        return results
+
     def is_eip_free(self, eip):
         """
         check the availability of the specified EIP address: free or not
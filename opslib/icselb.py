@@ -7,13 +7,81 @@ IcsELB: Library for ELB
 +--------------------+------------+--+
 """
 
+import time
+
 import opslib
 from boto.ec2.elb import connect_to_region
 from boto.ec2.elb import HealthCheck
+from boto.exception import BotoServerError
+from opslib.icsutils.misc import wait_for
+from opslib.icsutils.parallel import run_parallel
+from opslib.icsutils.cache import TTLCache
+from opslib.icsexception import IcsELBException
 
 import logging
 log = logging.getLogger(__name__)
 
+# Load balancer descriptors shared by all IcsELB objects in this process,
+# keyed by (access key, region, name); (access key, region, None) marks
+# that all the load balancers of this region have been listed
+_descriptors = TTLCache()
+
+# listener string to its parsed tuple, shared by all IcsELB objects
+_parsed_listeners = {}
+
+
+def describe_elb(lb):
+    """
+    Convert a boto LoadBalancer object into a descriptor
+
+    :type lb: class
+    :param lb: boto.ec2.elb.loadbalancer.LoadBalancer
+
+    :rtype: dict
+    :return: a dict containing the name, hosted zone id, DNS name,
+        listeners and attached instance ids of this load balancer
+    """
+    listeners = []
+    for l in lb.listeners:
+        if l.protocol.upper() == 'HTTPS' or l.ssl_certificate_id:
+            listeners.append((l.load_balancer_port, l.instance_port,
+                              l.protocol, l.ssl_certificate_id))
+        else:
+            listeners.append((l.load_balancer_port, l.instance_port,
+                              l.protocol))
+    return {'name': lb.name,
+            'hosted_zone_id': lb.canonical_hosted_zone_name_id,
+            'dns_name': lb.dns_name,
+            'listeners': listeners,
+            'instances': [i.id for i in lb.instances]}
+
+
+def parse_listener(listener):
+    """
+    Parse one listener string "<elb port>,<instance port>,<protocol>"
+    with the certificate ARN appended for HTTPS and SSL
+
+    :type listener: string
+    :param listener: the listener string, like "443,80,HTTPS,arn:..."
+
+    :rtype: tuple
+    :return: the listener tuple, or None if not valid
+    """
+    fields = [f.strip() for f in listener.split(",")]
+    try:
+        elb_port, instance_port = int(fields[0]), int(fields[1])
+        protocol = fields[2]
+    except (IndexError, ValueError):
+        return None
+    cert = ",".join(fields[3:])
+    if protocol.upper() in ('HTTPS', 'SSL'):
+        if not cert:
+            return None
+        return (elb_port, instance_port, protocol, cert)
+    if protocol.upper() not in ('HTTP', 'TCP') or cert:
+        return None
+    return (elb_port, instance_port, protocol)
+
 
 class IcsELB(object):
 
@@ -21,8 +89,90 @@ class IcsELB(object):
     ICS Library for ELB
     """
 
-    def __init__(self, region, **kwargs):
+    def __init__(self, region, cache_ttl=300, **kwargs):
+        """
+        :type region: string
+        :param region: the region name
+
+        :type cache_ttl: int
+        :param cache_ttl: how many seconds the load balancer descriptors
+            are cached
+        """
         self.conn = connect_to_region(region, **kwargs)
+        self.region = region
+        self.cache_ttl = cache_ttl
+        self._cache_key = (kwargs.get('aws_access_key_id'), region)
+
+    def iter_all_elbs(self):
+        """
+        Iterate all the load balancers in this region, following the marker
+
+        :rtype: generator
+        :return: a generator of boto.ec2.elb.loadbalancer.LoadBalancer
+        """
+        marker = None
+        while True:
+            page = self.conn.get_all_load_balancers(marker=marker)
+            for lb in page:
+                yield lb
+            marker = getattr(page, 'next_marker', None)
+            if not marker:
+                break
+
+    def load_elb_descriptors(self):
+        """
+        List all the load balancers in this region into the cache
+        """
+        for lb in self.iter_all_elbs():
+            _descriptors.set(self._cache_key + (lb.name,), describe_elb(lb),
+                             self.cache_ttl)
+        _descriptors.set(self._cache_key + (None,), True, self.cache_ttl)
+
+    def get_elb_descriptor(self, name):
+        """
+        Get the descriptor of the load balancer from the cache, which is
+        filled by listing all the load balancers in this region
+
+        :type name: str
+        :param name: The load balances name
+
+        :rtype: dict
+        :return: a dict described in :func:`describe_elb`
+        """
+        key = self._cache_key + (name,)
+        descriptor = _descriptors.get(key)
+        if descriptor is not None:
+            return descriptor
+        if self._cache_key + (None,) not in _descriptors:
+            self.load_elb_descriptors()
+            descriptor = _descriptors.get(key)
+            if descriptor is not None:
+                return descriptor
+
+        # Created or changed since the region was listed
+        try:
+            record = self.conn.get_all_load_balancers(name)
+        except BotoServerError, e:
+            raise IcsELBException(e)
+        if not record:
+            raise IcsELBException("Cannot find this elb: %s" % name)
+        descriptor = describe_elb(record[0])
+        _descriptors.set(key, descriptor, self.cache_ttl)
+        return descriptor
+
+    def invalidate(self, name=None):
+        """
+        Drop the cached descriptor of the load balancer
+
+        :type name: str
+        :param name: The load balances name, all the load balancers in
+            this region if None
+        """
+        if name is not None:
+            _descriptors.invalidate(self._cache_key + (name,))
+        else:
+            _descriptors.invalidate_matching(
+                lambda key: key[:2] == self._cache_key)
 
     def get_elb_id(self, name):
         """
@@ -35,8 +185,7 @@ class IcsELB(object):
         :retrun: load balancer hosted zone id
         """
 
-        record = self.conn.get_all_load_balancers(name)
-        return record[0].canonical_hosted_zone_name_id
+        return self.get_elb_descriptor(name)['hosted_zone_id']
 
     def get_elb_dns_name(self, name):
         """
@@ -48,8 +197,34 @@ class IcsELB(object):
         :retrun: load balancer hosted zone id
         """
 
-        record = self.conn.get_all_load_balancers(name)
-        return record[0].dns_name
+        return self.get_elb_descriptor(name)['dns_name']
+
+    def get_elb_listeners(self, name):
+        """
+        Get Load Balancer listeners.
+
+        :type name: str
+        :param name: The load balances name
+
+        :rtype: list
+        :return: a list of listener tuples, like the ones returned by
+            :meth:`parse_listeners`
+        """
+
+        return self.get_elb_descriptor(name)['listeners']
+
+    def get_elb_instances(self, name):
+        """
+        Get the instances attached to the Load Balancer.
+
+        :type name: str
+        :param name: The load balances name
+
+        :rtype: list
+        :return: a list of EC2 instance ids
+        """
+
+        return self.get_elb_descriptor(name)['instances']
 
     def get_elb_health(self, name, instance_id):
         """
@@ -69,18 +244,230 @@ class IcsELB(object):
 
         try:
             elb = self.conn.describe_instance_health(name, instances=id_list)
-        except Exception:
-            return 'Cannot find this elb: %s' % name
+        except BotoServerError, e:
+            if e.error_code == 'LoadBalancerNotFound':
+                return 'Cannot find this elb: %s' % name
+            elif e.error_code == 'InvalidInstance':
+                return 'Cannot find this instance in elb %s: %s' % (
+                    name, instance_id)
+            raise IcsELBException(e)
 
         if elb[0].state == 'InService':
             return False
         else:
             return elb[0].description
 
+    def get_instances_health(self, name, instance_ids=None):
+        """
+        Get the state of the instances in the specified elb in one request
+
+        :type name: string
+        :param name: The load balances name
+
+        :type instance_ids: list
+        :param instance_ids: a list of EC2 instance ids,
+            all the instances of this elb by default
+
+        :rtype: dict
+        :return: a dict of instance id to its state, like 'InService'
+        """
+        states = self.conn.describe_instance_health(name,
+                                                    instances=instance_ids)
+        return dict((state.instance_id, state.state) for state in states)
+
+    def get_elbs_health(self, names, workers=8):
+        """
+        Get the state of all the instances in many elbs, with one request
+        for each elb and the elbs requested in parallel
+
+        :type names: list
+        :param names: The load balances names
+
+        :type workers: int
+        :param workers: the number of concurrent requests
+
+        :rtype: dict
+        :return: a dict of elb name to the
+            :class:`opslib.icsutils.parallel.TaskResult`, whose result is
+            a dict of instance id to its state
+        """
+        results = run_parallel(self.get_instances_health, names,
+                               workers=workers)
+        for result in results:
+            if not result.ok:
+                log.error("failed to get the health of elb '%s': %s" %
+                          (result.item, result.error))
+        return dict((result.item, result) for result in results)
+
+    def watch(self, name, until='InService', deadline=300,
+              instance_ids=None, interval=2, max_interval=30):
+        """
+        Watch the instances in the elb until they are all in the
+        expected state, polling with exponential backoff
+
+        :type name: string
+        :param name: The load balances name
+
+        :type until: string
+        :param until: the expected state, 'InService' or 'OutOfService'
+
+        :type deadline: int
+        :param deadline: how many seconds to watch at most
+
+        :type instance_ids: list
+        :param instance_ids: a list of EC2 instance ids,
+            all the instances of this elb by default
+
+        :type interval: int
+        :param interval: the first polling interval in seconds, which is
+            doubled while nothing changes and reset on any change
+
+        :type max_interval: int
+        :param max_interval: the maximum polling interval in seconds
+
+        :rtype: dict
+        :return: a dict containing whether the state is reached,
+            the last states, the elapsed time and the transitions as a
+            list of (seconds since start, instance id, old state, new state)
+        """
+        start = time.time()
+        states = {}
+        transitions = []
+        wait = interval
+        while True:
+            current = self.get_instances_health(name, instance_ids)
+            elapsed = time.time() - start
+            changed = False
+            for instance_id, state in current.iteritems():
+                if states.get(instance_id) != state:
+                    transitions.append((elapsed, instance_id,
+                                        states.get(instance_id), state))
+                    changed = True
+            states = current
+
+            reached = bool(states) and \
+                all(state == until for state in states.itervalues())
+            if reached or elapsed + wait > deadline:
+                break
+            if changed:
+                wait = interval
+            time.sleep(wait)
+            wait = min(wait * 2, max_interval)
+
+        return {'reached': reached,
+                'states': states,
+                'transitions': transitions,
+                'elapsed': time.time() - start}
+
+    def _update_instances(self, action, names, instance_ids, wait, timeout,
+                          workers, batch_size):
+        """
+        Register or deregister the instances in batches, for each elb in
+        parallel, and wait for the instances to be in the expected state
+        """
+        if isinstance(names, basestring):
+            names = [names]
+        batches = [instance_ids[i:i + batch_size]
+                   for i in xrange(0, len(instance_ids), batch_size)]
+
+        def update(name):
+            for batch in batches:
+                if action == 'register':
+                    self.conn.register_instances(name, batch)
+                else:
+                    self.conn.deregister_instances(name, batch)
+            self.invalidate(name)
+            if not wait:
+                return True
+
+            if action == 'register':
+                check = lambda: all(
+                    state == 'InService' for state in
+                    self.get_instances_health(name, instance_ids).values())
+            else:
+                check = lambda: not set(instance_ids).intersection(
+                    self.get_instances_health(name).keys())
+            if not wait_for(check, timeout=timeout):
+                raise IcsELBException("instances not %sed in elb '%s' "
+                                      "in %ss" % (action, name, timeout))
+            return True
+
+        results = run_parallel(update, names, workers=workers)
+        for result in results:
+            if not result.ok:
+                log.error("failed to %s instances in elb '%s': %s" %
+                          (action, result.item, result.error))
+        return dict((result.item, result) for result in results)
+
+    def register_instances(self, names, instance_ids, wait=False,
+                           timeout=300, workers=8, batch_size=100):
+        """
+        Register the instances with one or many load balancers
+
+        :type names: string or list
+        :param names: The load balances name(s)
+
+        :type instance_ids: list
+        :param instance_ids: a list of EC2 instance ids
+
+        :type wait: bool
+        :param wait: whether to wait until all the instances are
+            'InService', polling with exponential backoff
+
+        :type timeout: int
+        :param timeout: how many seconds to wait at most
+
+        :type workers: int
+        :param workers: the number of load balancers updated in parallel
+
+        :type batch_size: int
+        :param batch_size: the number of instances in each request
+
+        :rtype: dict
+        :return: a dict of elb name to the
+            :class:`opslib.icsutils.parallel.TaskResult`
+        """
+        return self._update_instances('register', names, instance_ids,
+                                      wait, timeout, workers, batch_size)
+
+    def deregister_instances(self, names, instance_ids, wait=False,
+                             timeout=300, workers=8, batch_size=100):
+        """
+        Deregister the instances from one or many load balancers
+
+        :type names: string or list
+        :param names: The load balances name(s)
+
+        :type instance_ids: list
+        :param instance_ids: a list of EC2 instance ids
+
+        :type wait: bool
+        :param wait: whether to wait until none of the instances is
+            reported by the load balancer, e.g. after connection draining
+
+        :type timeout: int
+        :param timeout: how many seconds to wait at most
+
+        :type workers: int
+        :param workers: the number of load balancers updated in parallel
+
+        :type batch_size: int
+        :param batch_size: the number of instances in each request
+
+        :rtype: dict
+        :return: a dict of elb name to the
+            :class:`opslib.icsutils.parallel.TaskResult`
+        """
+        return self._update_instances('deregister', names, instance_ids,
+                                      wait, timeout, workers, batch_size)
+
     def parse_listeners(self, listeners):
         """
         Parse elb listeners form list of string to list of tuple
 
+        All the listeners are validated at once, see :func:`parse_listener`,
+        so that nothing is changed if any of them is invalid.
+
         :param listeners: Listeners of this elb
         :type listeners: list of string
 
@@ -89,15 +476,118 @@ class IcsELB(object):
         """
 
         l_list = []
+        invalid = []
         for l in listeners:
-            l = l.split(",")
-            if l[2] == 'HTTPS':
-                l_list.append((int(l[0]), int(l[1]), l[2], l[3]))
-            else:
-                l_list.append((int(l[0]), int(l[1]), l[2]))
-
+            parsed = _parsed_listeners.get(l)
+            if parsed is None:
+                parsed = parse_listener(l)
+                if parsed is None:
+                    invalid.append(l)
+                    continue
+                _parsed_listeners[l] = parsed
+            l_list.append(parsed)
+        if invalid:
+            raise IcsELBException("Invalid listeners: %s" % invalid)
+
+        ports = [l[0] for l in l_list]
+        duplicated = sorted(set(p for p in ports if ports.count(p) > 1))
+        if duplicated:
+            raise IcsELBException("More than one listener on the ELB "
+                                  "ports: %s" % duplicated)
         return l_list
 
+    @staticmethod
+    def _listener_key(listener):
+        """
+        Normalize a listener tuple, so that the same listener always
+        compares equal whatever the case of its protocol
+        """
+        cert = listener[3] if len(listener) > 3 else None
+        return (int(listener[0]), int(listener[1]),
+                listener[2].upper(), cert or None)
+
+    def diff_listeners(self, name, desired):
+        """
+        Compare the listeners of an existing Load Balancer with the
+        desired ones
+
+        :param name: The name of the load balancer
+        :type name: string
+
+        :param desired: The desired listeners, see :meth:`parse_listeners`,
+            all validated before anything is compared
+        :type desired: list of string
+
+        :rtype: tuple
+        :return: a tuple containing (the list of listener tuples to be
+            created, the list of ELB ports to be removed)
+        """
+        current = dict((self._listener_key(l), l)
+                       for l in self.get_elb_listeners(name))
+        wanted = dict((self._listener_key(l), l)
+                      for l in self.parse_listeners(desired))
+        to_add = [wanted[k] for k in sorted(wanted) if k not in current]
+        to_remove = sorted(set(k[0] for k in current if k not in wanted))
+        return to_add, to_remove
+
+    def sync_listeners(self, name, desired):
+        """
+        Reconcile the listeners of an existing Load Balancer with the
+        desired ones, with one call to remove the extra or changed
+        listeners and one call to create the missing ones at most;
+        nothing is removed if any desired listener is invalid
+
+        :param name: The name of the load balancer
+        :type name: string
+
+        :param desired: The desired listeners, see :meth:`parse_listeners`
+        :type desired: list of string
+
+        :rtype: dict
+        :return: a dict containing the 'added' listener tuples and the
+            'removed' ELB ports, both empty if nothing changed
+        """
+        to_add, to_remove = self.diff_listeners(name, desired)
+        if not to_add and not to_remove:
+            log.debug("listeners of elb '%s' up to date" % name)
+            return {'added': [], 'removed': []}
+
+        if to_remove:
+            self.conn.delete_load_balancer_listeners(name, to_remove)
+        if to_add:
+            self.conn.create_load_balancer_listeners(name, listeners=to_add)
+        self.invalidate(name)
+        log.info("elb '%s': listeners added %s, ports removed %s" %
+                 (name, to_add, to_remove))
+        return {'added': to_add, 'removed': to_remove}
+
+    def sync_elbs_listeners(self, desired, workers=8):
+        """
+        Reconcile the listeners of many Load Balancers in parallel,
+        with all their current listeners listed at once
+
+        :param desired: a dict of elb name to its desired listeners
+        :type desired: dict
+
+        :type workers: int
+        :param workers: the number of load balancers updated in parallel
+
+        :rtype: dict
+        :return: a dict of elb name to the
+            :class:`opslib.icsutils.parallel.TaskResult` of
+            :meth:`sync_listeners`
+        """
+        if self._cache_key + (None,) not in _descriptors:
+            self.load_elb_descriptors()
+        results = run_parallel(
+            lambda name: self.sync_listeners(name, desired[name]),
+            desired.keys(), workers=workers)
+        for result in results:
+            if not result.ok:
+                log.error("failed to sync listeners of elb '%s': %s" %
+                          (result.item, result.error))
+        return dict((result.item, result) for result in results)
+
     def set_health_check(self, name, health_check):
         """
         Configures the health check behavior for the instances behind this
@@ -160,6 +650,7 @@ class IcsELB(object):
                                            scheme=scheme)
         else:
             self.conn.create_load_balancer(name, zones, l_list)
+        self.invalidate(name)
 
     def remove_elb_listeners(self, name, listeners):
         """
@@ -175,6 +666,7 @@ class IcsELB(object):
         """
 
         self.conn.delete_load_balancer_listeners(name, listeners)
+        self.invalidate(name)
 
     def set_elb_listeners(self, name, listeners):
         """
@@ -190,6 +682,7 @@ class IcsELB(object):
 
         l_list = self.parse_listeners(listeners)
         self.conn.create_load_balancer_listeners(name, listeners=l_list)
+        self.invalidate(name)
 
     def get_all_elbs(self, load_balancer_names=None):
         """
@@ -214,5 +707,6 @@ class IcsELB(object):
         """
 
         self.conn.delete_load_balancer(name)
+        self.invalidate(name)
 
 # vim: tabstop=4 shiftwidth=4 softtabstop=4
@@ -36,6 +36,13 @@ class IcsASException(IcsException):
     """
 
 
+class IcsELBException(IcsException):
+
+    """
+    Error for ELB request
+    """
+
+
 class IcsMetaException(IcsException):
 
     """
@@ -64,6 +71,13 @@ class IcsSNSException(IcsException):
     """
 
 
+class IcsSQSException(IcsException):
+
+    """
+    Errors processing ICS SQS request
+    """
+
+
 class IcsSysCfgException(IcsException):
 
     """
@@ -10,8 +10,14 @@ IcsLog: Library for Log
 import logging
 import fcntl
 import time
+import atexit
+import threading
+from Queue import Queue, Empty, Full
 from logging.handlers import RotatingFileHandler
 
+# Stops the writer thread of AsyncHandler
+_STOP = object()
+
 
 class NullHandler(logging.Handler):
 
@@ -19,13 +25,170 @@ class NullHandler(logging.Handler):
         pass
 
 
+class _Flush(object):
+
+    """
+    Marker queued by :meth:`AsyncHandler.flush`
+    """
+
+    def __init__(self):
+        self.done = threading.Event()
+
+
+class AsyncHandler(logging.Handler):
+
+    """
+    Handler queueing the records for a background thread, which writes
+    them in batches to the target handler, e.g. a RotatingFileHandler
+
+    The callers only format the message and queue the record.  When the
+    queue is full, the records are dropped, or the callers wait if
+    ``block`` is True.  The queued records are written when the process
+    exits.
+    """
+
+    def __init__(self, target, queue_size=10000, block=False,
+                 batch_size=100, lock_file=None):
+        """
+        :type target: class
+        :param target: the handler writing the records
+
+        :type queue_size: int
+        :param queue_size: the number of records waiting to be written
+
+        :type block: bool
+        :param block: whether to wait, instead of dropping the records,
+            when the queue is full
+
+        :type batch_size: int
+        :param batch_size: the number of records written at once
+
+        :type lock_file: string
+        :param lock_file: the file locked while writing each batch, shared
+            with the other processes writing the same log file
+        """
+        logging.Handler.__init__(self)
+        self.target = target
+        self.block = block
+        self.batch_size = batch_size
+        self.lock_file = lock_file
+        self.dropped = 0
+        self.queue = Queue(maxsize=queue_size)
+        self._fp = None
+        self._closed = False
+        self._thread = threading.Thread(target=self._run)
+        self._thread.setDaemon(True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    def emit(self, record):
+        try:
+            # Merge the arguments and the traceback now, as they may
+            # change or be released before the record is written
+            record.msg = record.getMessage()
+            record.args = None
+            if record.exc_info:
+                record.exc_text = logging.Formatter().formatException(
+                    record.exc_info)
+                record.exc_info = None
+        except Exception:
+            self.handleError(record)
+            return
+        if self.block:
+            self.queue.put(record)
+            return
+        try:
+            self.queue.put_nowait(record)
+        except Full:
+            self.dropped += 1
+
+    def _write(self, records):
+        if not records:
+            return
+        if self.lock_file is not None:
+            if self._fp is None:
+                self._fp = open(self.lock_file, 'w')
+            fcntl.flock(self._fp, fcntl.LOCK_EX)
+        try:
+            for record in records:
+                self.target.handle(record)
+            self.target.flush()
+        except Exception:
+            # Keep the writer thread alive whatever the target raises
+            self.handleError(records[-1])
+        finally:
+            if self._fp is not None:
+                fcntl.flock(self._fp, fcntl.LOCK_UN)
+
+    def _run(self):
+        stopped = False
+        while not stopped:
+            items = [self.queue.get()]
+            while len(items) < self.batch_size:
+                try:
+                    items.append(self.queue.get_nowait())
+                except Empty:
+                    break
+            records = []
+            for item in items:
+                if item is _STOP:
+                    stopped = True
+                elif isinstance(item, _Flush):
+                    self._write(records)
+                    records = []
+                    item.done.set()
+                else:
+                    records.append(item)
+            self._write(records)
+
+    def flush(self, timeout=30):
+        """
+        Wait until all the queued records are written
+        """
+        if not self._thread.isAlive():
+            return
+        marker = _Flush()
+        try:
+            self.queue.put(marker, timeout=timeout)
+        except Full:
+            return
+        marker.done.wait(timeout)
+
+    def close(self):
+        """
+        Write the queued records, stop the writer thread and close the
+        target handler
+        """
+        if self._closed:
+            return
+        self._closed = True
+        if self._thread.isAlive():
+            try:
+                self.queue.put(_STOP, timeout=30)
+            except Full:
+                pass
+            self._thread.join(30)
+        if self.dropped:
+            self.target.handle(logging.makeLogRecord({
+                'name': __name__, 'levelno': logging.WARNING,
+                'levelname': 'WARNING',
+                'msg': "%s log records dropped as the queue was full"
+                       % self.dropped}))
+        self.target.close()
+        if self._fp is not None:
+            self._fp.close()
+            self._fp = None
+        logging.Handler.close(self)
+
+
 class IcsLog(object):
 
     """
     ICS Log Library
     """
 
-    def __init__(self, name, console=True, logfile=None, level="DEBUG"):
+    def __init__(self, name, console=True, logfile=None, level="DEBUG",
+                 asynchronous=False, queue_size=10000, block=False):
         """
         Initialize the Ics Log
 
@@ -40,6 +203,17 @@ class IcsLog(object):
         :type logfile: string
         :param logfile: the file to save the logs
 
+        :type asynchronous: bool
+        :param asynchronous: whether to write the logs to the file in a
+            background thread, see :class:`AsyncHandler`
+
+        :type queue_size: int
+        :param queue_size: the number of logs waiting to be written
+
+        :type block: bool
+        :param block: whether to wait when the queue is full, \
+            the logs are dropped otherwise
+
         :rtype: class object
         :return: a log object
         """
@@ -50,6 +224,7 @@ class IcsLog(object):
         self._rotate_count = 5
         self._log_file = logfile
         self._console = console
+        self._async = asynchronous
         self._lock_file = None
         self._fp = None
         self._logger = logging.getLogger(name)
@@ -76,6 +251,12 @@ class IcsLog(object):
                 maxBytes=self._max_bytes,
                 backupCount=self._rotate_count)
             rotate_handler.setFormatter(formatter)
+            if self._async:
+                # The writer thread locks the file for each batch instead
+                rotate_handler = AsyncHandler(
+                    rotate_handler, queue_size=queue_size, block=block,
+                    lock_file=self._lock_file)
+                self._lock_file = None
             self._logger.addHandler(rotate_handler)
 
     def set_debug_level(self):
@@ -11,29 +11,129 @@ import os
 import re
 import json
 import time
+import tempfile
+import threading
 
 from boto import config
+from boto.s3.key import Key
 from boto.utils import get_instance_metadata as get_metadata
 from opslib.icss3 import IcsS3
 from opslib.icsec2 import IcsEc2
 from opslib.icsutils.misc import get_userdata
 from opslib.icsutils.misc import is_valid_ip
+from opslib.icsutils.misc import wait_for
+from opslib.icsutils.misc import write_file_atomic
+from opslib.icsutils.parallel import run_parallel
+from opslib.icsutils.profiler import profile_step
 from opslib.icsutils.utils import set_timezone, chmod, chownbyname
-from opslib.icsutils.utils import del_file, copy
+from opslib.icsutils.utils import del_file, md5sum
 from opslib.icsutils.icsalert import IcsAlert
 from opslib.icsexception import IcsMetaException, IcsS3Exception
 
 import logging
 log = logging.getLogger(__name__)
 
+# The directory suggested for the cache shared by the IcsMeta processes
+DEFAULT_CACHE_DIR = "/var/cache/opslib"
+
+# How many seconds each source is kept in the cache files by default
+DEFAULT_CACHE_TTLS = {'meta_data': 3600, 'user_data': 3600, 'tags': 300}
+
+# The meta-data keys read by IcsMeta, the only ones kept in the cache file;
+# the "iam" subtree with the role credentials is never written to disk
+CACHED_META_DATA_KEYS = ('instance-id', 'local-ipv4', 'placement',
+                         'public-hostname', 'public-ipv4', 'public-keys')
+
+# The id of the current boot, stored in each cache entry, so that the
+# entries written before a reboot or on another instance, e.g. baked into
+# an AMI, are never read
+BOOT_ID_PATH = "/proc/sys/kernel/random/boot_id"
+
+# The ETag of a plain upload, which is the MD5 of the object
+MD5_ETAG = re.compile(r'^[0-9a-f]{32}$')
+
+
+class _S3Key(Key):
+
+    """
+    S3 key keeping the algorithm of the customer-provided encryption key,
+    with which the ETag is not the MD5 of the object
+    """
+
+    customer_algorithm = None
+
+    def handle_addl_headers(self, headers):
+        header = 'x-amz-server-side-encryption-customer-algorithm'
+        for name, value in headers:
+            if name.lower() == header:
+                self.customer_algorithm = value
+
+
+def get_boot_id(path=BOOT_ID_PATH):
+    """
+    Get the id of the current boot
+
+    :rtype: string
+    :return: the boot id, or None if not available on this system
+    """
+    try:
+        with open(path) as fp:
+            return fp.read().strip() or None
+    except IOError:
+        return None
+
+
+def _md5_etag(key):
+    """
+    Get the MD5 of the S3 object from its ETag
+
+    :rtype: string
+    :return: the MD5, or None if the ETag is not a plain MD5, e.g. for
+        the multipart uploads ("<md5>-<parts>") and the objects encrypted
+        with KMS or a customer-provided key
+    """
+    etag = (key.etag or '').strip('"').lower()
+    if not MD5_ETAG.match(etag):
+        return None
+    if key.encrypted == 'aws:kms' or key.customer_algorithm:
+        return None
+    return etag
+
+
+def _source_property(name):
+    """
+    Property of :class:`IcsMeta` loading the source on first access
+    """
+    def getter(self):
+        return self._get_source(name)
+
+    def setter(self, value):
+        self._data[name] = value
+    return property(getter, setter)
+
 
 class IcsMeta(object):
 
+    # The sources loaded on first access, by the methods "_fetch_<source>"
+    SOURCES = ('meta_data', 'user_data', 'credentials', 'tags')
+
     def __init__(self, credentials=None, metadata=None,
-                 userdata=None, tags=None):
+                 userdata=None, tags=None, wait_tags=True, tags_timeout=120,
+                 cache_dir=None, cache_ttls=None, refresh=False):
         """
         Initialize Ics Meta (meta-data, user-data, credentials, tags)
 
+        Each of them is fetched on its first access; the meta-data and the
+        user-data are fetched concurrently when both are needed, e.g.
+        before the tags.
+
+        With a cache directory, the fetched meta-data, user-data and tags
+        are saved into files there, which are read by the following IcsMeta
+        objects, even in other processes, until they expire or the instance
+        reboots, see :data:`BOOT_ID_PATH`.  The files are written atomically,
+        so they are read without any lock, and are only readable by the
+        owner as the user-data may contain credentials.
+
         :type credentials: dict
         :param credentials: user-defined credentials for testing
 
@@ -45,16 +145,170 @@ class IcsMeta(object):
 
         :type tags: dict
         :param tags: user-defined instance tags for testing
+
+        :type wait_tags: bool
+        :param wait_tags: whether to wait for the instance tags to show up,
+            which may take a while after the instance is launched
+
+        :type tags_timeout: int
+        :param tags_timeout: how long to wait for the instance tags
+
+        :type cache_dir: string
+        :param cache_dir: the directory of the cache files, e.g.
+            :data:`DEFAULT_CACHE_DIR`; nothing is cached if None
+
+        :type cache_ttls: dict
+        :param cache_ttls: how many seconds each source is kept, updating
+            :data:`DEFAULT_CACHE_TTLS`
+
+        :type refresh: bool
+        :param refresh: whether to ignore the cache files, which are
+            still updated with the fetched sources
         """
-        self.meta_data = IcsMeta.get_meta_data(data=metadata)
+        self.wait_tags = wait_tags
+        self.tags_timeout = tags_timeout
+        self.cache_dir = cache_dir
+        self.cache_ttls = dict(DEFAULT_CACHE_TTLS)
+        if cache_ttls:
+            self.cache_ttls.update(cache_ttls)
+        self.refresh = refresh
+        self._data = {}
+        self._locks = dict((name, threading.Lock()) for name in self.SOURCES)
+        for name, value in (('meta_data', metadata), ('user_data', userdata),
+                            ('credentials', credentials), ('tags', tags)):
+            if value is not None:
+                self._data[name] = value
 
-        if userdata is not None:
-            self.user_data = userdata
-        else:
-            self.user_data = json.loads(IcsMeta.get_user_data())
+    def _get_source(self, name):
+        """
+        Get the source, fetching it once if not loaded yet
+        """
+        try:
+            return self._data[name]
+        except KeyError:
+            pass
+        with self._locks[name]:
+            if name not in self._data:
+                missing = object()
+                value = missing
+                if not self.refresh:
+                    value = self._read_cache(name, missing)
+                if value is missing:
+                    value = getattr(self, '_fetch_%s' % name)()
+                    self._write_cache(name, value)
+                self._data[name] = value
+            return self._data[name]
+
+    def _cache_path(self, name):
+        return os.path.join(self.cache_dir, "%s.json" % name)
+
+    def _read_cache(self, name, default=None):
+        """
+        Read the source from its cache file, without any lock as the file
+        is replaced atomically
 
-        self.credentials = self.get_credentials(credentials=credentials)
-        self.tags = self.get_machine_tags(tags=tags)
+        :rtype: dict
+        :return: the source, or the default if missing, expired or
+            written in another boot
+        """
+        if self.cache_dir is None or name not in self.cache_ttls:
+            return default
+        try:
+            with open(self._cache_path(name)) as fp:
+                entry = json.load(fp)
+        except (IOError, ValueError):
+            return default
+        if entry.get('expires', 0) < time.time():
+            return default
+        if entry.get('boot_id') != get_boot_id():
+            log.debug("'%s' cached in another boot, ignored" % name)
+            return default
+        log.debug("'%s' loaded from the cache" % name)
+        return entry['data']
+
+    def _write_cache(self, name, value):
+        """
+        Write the source into its cache file
+
+        Empty sources are not cached, as the metadata service may be
+        unreachable for a while or the instance tagged later; only the
+        :data:`CACHED_META_DATA_KEYS` of the meta-data are cached, which
+        fetches just those leaves of the lazily loaded meta-data.
+        """
+        if self.cache_dir is None or name not in self.cache_ttls:
+            return
+        if not value:
+            return
+        if name == 'meta_data':
+            value = dict((key, value[key]) for key in CACHED_META_DATA_KEYS
+                         if key in value)
+        entry = {'expires': time.time() + self.cache_ttls[name],
+                 'boot_id': get_boot_id(),
+                 'data': value}
+        try:
+            if not os.path.isdir(self.cache_dir):
+                os.makedirs(self.cache_dir, 0700)
+            write_file_atomic(self._cache_path(name), json.dumps(entry),
+                              mode=0600)
+        except (IOError, OSError), e:
+            log.warning("Failed to cache '%s' into '%s': %s" %
+                        (name, self.cache_dir, e))
+
+    def reload(self, names=None):
+        """
+        Fetch the sources again, bypassing and updating the cache files
+
+        :type names: list
+        :param names: the sources in :attr:`SOURCES`, all if None
+        """
+        if names is None:
+            names = self.SOURCES
+        refresh, self.refresh = self.refresh, True
+        try:
+            for name in names:
+                self._data.pop(name, None)
+            self.prefetch(names)
+        finally:
+            self.refresh = refresh
+
+    @profile_step('get_meta_data')
+    def _fetch_meta_data(self):
+        return IcsMeta.get_meta_data()
+
+    @profile_step('get_user_data')
+    def _fetch_user_data(self):
+        return json.loads(IcsMeta.get_user_data())
+
+    def _fetch_credentials(self):
+        return self.get_credentials()
+
+    def _fetch_tags(self):
+        # Both needed to call DescribeTags
+        self.prefetch(['meta_data', 'user_data'])
+        return self.get_machine_tags(timeout=self.tags_timeout,
+                                     wait=self.wait_tags)
+
+    meta_data = _source_property('meta_data')
+    user_data = _source_property('user_data')
+    credentials = _source_property('credentials')
+    tags = _source_property('tags')
+
+    def prefetch(self, names=('meta_data', 'user_data')):
+        """
+        Fetch the sources not loaded yet concurrently
+
+        :type names: list
+        :param names: the sources in :attr:`SOURCES`
+        """
+        missing = [name for name in names if name not in self._data]
+        if len(missing) < 2:
+            for name in missing:
+                self._get_source(name)
+            return
+        for result in run_parallel(self._get_source, missing,
+                                   workers=len(missing)):
+            if not result.ok:
+                raise result.error
 
     @staticmethod
     def get_meta_data(timeout=None, url=None, num_retries=None,
@@ -151,7 +405,8 @@ class IcsMeta(object):
         except KeyError:
             return None
 
-    def get_machine_tags(self, tags=None, timeout=120):
+    @profile_step('get_machine_tags')
+    def get_machine_tags(self, tags=None, timeout=120, wait=True):
         """
         Get the instance tags
 
@@ -161,6 +416,10 @@ class IcsMeta(object):
         :type timeout: int
         :param timeout: timeout for the request
 
+        :type wait: bool
+        :param wait: whether to wait for the tags to show up, polling
+            with exponential backoff; only one request is made if False
+
         :rtype: string
         :return: the tags of this instance
         """
@@ -175,14 +434,18 @@ class IcsMeta(object):
         else:
             ec2conn = IcsEc2(region, **self.credentials)
 
-        for i in xrange(timeout / 5):
-            result = ec2conn.get_instance_tags(instance_id)
-            if result:
-                return result
-            time.sleep(5)
+        result = {}
+
+        def check():
+            result.update(ec2conn.get_instance_tags(instance_id) or {})
+            return bool(result)
+
+        if wait:
+            wait_for(check, timeout=timeout, interval=1, max_interval=16)
         else:
-            # To avoid specific tags with "TypeError" Exception
-            return {}
+            check()
+        # To avoid specific tags with "TypeError" Exception
+        return result
 
     def init_config(self):
         """
@@ -191,6 +454,7 @@ class IcsMeta(object):
         :rtype: dict
         :return: json string contains meta-data, user-data, tags
         """
+        self.prefetch()
         data = {}
         data.update({'MetaData': self.meta_data})
         data.update({'UserData': self.user_data})
@@ -435,6 +699,7 @@ class IcsMeta(object):
 
     # Functions on how to deal with the information above
 
+    @profile_step('configure_timezone')
     def configure_timezone(self, tz=None):
         """
         Configure the system timezone
@@ -482,6 +747,7 @@ class IcsMeta(object):
             return False
         return True
 
+    @profile_step('download_script')
     def download_script(self, pattern):
         """
         Download scripts from S3
@@ -555,12 +821,78 @@ class IcsMeta(object):
             log.debug("Inventory file content: \n %s" % data)
             return data
 
-    def download_cfg_from_inventory_file(self, s3url):
+    @staticmethod
+    def install_cfg_file(s3conn, s3loc, attr):
+        """
+        Install one configuration file from S3, skipped if the local file
+        has the same MD5 as the S3 ETag, otherwise downloaded into a temp
+        file next to the destination, which is then renamed atomically
+
+        The MD5s are only compared when the ETag is a plain MD5, so the
+        multipart uploads and the objects encrypted with KMS or a customer
+        key are always downloaded, without the checksum verified.
+
+        :type s3conn: class
+        :param s3conn: the :class:`opslib.icss3.IcsS3` connection
+
+        :type s3loc: string
+        :param s3loc: S3 URL of the file, like "s3://XXXXX"
+
+        :type attr: dict
+        :param attr: the 'dest', 'mode', 'owner' and 'group' of the file
+
+        :rtype: dict
+        :return: the 'status' ('unchanged' or 'updated') and the 'bytes'
+            downloaded
+        """
+        bucket_name, key_name = s3loc[len('s3://'):].split('/', 1)
+        bucket = s3conn.get_bucket(bucket_name, validate=False)
+        bucket.key_class = _S3Key
+        key = bucket.get_key(key_name)
+        if key is None:
+            raise IcsS3Exception('S3 file does not exist: "%s"' % s3loc)
+
+        dest = attr['dest']
+        # Both the shortcut and the check need the ETag to be the MD5
+        etag = _md5_etag(key)
+        if etag and md5sum(dest) == etag:
+            chmod(dest, attr['mode'])
+            chownbyname(dest, user=attr['owner'], group=attr['group'])
+            return {'status': 'unchanged', 'bytes': 0}
+
+        fd, temp_path = tempfile.mkstemp(
+            dir=os.path.dirname(dest), prefix=".%s." % os.path.basename(dest))
+        try:
+            with os.fdopen(fd, 'wb') as fp:
+                key.get_contents_to_file(fp)
+            if etag and md5sum(temp_path) != etag:
+                raise IcsMetaException("Checksum mismatch for '%s'" % s3loc)
+            chmod(temp_path, attr['mode'])
+            chownbyname(temp_path, user=attr['owner'], group=attr['group'])
+            os.rename(temp_path, dest)
+        except Exception:
+            del_file(temp_path)
+            raise
+        return {'status': 'updated', 'bytes': key.size}
+
+    def download_cfg_from_inventory_file(self, s3url, workers=8):
         """
         Download configuration files from S3 according to the inventory file
 
+        The files are installed concurrently by :meth:`install_cfg_file`;
+        a failed file does not stop the others and is kept unchanged.
+
         :type s3url: string
         :param s3url: S3 URL for searching inventory file, like "s3://XXXXX"
+
+        :type workers: int
+        :param workers: the number of files downloaded concurrently
+
+        :rtype: dict
+        :return: the report of the 'files', each with its 'status'
+            ('unchanged', 'updated' or 'failed') and 'elapsed' seconds,
+            the total 'elapsed' seconds and the number 'failed';
+            None if no valid inventory file found
         """
         log.debug(">> Enter the 'inventory-file' download mode")
         if self.credentials is None:
@@ -573,45 +905,39 @@ class IcsMeta(object):
             log.debug(">> Exit the 'inventory-file' download mode")
             return None
 
-        for fname, attr in inventory_data.iteritems():
-            s3loc = os.path.join(s3url, fname)
-            try:
-                filepath = s3conn.download_files(s3loc)
-            except Exception as e:
-                log.error(e)
-                break
-
-            # Backup
-            bak_file = ".".join([attr['dest'], "bak"])
-            try:
-                copy(attr['dest'], bak_file)
-            except (IOError, OSError) as e:
-                log.info("No need to back up for '%s' - %s" %
-                         (attr['dest'], e))
-                pass
-
-            try:
-                copy(filepath, attr['dest'])
-                chmod(attr['dest'], attr['mode'])
-                chownbyname(attr['dest'], user=attr['owner'],
-                            group=attr['group'])
-
-            except Exception as e:
-                log.error("Failed to copy '%s' to '%s'" %
-                          (filepath, attr['dest']))
-                log.error(e)
-
-                # Rollback
-                copy(bak_file, attr['dest'])
-                del_file(filepath)
-                break
-
-            del_file(filepath)
-            log.info("'%s' copied to '%s' with '%s:%s:%s'" %
-                     (s3loc, attr['dest'], attr['mode'],
-                      attr['owner'], attr['group']))
+        start = time.time()
+        files = []
+        for result in run_parallel(
+                lambda fname: self.install_cfg_file(
+                    s3conn, os.path.join(s3url, fname),
+                    inventory_data[fname]),
+                sorted(inventory_data), workers=workers):
+            attr = inventory_data[result.item]
+            s3loc = os.path.join(s3url, result.item)
+            entry = {'file': s3loc, 'dest': attr['dest'],
+                     'elapsed': result.elapsed}
+            if result.ok:
+                entry.update(result.result)
+                log.info("'%s' %s to '%s' with '%s:%s:%s' in %.2fs" %
+                         (s3loc, result.result['status'], attr['dest'],
+                          attr['mode'], attr['owner'], attr['group'],
+                          result.elapsed))
+            else:
+                entry.update({'status': 'failed', 'bytes': 0,
+                              'error': str(result.error)})
+                log.error("Failed to install '%s' to '%s'" %
+                          (s3loc, attr['dest']))
+                log.error(result.error)
+            files.append(entry)
+
+        report = {'files': files,
+                  'elapsed': time.time() - start,
+                  'failed': len([f for f in files
+                                 if f['status'] == 'failed'])}
         log.debug(">> Exit the 'inventory-file' download mode")
+        return report
 
+    @profile_step('download_cfg')
     def download_cfg(self, pattern):
         """
         Download configuration files from S3
@@ -619,21 +945,23 @@ class IcsMeta(object):
         :type pattern: string
         :param pattern: regrex expression to match
 
-        :rtype: string
-        :return: the local path where downloaded files stored
+        :rtype: list
+        :return: the local paths where the files downloaded without an
+            inventory file are stored
         """
         if self.credentials is None:
             s3conn = IcsS3()
         else:
             s3conn = IcsS3(**self.credentials)
 
-        localpath = None
+        localpath = []
 
         rolecfg_uri = "s3://" + os.path.join(self.get_cfg_bucket(),
                                              self.get_role_name())
         result = self.download_cfg_from_inventory_file(rolecfg_uri)
         if result is None:
-            localpath = s3conn.batch_download(rolecfg_uri, pattern=pattern)
+            localpath.extend(
+                s3conn.batch_download(rolecfg_uri, pattern=pattern))
 
         instcfg_uri = os.path.join(rolecfg_uri, self.get_instance_name())
         result = self.download_cfg_from_inventory_file(instcfg_uri)
@@ -642,6 +970,7 @@ class IcsMeta(object):
                 s3conn.batch_download(instcfg_uri, pattern=pattern))
         return localpath
 
+    @profile_step('init_alert')
     def init_alert(self, prefix='ICS'):
         """
         Intialize ICS Alert
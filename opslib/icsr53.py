@@ -148,6 +148,77 @@ class IcsR53(object):
         """
         return self.zone.find_all_records()
 
+    def iter_records(self, page_size=100):
+        """
+        Iterate all records in this zone, one page at a time.
+
+        :type page_size: int
+        :param page_size: the number of records fetched in each request
+        """
+        return self.zone.iter_records(page_size)
+
+    def export_records(self, fp, format="bind", page_size=100):
+        """
+        Export all records in this zone into a file.
+
+        :type fp: file
+        :param fp: opened file object to write
+
+        :type format: str
+        :param format: "bind" for BIND zone file, "jsonl" for JSON Lines
+
+        :type page_size: int
+        :param page_size: the number of records fetched in each request
+
+        :rtype: int
+        :return: the number of exported records
+        """
+        return self.zone.export_records(fp, format, page_size)
+
+    def import_records(self, fp, format="jsonl", batch_size=100, workers=4,
+                       action="CREATE", wait=False, timeout=120):
+        """
+        Import the records from a file into this zone in batches.
+
+        :type fp: file
+        :param fp: opened file object to read
+
+        :type format: str
+        :param format: "bind" for BIND zone file, "jsonl" for JSON Lines
+
+        :type batch_size: int
+        :param batch_size: the number of records in each change request
+
+        :type workers: int
+        :param workers: the number of concurrent change requests
+
+        :type action: str
+        :param action: the change action, "CREATE" or "UPSERT"
+
+        :type wait: bool
+        :param wait: whether to wait for all the changes to be INSYNC
+
+        :type timeout: int
+        :param timeout: how long to wait for each change
+
+        :rtype: list
+        :return: a list of :class:`opslib.icsutils.parallel.TaskResult`,
+            one for each batch
+        """
+        results = self.zone.import_records(fp, format, batch_size, workers,
+                                           action)
+        failed = [r for r in results if not r.ok]
+        for result in failed:
+            log.error("failed to import %s records: %s" %
+                      (len(result.item), result.error))
+        if failed:
+            raise IcsR53Exception("%s of %s batches failed to import" %
+                                  (len(failed), len(results)))
+        if wait:
+            for result in results:
+                self.wait_to_complete(result.result, timeout)
+        return results
+
     def find_records(self, name, type, desired=1, all=False, identifier=None):
         """
         Search this Zone for records that match given parameters.
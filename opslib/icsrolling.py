@@ -0,0 +1,329 @@
+"""
+IcsRolling: Library for Rolling Update
+--------------------------------------
+
++------------------------+---------------+
+| This is the IcsRolling common library. |
++------------------------+---------------+
+"""
+
+import time
+import threading
+
+from opslib.icsas import IcsAS
+from opslib.icselb import IcsELB
+from opslib.icsec2 import IcsEc2
+from opslib.icsutils.parallel import run_parallel
+from opslib.icsexception import IcsASException
+
+import logging
+log = logging.getLogger(__name__)
+
+
+class IcsRolling(object):
+
+    """
+    ICS Library for rolling replacement of Auto-Scaling instances
+
+    The instances not running the current launch configuration of the
+    group are terminated batch by batch; Auto Scaling launches the
+    replacements, which must pass the ELB and EC2 health checks before
+    the next batch starts.  As the outdated instances are found from the
+    group itself, an interrupted update is resumed by running it again.
+    """
+
+    def __init__(self, region, name, batch_size=1, max_unavailable=1,
+                 check_elb=True, check_ec2=True, timeout=900, interval=15,
+                 processes=None, **kwargs):
+        """
+        :type region: string
+        :param region: the region name
+
+        :type name: string
+        :param name: the ASG name
+
+        :type batch_size: int
+        :param batch_size: the number of instances replaced in each batch
+
+        :type max_unavailable: int
+        :param max_unavailable: the maximum number of instances out of
+            service at any time, including the unhealthy ones
+
+        :type check_elb: bool
+        :param check_elb: whether to wait for 'InService' in all the ELBs
+
+        :type check_ec2: bool
+        :param check_ec2: whether to wait for the EC2 status checks
+
+        :type timeout: int
+        :param timeout: how long to wait for each batch to be healthy
+
+        :type interval: int
+        :param interval: how long to wait between health checks
+
+        :type processes: list
+        :param processes: scaling processes suspended during the update,
+            'AZRebalance', 'AlarmNotification' and 'ScheduledActions'
+            by default
+        """
+        if batch_size < 1 or max_unavailable < 1:
+            raise IcsASException("batch_size and max_unavailable must be "
+                                 "at least 1, got %s and %s"
+                                 % (batch_size, max_unavailable))
+        self.name = name
+        self.batch_size = batch_size
+        self.max_unavailable = max_unavailable
+        self.check_elb = check_elb
+        self.check_ec2 = check_ec2
+        self.timeout = timeout
+        self.interval = interval
+        if processes is None:
+            processes = ['AZRebalance', 'AlarmNotification',
+                         'ScheduledActions']
+        self.processes = processes
+
+        self.asg = IcsAS(region, **kwargs)
+        self.elb = IcsELB(region, **kwargs)
+        self.ec2 = IcsEc2(region, **kwargs)
+
+        self.phases = []
+        self._running = threading.Event()
+        self._running.set()
+
+    def pause(self):
+        """
+        Pause the update before the next batch starts
+        """
+        log.info("pause the rolling update of '%s'" % self.name)
+        self._running.clear()
+
+    def resume(self):
+        """
+        Resume the paused update
+        """
+        log.info("resume the rolling update of '%s'" % self.name)
+        self._running.set()
+
+    def is_paused(self):
+        return not self._running.isSet()
+
+    def _wait_resumed(self):
+        # Wait with a timeout, so that signals are still handled
+        while not self._running.isSet():
+            self._running.wait(1)
+
+    def get_group(self):
+        """
+        Get the ASG
+
+        :rtype: class
+        :return: the boto AutoScalingGroup object
+        """
+        groups = self.asg.get_group_from_name(self.name)
+        if not groups:
+            raise IcsASException("no such Auto-Scaling Group '%s' found"
+                                 % self.name)
+        return groups[0]
+
+    @staticmethod
+    def get_outdated(group):
+        """
+        Get the instances not running the current launch configuration
+
+        :rtype: list
+        :return: a list of instance ids
+        """
+        return [i.instance_id for i in group.instances
+                if i.launch_config_name != group.launch_config_name
+                and not i.lifecycle_state.startswith('Terminating')]
+
+    @staticmethod
+    def get_in_service(group, exclude=()):
+        """
+        Get the instances in service and healthy
+
+        :type exclude: list
+        :param exclude: the instance ids not counted, e.g. being terminated
+
+        :rtype: list
+        :return: a list of instance ids
+        """
+        return [i.instance_id for i in group.instances
+                if i.lifecycle_state == 'InService'
+                and i.health_status == 'Healthy'
+                and i.instance_id not in exclude]
+
+    @staticmethod
+    def count_unavailable(group, exclude=()):
+        """
+        Count the instances out of service, including the missing ones
+
+        :rtype: int
+        :return: the number of unavailable instances
+        """
+        in_service = IcsRolling.get_in_service(group, exclude)
+        return max(group.desired_capacity - len(in_service), 0)
+
+    def check_health(self, group, instance_ids):
+        """
+        Check the instances in all the ELBs of the group and with the EC2
+        status checks, with all the checks running in parallel
+
+        :type group: class
+        :param group: the boto AutoScalingGroup object
+
+        :type instance_ids: list
+        :param instance_ids: a list of EC2 instance ids
+
+        :rtype: list
+        :return: a list of the unhealthy instance ids
+        """
+        checks = []
+        if self.check_elb:
+            for lb_name in group.load_balancers:
+                checks.append(lambda lb_name=lb_name: dict(
+                    (i, s == 'InService') for i, s in
+                    self.elb.get_instances_health(
+                        lb_name, instance_ids).iteritems()))
+        if self.check_ec2:
+            checks.append(lambda: dict(
+                (i, s[0].lower() == 'ok' and s[1].lower() == 'ok')
+                for i, s in self.ec2.get_instances_status(
+                    instance_ids).iteritems()))
+
+        unhealthy = set()
+        for result in run_parallel(lambda check: check(), checks,
+                                   workers=len(checks) or 1):
+            if not result.ok:
+                log.info("health check failed: %s" % result.error)
+                return list(instance_ids)
+            unhealthy.update(i for i in instance_ids
+                             if not result.result.get(i, False))
+        return sorted(unhealthy)
+
+    def wait_healthy(self, exclude=(), previous=()):
+        """
+        Wait until the group is back to its desired capacity with all its
+        instances in service, and the new ones healthy
+
+        :type exclude: list
+        :param exclude: the instance ids not counted, e.g. being terminated
+
+        :type previous: list
+        :param previous: the instance ids present before, whose ELB and
+            EC2 health is not checked, e.g. the outdated instances which
+            are going to be replaced anyway
+
+        :rtype: list
+        :return: a list of the checked instance ids
+        """
+        deadline = time.time() + self.timeout
+        while True:
+            group = self.get_group()
+            instance_ids = [i for i in self.get_in_service(group, exclude)
+                            if i not in previous]
+            if self.count_unavailable(group, exclude) == 0:
+                unhealthy = self.check_health(group, instance_ids)
+                if not unhealthy:
+                    return instance_ids
+                log.info("waiting for healthy instances: %s" % unhealthy)
+            if time.time() + self.interval > deadline:
+                raise IcsASException(
+                    "Auto-Scaling Group '%s' not healthy in %ss"
+                    % (self.name, self.timeout))
+            time.sleep(self.interval)
+
+    def terminate(self, instance_ids):
+        """
+        Terminate the instances in parallel, keeping the desired capacity,
+        so that Auto Scaling will replace them
+
+        :type instance_ids: list
+        :param instance_ids: a list of EC2 instance ids
+        """
+        results = run_parallel(
+            lambda i: self.asg.terminate_group_instance(
+                i, decrement_capacity=False),
+            instance_ids, workers=len(instance_ids))
+        failed = [r for r in results if not r.ok]
+        if failed:
+            raise IcsASException("failed to terminate %s" %
+                                 ", ".join(["%s: %s" % (r.item, r.error)
+                                            for r in failed]))
+
+    def _phase(self, phase, batch, func, *args):
+        """
+        Run one phase of the update and record how long it took
+        """
+        start = time.time()
+        try:
+            return func(*args)
+        finally:
+            elapsed = time.time() - start
+            self.phases.append({'phase': phase, 'batch': batch,
+                                'elapsed': elapsed})
+            log.info("batch %s: %s took %.1fs" % (batch, phase, elapsed))
+
+    def run(self):
+        """
+        Replace all the outdated instances of the group
+
+        :rtype: dict
+        :return: a report containing the replaced instances,
+            the number of batches, the processes suspended during the
+            update, and the time taken by each phase
+        """
+        start = time.time()
+        replaced = []
+        batch = 0
+
+        # The processes suspended before, e.g. by the operator, are left
+        # suspended after the update
+        suspended = set(p.process_name for p in
+                        self.get_group().suspended_processes)
+        processes = [p for p in self.processes if p not in suspended]
+        if processes:
+            self.asg.suspend_scaling_group(self.name, processes)
+        try:
+            while True:
+                if self.is_paused():
+                    self._phase('pause', batch, self._wait_resumed)
+
+                group = self.get_group()
+                outdated = [i for i in self.get_outdated(group)
+                            if i not in replaced]
+                if not outdated:
+                    break
+
+                size = min(self.batch_size, len(outdated),
+                           self.max_unavailable -
+                           self.count_unavailable(group))
+                if size <= 0:
+                    # Too many instances out of service already, wait for
+                    # the ones launched to be in service and healthy
+                    self._phase('wait', batch, self.wait_healthy, (),
+                                set(self.get_in_service(group)))
+                    continue
+
+                batch += 1
+                instance_ids = outdated[:size]
+                # Only the replacements are checked, not the instances
+                # present before, e.g. the unhealthy outdated ones
+                previous = set(i.instance_id for i in group.instances)
+                log.info("batch %s: replace %s" % (batch, instance_ids))
+                self._phase('terminate', batch, self.terminate, instance_ids)
+                self._phase('health', batch, self.wait_healthy, instance_ids,
+                            previous)
+                replaced.extend(instance_ids)
+        finally:
+            if processes:
+                self.asg.resume_scaling_group(self.name, processes)
+
+        return {'group': self.name,
+                'replaced': replaced,
+                'batches': batch,
+                'suspended': processes,
+                'phases': self.phases,
+                'elapsed': time.time() - start}
+
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
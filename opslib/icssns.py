@@ -7,38 +7,163 @@ IcsSNS: Library for SNS
 +--------------------+------------+--+
 """
 
+import json
+import time
+
 from boto import sns
+from opslib.icsutils.cache import TTLCache
+from opslib.icsutils.misc import write_file_atomic
 from opslib.icsexception import IcsSNSException
 
 import logging
 log = logging.getLogger(__name__)
 
 
+# keyed by (access key, region), the dict of topic name to its ARN
+_topic_indexes = TTLCache()
+
+
 class IcsSNS(object):
 
     """
     ICS Libraray for SNS
     """
 
-    def __init__(self, region, **kwargs):
+    def __init__(self, region, cache_ttl=300, cache_file=None, **kwargs):
+        """
+        :type region: string
+        :param region: the region name
+
+        :type cache_ttl: int
+        :param cache_ttl: how many seconds the topic index is kept
+
+        :type cache_file: string
+        :param cache_file: the JSON file where the topic index is persisted,
+            so that it is shared by short-lived processes
+        """
         self.conn = sns.connect_to_region(region, **kwargs)
+        self.region = region
+        self.cache_ttl = cache_ttl
+        self.cache_file = cache_file
+        self._cache_key = (kwargs.get('aws_access_key_id'), region)
+
+    def iter_topics(self):
+        """
+        Iterate all the SNS Topics in this region, following NextToken
+
+        :rtype: generator
+        :return: a generator of topic ARNs
+        """
+        next_token = None
+        while True:
+            topics = self.conn.get_all_topics(next_token)
+            result = topics['ListTopicsResponse']['ListTopicsResult']
+            for a in result['Topics']:
+                yield a['TopicArn']
+            next_token = result.get('NextToken')
+            if not next_token:
+                break
+
+    def _read_cache_file(self):
+        """
+        Read the topic index of this region from the cache file
+
+        :rtype: dict
+        :return: the topic index, None if missing or expired
+        """
+        try:
+            with open(self.cache_file) as fp:
+                entry = json.load(fp).get(self.region)
+        except (IOError, ValueError), e:
+            log.debug("cannot read the topic cache '%s': %s" %
+                      (self.cache_file, e))
+            return None
+        if not entry or entry.get('expires', 0) < time.time():
+            return None
+        return entry['topics']
+
+    def _write_cache_file(self, index):
+        """
+        Write the topic index of this region into the cache file
+        """
+        try:
+            with open(self.cache_file) as fp:
+                data = json.load(fp)
+        except (IOError, ValueError):
+            data = {}
+        data[self.region] = {'expires': time.time() + self.cache_ttl,
+                             'topics': index}
+        try:
+            write_file_atomic(self.cache_file, json.dumps(data))
+        except (IOError, OSError), e:
+            log.warning("cannot write the topic cache '%s': %s" %
+                        (self.cache_file, e))
+
+    def load_topic_index(self):
+        """
+        List all the SNS Topics in this region into the topic index
+
+        :rtype: dict
+        :return: a dict of topic name to its ARN
+        """
+        index = dict((arn.split(':')[-1], arn) for arn in self.iter_topics())
+        _topic_indexes.set(self._cache_key, index, self.cache_ttl)
+        if self.cache_file:
+            self._write_cache_file(index)
+        return index
+
+    def _get_cached_index(self):
+        """
+        Get the topic index from the memory, then from the cache file
+
+        :rtype: dict
+        :return: the topic index, None if missing or expired
+        """
+        index = _topic_indexes.get(self._cache_key)
+        if index is None and self.cache_file:
+            index = self._read_cache_file()
+            if index is not None:
+                _topic_indexes.set(self._cache_key, index, self.cache_ttl)
+        return index
+
+    def get_topic_index(self, refresh=False):
+        """
+        Get the topic index, listing the SNS Topics only if it is neither
+        in the memory nor in the cache file
+
+        :type refresh: bool
+        :param refresh: whether to list the SNS Topics anyway
+
+        :rtype: dict
+        :return: a dict of topic name to its ARN
+        """
+        index = None if refresh else self._get_cached_index()
+        if index is None:
+            index = self.load_topic_index()
+        return index
+
+    def invalidate(self):
+        """
+        Drop the topic index of this region, e.g. after creating a topic
+        """
+        _topic_indexes.invalidate(self._cache_key)
 
     def getTopicARN(self, name):
         """Get the ``Amazon Resource Name`` of specified SNS Topic
 
+        The topic index is listed again if the topic is not found in a
+        cached one, in case the topic has been created since.
+
         :type name: str
         :param name: SNS Topic Name
 
         :rtype: string
         :return: a string containing ``Amazon Resource Name``
         """
-        topics = self.conn.get_all_topics()
-        arns = topics['ListTopicsResponse']['ListTopicsResult']['Topics']
-        for a in arns:
-            arn = a['TopicArn']
-            if arn.split(':')[-1] == name:
-                return arn
-        return None
+        index = self._get_cached_index()
+        if index is not None and name in index:
+            return index[name]
+        return self.load_topic_index().get(name)
 
     def publish(self, topic_arn, msg, subj=None):
         """
@@ -7,11 +7,25 @@ IcsSqs: Library for SQS
 +--------------------+------------+--+
 """
 
+import time
+import threading
+
 from boto.sqs import connect_to_region
+from opslib.icsutils.parallel import iter_parallel, run_parallel
+from opslib.icsutils.cache import TTLCache
+from opslib.icsexception import IcsSQSException
 
 import logging
 log = logging.getLogger(__name__)
 
+# The limits of SendMessageBatch, DeleteMessageBatch
+# and ChangeMessageVisibilityBatch
+MAX_BATCH = 10
+MAX_BATCH_BYTES = 256 * 1024
+
+# keyed by (access key, region, name), the queue objects
+_queues = TTLCache()
+
 
 class IcsSqs(object):
 
@@ -19,8 +33,17 @@ class IcsSqs(object):
     ICS Library for SQS
     """
 
-    def __init__(self, region, **kwargs):
-        self.conn = connect_to_region(region)
+    def __init__(self, region, cache_ttl=3600, **kwargs):
+        """
+        :type region: string
+        :param region: the region name
+
+        :type cache_ttl: int
+        :param cache_ttl: how many seconds the queue objects are cached
+        """
+        self.conn = connect_to_region(region, **kwargs)
+        self.cache_ttl = cache_ttl
+        self._cache_key = (kwargs.get('aws_access_key_id'), region)
 
     def create_queue(self, name, visibility_timeout=None):
         """
@@ -39,14 +62,16 @@ class IcsSqs(object):
         :type: boto.sqs.queue.Queue
         """
 
-        return self.conn.create_queue(
+        sqs = self.conn.create_queue(
             name,
             visibility_timeout=visibility_timeout)
+        _queues.set(self._cache_key + (name,), sqs, self.cache_ttl)
+        return sqs
 
     def get_queues(self, name=''):
         """
         If name is empty, it will get all queues, else it retrieves the queue
-        with the given name.
+        with the given name, from the cache if found.
 
         :param name: The name of the queue to retrieve.
         :type name: string
@@ -58,7 +83,13 @@ class IcsSqs(object):
         """
 
         if name:
-            return self.conn.get_queue(name)
+            key = self._cache_key + (name,)
+            sqs = _queues.get(key)
+            if sqs is None:
+                sqs = self.conn.get_queue(name)
+                if sqs is not None:
+                    _queues.set(key, sqs, self.cache_ttl)
+            return sqs
         else:
             return self.conn.get_all_queues()
 
@@ -75,4 +106,401 @@ class IcsSqs(object):
 
         sqs = self.get_queues(name)
         if sqs:
-            return sqs.delete()
+            result = sqs.delete()
+            self.invalidate(name)
+            return result
+
+    def invalidate(self, name=None):
+        """
+        Drop the cached queue object, or all of them in this region
+
+        :param name: The name of the queue
+        :type name: string
+        """
+        if name is not None:
+            _queues.invalidate(self._cache_key + (name,))
+        else:
+            _queues.invalidate_matching(
+                lambda key: key[:2] == self._cache_key)
+
+    def _run_queues(self, action, func, names, workers):
+        results = run_parallel(func, names, workers=workers)
+        for result in results:
+            if not result.ok:
+                log.error("failed to %s queue '%s': %s" %
+                          (action, result.item, result.error))
+        return dict((result.item, result) for result in results)
+
+    def create_queues(self, names, visibility_timeout=None, workers=8):
+        """
+        Create many SQS Queues in parallel
+
+        :param names: The names of the new queues
+        :type names: list of string
+
+        :param visibility_timeout: The default visibility timeout for all \
+             messages written in the queues.
+        :type visibility_timeout: int
+
+        :param workers: The number of queues created in parallel
+        :type workers: int
+
+        :return: The queue name to the \
+            :class:`opslib.icsutils.parallel.TaskResult` of the new queue
+        :type: dict
+        """
+        return self._run_queues(
+            'create',
+            lambda name: self.create_queue(name, visibility_timeout),
+            names, workers)
+
+    def delete_queues(self, names, workers=8):
+        """
+        Delete many SQS Queues in parallel
+
+        :param names: The names of the queues
+        :type names: list of string
+
+        :param workers: The number of queues deleted in parallel
+        :type workers: int
+
+        :return: The queue name to the \
+            :class:`opslib.icsutils.parallel.TaskResult` of the deletion
+        :type: dict
+        """
+        return self._run_queues('delete', self.delete_queue, names, workers)
+
+    def get_queue_depth(self, queue):
+        """
+        Get the approximate numbers of messages in the queue
+
+        :param queue: The queue or its name
+        :type queue: boto.sqs.queue.Queue or string
+
+        :return: The numbers of the 'visible', 'in_flight' and 'delayed'
+            messages
+        :type: dict
+        """
+        attrs = self.conn.get_queue_attributes(self._get_queue(queue), 'All')
+        return {
+            'visible': int(attrs.get('ApproximateNumberOfMessages', 0)),
+            'in_flight': int(
+                attrs.get('ApproximateNumberOfMessagesNotVisible', 0)),
+            'delayed': int(
+                attrs.get('ApproximateNumberOfMessagesDelayed', 0))}
+
+    def get_queue_depths(self, names, workers=8):
+        """
+        Get the approximate numbers of messages in many queues, with the
+        attributes of the queues read in parallel
+
+        :param names: The names of the queues
+        :type names: list of string
+
+        :param workers: The number of queues read in parallel
+        :type workers: int
+
+        :return: The queue name to the dict of :meth:`get_queue_depth`,
+            the queues failed to read are left out
+        :type: dict
+        """
+        return dict((name, result.result) for name, result in
+                    self._run_queues('sample', self.get_queue_depth,
+                                     names, workers).iteritems()
+                    if result.ok)
+
+    def iter_queue_depths(self, names, interval=60, workers=8, stop=None):
+        """
+        Sample the queue depths periodically, e.g. for autoscaling decisions
+
+        :param names: The names of the queues
+        :type names: list of string
+
+        :param interval: How many seconds between the samples
+        :type interval: int
+
+        :param workers: The number of queues read in parallel
+        :type workers: int
+
+        :param stop: The event to stop sampling
+        :type stop: threading.Event
+
+        :return: The tuples of (timestamp, :meth:`get_queue_depths`)
+        :type: generator
+        """
+        if stop is None:
+            stop = threading.Event()
+        while not stop.isSet():
+            start = time.time()
+            yield start, self.get_queue_depths(names, workers)
+            stop.wait(max(interval - (time.time() - start), 0))
+
+    def _get_queue(self, queue):
+        """
+        Get the queue object from its name
+
+        :param queue: The queue or its name
+        :type queue: boto.sqs.queue.Queue or string
+
+        :return: The queue
+        :type: boto.sqs.queue.Queue
+        """
+        if not isinstance(queue, basestring):
+            return queue
+        sqs = self.get_queues(queue)
+        if sqs is None:
+            raise IcsSQSException("Cannot find this queue: %s" % queue)
+        return sqs
+
+    @staticmethod
+    def _split_batches(entries, size=lambda entry: 0):
+        """
+        Split the entries into batches within the limits of SQS
+
+        :type entries: list
+        :param entries: the entries of the batch requests
+
+        :type size: callable
+        :param size: the function returning the bytes of one entry
+        """
+        batch, batch_bytes = [], 0
+        for entry in entries:
+            entry_bytes = size(entry)
+            if batch and (len(batch) == MAX_BATCH or
+                          batch_bytes + entry_bytes > MAX_BATCH_BYTES):
+                yield batch
+                batch, batch_bytes = [], 0
+            batch.append(entry)
+            batch_bytes += entry_bytes
+        if batch:
+            yield batch
+
+    def send_messages(self, queue, bodies, delay_seconds=0, tries=3):
+        """
+        Send the messages in batches of 10, retrying the failed ones
+
+        :param queue: The queue or its name
+        :type queue: boto.sqs.queue.Queue or string
+
+        :param bodies: The message bodies
+        :type bodies: list of string
+
+        :param delay_seconds: The delay of the messages
+        :type delay_seconds: int
+
+        :param tries: How many times to send a message at most
+        :type tries: int
+
+        :return: The message ids, in the order of the bodies
+        :type: list of string
+        """
+        sqs = self._get_queue(queue)
+        encoded = [sqs.message_class(body=body).get_body_encoded()
+                   for body in bodies]
+        message_ids = [None] * len(encoded)
+        pending = range(len(encoded))
+        errors = {}
+        for i in xrange(tries):
+            failed = []
+            for batch in self._split_batches(
+                    pending, lambda index: len(encoded[index])):
+                result = sqs.write_batch([(str(index), encoded[index],
+                                           delay_seconds)
+                                          for index in batch])
+                for entry in result.results:
+                    message_ids[int(entry['id'])] = entry['message_id']
+                for entry in result.errors:
+                    errors[int(entry['id'])] = entry['error_message']
+                    if entry.get('sender_fault') != 'true':
+                        failed.append(int(entry['id']))
+            pending = failed
+            if not pending:
+                break
+        unsent = [index for index, mid in enumerate(message_ids)
+                  if mid is None]
+        if unsent:
+            raise IcsSQSException(
+                "%s of %s messages not sent to %s: %s" %
+                (len(unsent), len(bodies), sqs.name,
+                 "; ".join(set(errors[index] for index in unsent))))
+        return message_ids
+
+    def delete_messages(self, queue, messages):
+        """
+        Delete the messages in batches of 10
+
+        :param queue: The queue or its name
+        :type queue: boto.sqs.queue.Queue or string
+
+        :param messages: The received messages
+        :type messages: list of boto.sqs.message.Message
+
+        :return: The number of deleted messages
+        :type: int
+        """
+        sqs = self._get_queue(queue)
+        deleted, errors = 0, []
+        for batch in self._split_batches(messages):
+            result = sqs.delete_message_batch(batch)
+            deleted += len(result.results)
+            errors.extend(entry['error_message'] for entry in result.errors)
+        if errors:
+            raise IcsSQSException(
+                "%s of %s messages not deleted from %s: %s" %
+                (len(errors), len(messages), sqs.name,
+                 "; ".join(set(errors))))
+        return deleted
+
+    def iter_messages(self, queue, batch_size=MAX_BATCH, wait_time=20,
+                      visibility_timeout=None, stop=None):
+        """
+        Receive the messages with long polling until stopped
+
+        :param queue: The queue or its name
+        :type queue: boto.sqs.queue.Queue or string
+
+        :param batch_size: The number of messages received in each call
+        :type batch_size: int
+
+        :param wait_time: How many seconds each call waits for messages
+        :type wait_time: int
+
+        :param visibility_timeout: The visibility timeout of the messages
+        :type visibility_timeout: int
+
+        :param stop: The event to stop receiving
+        :type stop: threading.Event
+
+        :return: The received messages
+        :type: generator of boto.sqs.message.Message
+        """
+        sqs = self._get_queue(queue)
+        while stop is None or not stop.isSet():
+            for message in sqs.get_messages(
+                    batch_size, visibility_timeout=visibility_timeout,
+                    wait_time_seconds=wait_time):
+                yield message
+
+    def consume(self, queue, handler, workers=4, batch_size=MAX_BATCH,
+                wait_time=20, visibility_timeout=30, heartbeat=None,
+                stop=None):
+        """
+        Process the messages with a pool of threads until stopped
+
+        The messages are received with long polling and prefetched one
+        batch ahead of the workers.  A message is deleted once its handler
+        returns, and is received again after its visibility timeout if the
+        handler raises.  The visibility timeout of the messages still being
+        processed is extended periodically, so that slow handlers do not
+        get their messages delivered twice.
+
+        :param queue: The queue or its name
+        :type queue: boto.sqs.queue.Queue or string
+
+        :param handler: The function taking one message as its argument
+        :type handler: callable
+
+        :param workers: The number of concurrent handlers
+        :type workers: int
+
+        :param batch_size: The number of messages received in each call
+        :type batch_size: int
+
+        :param wait_time: How many seconds each call waits for messages
+        :type wait_time: int
+
+        :param visibility_timeout: The visibility timeout of the messages
+        :type visibility_timeout: int
+
+        :param heartbeat: How many seconds between the extensions of the
+            visibility timeout, half of the visibility timeout by default
+        :type heartbeat: int
+
+        :param stop: The event to stop consuming, which takes effect after
+            the current receive call and the prefetched messages
+        :type stop: threading.Event
+
+        :return: The numbers of the 'received', 'processed', 'failed' and
+            'deleted' messages
+        :type: dict
+        """
+        sqs = self._get_queue(queue)
+        if heartbeat is None:
+            heartbeat = max(visibility_timeout / 2, 1)
+        stats = {'received': 0, 'processed': 0, 'failed': 0, 'deleted': 0}
+        lock = threading.Lock()
+        in_flight = {}
+        done = []
+        finished = threading.Event()
+
+        def flush():
+            with lock:
+                messages = done[:]
+                del done[:]
+            if messages:
+                try:
+                    deleted = self.delete_messages(sqs, messages)
+                except IcsSQSException, e:
+                    log.error(e)
+                    return
+                with lock:
+                    stats['deleted'] += deleted
+
+        def extend():
+            now = time.time()
+            with lock:
+                slow = [message for message, started in in_flight.values()
+                        if now - started >= heartbeat]
+            for batch in self._split_batches(slow):
+                try:
+                    sqs.change_message_visibility_batch(
+                        [(message, visibility_timeout) for message in batch])
+                except Exception, e:
+                    log.warning("cannot extend the visibility of %s "
+                                "messages: %s" % (len(batch), e))
+
+        def beat():
+            while not finished.isSet():
+                finished.wait(heartbeat)
+                extend()
+                flush()
+
+        def process(message):
+            try:
+                handler(message)
+            finally:
+                with lock:
+                    del in_flight[message.id]
+            with lock:
+                done.append(message)
+                full = len(done) >= MAX_BATCH
+            if full:
+                flush()
+
+        def receive():
+            for message in self.iter_messages(sqs, batch_size, wait_time,
+                                              visibility_timeout, stop):
+                stats['received'] += 1
+                # The prefetched messages wait for the workers in flight
+                with lock:
+                    in_flight[message.id] = (message, time.time())
+                yield message
+
+        beater = threading.Thread(target=beat)
+        beater.setDaemon(True)
+        beater.start()
+        try:
+            for result in iter_parallel(process, receive(), workers=workers,
+                                        queue_size=batch_size):
+                if result.ok:
+                    stats['processed'] += 1
+                else:
+                    stats['failed'] += 1
+                    log.error("failed to process message %s: %s" %
+                              (result.item.id, result.error))
+        finally:
+            finished.set()
+            beater.join()
+            flush()
+        return stats
+
@@ -0,0 +1,121 @@
+"""
+Cache: Library for Cache
+------------------------
+
++-----------------------+----------+
+| This is the Cache common library. |
++-----------------------+----------+
+"""
+
+import time
+import threading
+
+import logging
+log = logging.getLogger(__name__)
+
+
+class TTLCache(object):
+
+    """
+    Dictionary shared by threads, whose items expire after a while
+    """
+
+    def __init__(self, ttl=60):
+        """
+        :type ttl: int
+        :param ttl: how many seconds an item is kept, forever if None
+        """
+        self.ttl = ttl
+        self._data = {}
+        self._lock = threading.RLock()
+
+    def _expiry(self, ttl):
+        if ttl is None:
+            ttl = self.ttl
+        if ttl is None:
+            return None
+        return time.time() + ttl
+
+    def get(self, key, default=None):
+        """
+        Get the item if it is not expired
+
+        :param key: the key of the item
+
+        :param default: the value returned if no such item
+        """
+        with self._lock:
+            try:
+                value, expiry = self._data[key]
+            except KeyError:
+                return default
+            if expiry is not None and expiry < time.time():
+                del self._data[key]
+                return default
+            return value
+
+    def set(self, key, value, ttl=None):
+        """
+        Set the item
+
+        :param key: the key of the item
+
+        :param value: the value of the item
+
+        :type ttl: int
+        :param ttl: how many seconds this item is kept, the default TTL
+            of this cache if None
+        """
+        with self._lock:
+            self._data[key] = (value, self._expiry(ttl))
+
+    def get_or_load(self, key, loader, ttl=None):
+        """
+        Get the item, or load and set it if missing or expired
+
+        :param key: the key of the item
+
+        :type loader: callable
+        :param loader: the function returning the value, without argument
+
+        :type ttl: int
+        :param ttl: how many seconds this item is kept
+        """
+        missing = object()
+        value = self.get(key, missing)
+        if value is not missing:
+            return value
+        with self._lock:
+            # Another thread may have loaded it while we were waiting
+            value = self.get(key, missing)
+            if value is missing:
+                value = loader()
+                self.set(key, value, ttl)
+            return value
+
+    def invalidate(self, key=None):
+        """
+        Remove the item, or all the items if the key is None
+        """
+        with self._lock:
+            if key is None:
+                self._data.clear()
+            else:
+                self._data.pop(key, None)
+
+    def invalidate_matching(self, match):
+        """
+        Remove all the items whose key matches
+
+        :type match: callable
+        :param match: the function taking a key and returning True/False
+        """
+        with self._lock:
+            for key in [k for k in self._data if match(k)]:
+                del self._data[key]
+
+    def __contains__(self, key):
+        missing = object()
+        return self.get(key, missing) is not missing
+
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
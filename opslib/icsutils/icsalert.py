@@ -7,18 +7,248 @@ IcsAlert: Library for Alert
 +------------------------+-------------+
 """
 
+import time
+import atexit
+import threading
 from time import strftime
 from time import gmtime
+from Queue import Queue, Empty, Full
 
 from opslib.icssns import IcsSNS
+from opslib.icsutils.parallel import RateLimiter
 from opslib.icsexception import IcsAlertException
 
 import logging
 log = logging.getLogger(__name__)
 
+# SNS limits the subject to 100 characters
+MAX_SUBJECT = 100
+
+# Stops the background thread of the dispatcher
+_STOP = object()
+
+_dispatcher = None
+_dispatcher_lock = threading.Lock()
+
+
+class _Flush(object):
+
+    """
+    Marker queued by :meth:`AlertDispatcher.flush`
+    """
+
+    def __init__(self):
+        self.done = threading.Event()
+
+
+class AlertDispatcher(object):
+
+    """
+    Publish the alerts in a background thread
+
+    The first alert of a subject is sent at once, and the following ones
+    with the same subject in the same topic are coalesced within the time
+    window into one digest message.  The alerts are dropped when the queue
+    is full, so that the callers are never blocked by SNS.  The queued
+    alerts are flushed when the process exits.
+    """
+
+    def __init__(self, window=60, queue_size=1000, rate=1, burst=5,
+                 max_digest=50):
+        """
+        :type window: int
+        :param window: how many seconds the alerts with the same subject
+            are coalesced
+
+        :type queue_size: int
+        :param queue_size: the number of alerts waiting to be published
+
+        :type rate: float
+        :param rate: the number of messages published per second per topic
+
+        :type burst: int
+        :param burst: the number of messages published at once per topic
+
+        :type max_digest: int
+        :param max_digest: the number of alerts kept in one digest message
+        """
+        self.window = window
+        self.rate = rate
+        self.burst = burst
+        self.max_digest = max_digest
+        self.stats = {'sent': 0, 'dropped': 0, 'coalesced': 0, 'failed': 0}
+        self.queue = Queue(maxsize=queue_size)
+        self._windows = {}
+        self._limiters = {}
+        self._lock = threading.Lock()
+        self._thread = threading.Thread(target=self._run)
+        self._thread.setDaemon(True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    def _count(self, key, n=1):
+        with self._lock:
+            self.stats[key] += n
+
+    def submit(self, sns, topic_arn, msg, subj):
+        """
+        Queue the alert to be published
+
+        :type sns: class
+        :param sns: the :class:`opslib.icssns.IcsSNS` to publish with
+
+        :type topic_arn: string
+        :param topic_arn: ``Amazon Resource Name`` for SNS
+
+        :type msg: string
+        :param msg: message contents
+
+        :type subj: string
+        :param subj: subject contents
+
+        :rtype: bool
+        :return: False if the alert is dropped as the queue is full
+        """
+        try:
+            self.queue.put_nowait((sns, topic_arn, msg, subj))
+        except Full:
+            self._count('dropped')
+            log.debug("alert dropped as the queue is full: %s" % subj)
+            return False
+        return True
+
+    def _publish(self, sns, topic_arn, msg, subj):
+        limiter = self._limiters.get(topic_arn)
+        if limiter is None:
+            limiter = RateLimiter(self.rate, self.burst)
+            self._limiters[topic_arn] = limiter
+        limiter.acquire()
+        try:
+            sns.publish(topic_arn, msg, subj)
+        except Exception, e:
+            self._count('failed')
+            log.error("failed to publish alert '%s': %s" % (subj, e))
+        else:
+            self._count('sent')
+
+    def _publish_digest(self, key, window):
+        topic_arn, subj = key
+        messages = window['messages']
+        count = len(messages) + window['skipped']
+        suffix = " [x%s]" % count
+        digest_subj = subj[:MAX_SUBJECT - len(suffix)] + suffix
+        lines = ["%s alerts coalesced in %ss:" % (count, self.window)]
+        lines.extend(messages)
+        if window['skipped']:
+            lines.append("... and %s more" % window['skipped'])
+        self._count('coalesced', count - 1)
+        self._publish(window['sns'], topic_arn, "\n\n".join(lines),
+                      digest_subj)
+
+    def _handle(self, sns, topic_arn, msg, subj):
+        key = (topic_arn, subj)
+        window = self._windows.get(key)
+        if window is None:
+            self._windows[key] = {'sns': sns, 'start': time.time(),
+                                  'messages': [], 'skipped': 0}
+            self._publish(sns, topic_arn, msg, subj)
+        elif len(window['messages']) < self.max_digest:
+            window['messages'].append(msg)
+        else:
+            window['skipped'] += 1
+
+    def _expire(self, force=False):
+        """
+        Publish the digests of the closed windows, all of them if forced
+
+        :rtype: float
+        :return: how many seconds until the next window closes
+        """
+        now = time.time()
+        wait = self.window
+        for key, window in self._windows.items():
+            left = window['start'] + self.window - now
+            if left > 0 and not force:
+                wait = min(wait, left)
+                continue
+            del self._windows[key]
+            if window['messages']:
+                self._publish_digest(key, window)
+        return wait
+
+    def _run(self):
+        while True:
+            timeout = self._expire()
+            try:
+                item = self.queue.get(timeout=max(timeout, 0.01))
+            except Empty:
+                continue
+            if item is _STOP:
+                self.queue.task_done()
+                break
+            try:
+                if isinstance(item, _Flush):
+                    # everything queued before has been handled
+                    self._expire(force=True)
+                    item.done.set()
+                else:
+                    self._handle(*item)
+            finally:
+                self.queue.task_done()
+
+    def flush(self, timeout=30):
+        """
+        Publish all the queued alerts and pending digests
+
+        :type timeout: int
+        :param timeout: how many seconds to wait at most
+
+        :rtype: bool
+        :return: True if all the alerts have been handled in time
+        """
+        marker = _Flush()
+        try:
+            self.queue.put(marker, timeout=timeout)
+        except Full:
+            return False
+        marker.done.wait(timeout)
+        return marker.done.isSet()
+
+    def close(self, timeout=30):
+        """
+        Flush the alerts and stop the background thread, which is done
+        when the process exits
+        """
+        if not self._thread.isAlive():
+            return
+        self.flush(timeout)
+        try:
+            self.queue.put(_STOP, timeout=timeout)
+        except Full:
+            return
+        self._thread.join(timeout)
+
+
+def get_dispatcher(**kwargs):
+    """
+    Get the alert dispatcher shared in this process
+
+    :param kwargs: the arguments of :class:`AlertDispatcher`, only used when
+        the dispatcher is created
+
+    :rtype: class
+    :return: the :class:`AlertDispatcher`
+    """
+    global _dispatcher
+    with _dispatcher_lock:
+        if _dispatcher is None:
+            _dispatcher = AlertDispatcher(**kwargs)
+        return _dispatcher
+
 
 class IcsAlert(object):
-    def __init__(self, region, topic, msg_prefix="", **kwargs):
+    def __init__(self, region, topic, msg_prefix="", dispatcher=None,
+                 **kwargs):
         """Generate and send alerts when exceptions occur
 
         :type region: str
@@ -32,6 +262,11 @@ class IcsAlert(object):
         :type msg_prefix: str
         :param msg_prefix: prefix of alert message
 
+        :type dispatcher: class
+        :param dispatcher: the :class:`AlertDispatcher` to send the alerts
+            in background, e.g. :func:`get_dispatcher`; the alerts are sent
+            synchronously if None
+
         """
         self.region = region
         self.sns = IcsSNS(region, **kwargs)
@@ -39,6 +274,13 @@ class IcsAlert(object):
         if self.arn is None:
             raise IcsAlertException("Cannot find topic: '%s'" % (topic))
         self.msg_prefix = msg_prefix
+        self.dispatcher = dispatcher
+
+    def _publish(self, msg, subj):
+        if self.dispatcher is None:
+            self.sns.publish(self.arn, msg, subj)
+        else:
+            self.dispatcher.submit(self.sns, self.arn, msg, subj)
 
     def sendAlert(self, msg, subj_result):
         """
@@ -53,7 +295,7 @@ class IcsAlert(object):
         ts = strftime("%Y-%m-%d %H:%M:%S UTC", gmtime())
         subj = "[%s] %s" % (subj_result, self.msg_prefix)
         msg = "[%s] [%s]: %s" % (ts, self.msg_prefix, msg)
-        self.sns.publish(self.arn, msg, subj)
+        self._publish(msg, subj)
 
     def sendHealthAlert(self, msg, subj):
         """
@@ -66,6 +308,6 @@ class IcsAlert(object):
         :param subj: subject of message
         """
 
-        self.sns.publish(self.arn, msg, subj)
+        self._publish(msg, subj)
 
 # vim: tabstop=4 shiftwidth=4 softtabstop=4
@@ -8,13 +8,15 @@ Misc: Library for Misc
 """
 
 import os
-import re
 import json
 import shlex
+import numbers
 import base64
 import random
 import socket
-from time import sleep, gmtime, strftime
+import tempfile
+import threading
+from time import time, sleep, gmtime, strftime
 from subprocess import Popen, PIPE, STDOUT
 from types import GeneratorType as generator
 from os.path import join as pathjoin
@@ -82,6 +84,35 @@ class Retry(object):
         return fn
 
 
+def wait_for(check, timeout=300, interval=1, max_interval=30):
+    """
+    Wait until the check passes, polling with exponential backoff
+
+    :type check: callable
+    :param check: the function without argument, returning True/False
+
+    :type timeout: int
+    :param timeout: how many seconds to wait at most
+
+    :type interval: int
+    :param interval: the first polling interval in seconds
+
+    :type max_interval: int
+    :param max_interval: the maximum polling interval in seconds
+
+    :rtype: bool
+    :return: True if the check passed, False if timed out
+    """
+    deadline = time() + timeout
+    while True:
+        if check():
+            return True
+        if time() + interval > deadline:
+            return False
+        sleep(interval)
+        interval = min(interval * 2, max_interval)
+
+
 def exec_shell(cmd):
     """
     Execute Shell Commands
@@ -362,6 +393,46 @@ def dict_merge(a, b):
     return result
 
 
+def iter_json(data, delimiter="/", path=""):
+    """
+    Iterate all the items in JSON data with their full paths
+
+    The data is walked iteratively in depth-first order, so deep nesting
+    will not hit the recursion limit. Empty items are skipped.
+
+    :type data: dict, list, element
+    :param data: JSON data
+
+    :type delimiter: string
+    :param delimiter: path delimiter for each JSON node
+
+    :type path: string
+    :param path: the parent path on this JSON data
+
+    :rtype: generator
+    :return: a generator of (path, value) for each item
+    """
+    stack = [(path, data)]
+    while stack:
+        path, data = stack.pop()
+        if not data:
+            continue
+        elif isinstance(data, dict):
+            prefix = path + delimiter
+            children = [(prefix + str(key), value)
+                        for key, value in data.iteritems()]
+        elif isinstance(data, list):
+            prefix = path + delimiter
+            children = [(prefix + str(index), value)
+                        for index, value in enumerate(data)]
+        else:
+            if path:
+                yield path, data
+            continue
+        children.reverse()
+        stack.extend(children)
+
+
 def traverse_json(data, delimiter="/", path="", output=None):
     """
     Traverse all the items in JSON data
@@ -380,21 +451,123 @@ def traverse_json(data, delimiter="/", path="", output=None):
     """
     if output is None:
         output = {}
-    if not data:
-        return output
-    elif isinstance(data, dict):
-        for element in data:
-            new_path = delimiter.join([path, str(element)])
-            output = traverse_json(data[element], path=new_path, output=output)
-    elif isinstance(data, list):
-        for element in data:
-            new_path = delimiter.join([path, str(data.index(element))])
-            output = traverse_json(element, path=new_path, output=output)
-    elif path:
-        output[path] = data
+    output.update(iter_json(data, delimiter=delimiter, path=path))
     return output
 
 
+def walk_json_index(data, prefixes=None):
+    """
+    Walk all the items in JSON data with index-agnostic paths
+
+    Each path is a tuple of the keys from the root, where any list
+    index is replaced with ``None``. Like :func:`iter_json`, empty
+    items are skipped.
+
+    :type data: dict, list, element
+    :param data: JSON data
+
+    :type prefixes: set
+    :param prefixes: if specified, only walk into the paths in this set
+
+    :rtype: generator
+    :return: a generator of (path, value)
+    """
+    stack = [((), data)]
+    while stack:
+        path, data = stack.pop()
+        if not data:
+            continue
+        elif isinstance(data, dict):
+            children = [(path + (key,), value)
+                        for key, value in data.iteritems()]
+        elif isinstance(data, list):
+            index_path = path + (None,)
+            children = [(index_path, value) for value in data]
+        else:
+            if path:
+                yield path, data
+            continue
+        if prefixes is not None:
+            children = [c for c in children if c[0] in prefixes]
+        stack.extend(children)
+
+
+class ResourceFilter(object):
+
+    """
+    Filter compiled from JSON data, to match resources in JSON format
+
+    A resource matches when each item in the filter can be found in the
+    resource at the same path, whatever the list indexes are.
+    """
+
+    def __init__(self, filter=None):
+        """
+        Compile the filter
+
+        :type filter: dict
+        :param filter: describe the filter in details
+        """
+        self.required = {}
+        for path, value in walk_json_index(filter):
+            self.required.setdefault(path, set()).add(value)
+
+        self.prefixes = set()
+        for path in self.required:
+            for i in xrange(1, len(path) + 1):
+                self.prefixes.add(path[:i])
+
+    def match(self, item):
+        """
+        Check whether the resource matches this filter
+
+        :type item: dict
+        :param item: resource data in JSON format
+
+        :rtype: bool
+        :return: True/False
+        """
+        if not self.required:
+            return True
+        found = {}
+        for path, value in walk_json_index(item, self.prefixes):
+            if path in self.required:
+                found.setdefault(path, set()).add(value)
+        for path, values in self.required.iteritems():
+            if not values.issubset(found.get(path, ())):
+                return False
+        return True
+
+
+def iter_resource_from_json(names=None, filter=None, items=None):
+    """
+    Filter the resource with specified filter on JSON data, one by one
+
+    :type names: list
+    :param names: specify the list of resoure names to filter
+        Ex: ["AutoScalingGroupName", "LaunchConfigurationName"]
+
+    :type filter: dict or ResourceFilter
+    :param filter: describe the filter in details
+
+    :type items: iterable
+    :param items: resource items in JSON format, can be a generator
+
+    :rtype: generator
+    :return: a generator of the names for filtered resources
+    """
+    if names is None:
+        names = []
+    if items is None:
+        items = []
+    if not isinstance(filter, ResourceFilter):
+        filter = ResourceFilter(filter)
+
+    for item in items:
+        if filter.match(item):
+            yield tuple([item.get(name, None) for name in names])
+
+
 def filter_resource_from_json(names=None, filter=None, raw_data=None):
     """
     Filter the resource with specified filter on JSON data
@@ -412,47 +585,89 @@ def filter_resource_from_json(names=None, filter=None, raw_data=None):
     :rtype: list
     :return: a list containing all the names for filtered resources
     """
-    if names is None:
-        names = []
-    if filter is None:
-        filter = {}
     if raw_data is None:
         raw_data = {}
 
-    data = {}
-    for item in raw_data[raw_data.keys()[0]]:
-        t = tuple([item.get(name, None) for name in names])
-        data[t] = traverse_json(item)
-
-    finder = traverse_json(filter)
-
-    resources = []
-    pattern = "\/\d\/"
-    sample = "/index/"
-    for k1, v1 in data.iteritems():
-        for k2, v2 in finder.iteritems():
-            flag = False
-            for k3, v3 in v1.iteritems():
-                k_1 = re.sub(pattern, sample, k2)
-                k_2 = re.sub(pattern, sample, k3)
-                if k_1 == k_2 and v2 == v3:
-                    flag = True
-                    break
-            if not flag:
-                break
-        else:
-            resources.append(k1)
-    return resources
+    items = raw_data[raw_data.keys()[0]] if raw_data else []
+    return list(iter_resource_from_json(names, filter=filter, items=items))
+
+
+# Process-wide cache of botocore objects, see init_botocore_service
+_botocore_lock = threading.RLock()
+_botocore_session = None
+_botocore_services = {}
+_botocore_members = {}
+
+
+def get_botocore_session():
+    """
+    Get the botocore session shared by this process
+    """
+    global _botocore_session
+    if _botocore_session is None:
+        with _botocore_lock:
+            if _botocore_session is None:
+                _botocore_session = botocore.session.get_session()
+    return _botocore_session
+
+
+def reset_botocore_cache():
+    """
+    Drop the cached botocore session, services and endpoints,
+    e.g. after the credentials changed
+    """
+    global _botocore_session
+    with _botocore_lock:
+        _botocore_session = None
+        _botocore_services.clear()
+        _botocore_members.clear()
 
 
 def init_botocore_service(name, region):
     """
     Initialize the proper service with botocore
+
+    The service and endpoint are cached for each (name, region), so
+    the service model is only loaded once in this process.
     """
-    session = botocore.session.get_session()
-    service = session.get_service(name)
-    endpoint = service.get_endpoint(region)
-    return service, endpoint
+    key = (name, region)
+    try:
+        return _botocore_services[key]
+    except KeyError:
+        pass
+    with _botocore_lock:
+        if key not in _botocore_services:
+            service = get_botocore_session().get_service(name)
+            endpoint = service.get_endpoint(region)
+            _botocore_services[key] = (service, endpoint)
+        return _botocore_services[key]
+
+
+def get_operation_members(service_name, cmd_name):
+    """
+    Get the input parameter names of the botocore operation (memoised)
+
+    :type service_name: string
+    :param service_name: botocore service name, like "autoscaling"
+
+    :type cmd_name: string
+    :param cmd_name: operation name, like "UpdateAutoScalingGroup"
+
+    :rtype: dict
+    :return: the input members in the botocore data model
+    """
+    key = (service_name, cmd_name)
+    try:
+        return _botocore_members[key]
+    except KeyError:
+        pass
+    with _botocore_lock:
+        if key not in _botocore_members:
+            path = '/'.join(['aws', service_name, 'operations',
+                            cmd_name, 'input', 'members'])
+            _botocore_members[key] = get_botocore_data(
+                get_botocore_session(), path)
+        return _botocore_members[key]
 
 
 def check_error(response_data):
@@ -502,15 +717,49 @@ def drop_null_items(obj):
     return obj
 
 
+# Memo of xform_name, the same key names are converted on every request
+_xform_names = {}
+
+
 def convert_keyname(obj):
     for key in obj.keys():
-        new_key = xform_name(key)
+        try:
+            new_key = _xform_names[key]
+        except KeyError:
+            new_key = _xform_names.setdefault(key, xform_name(key))
         if new_key != key:
             obj[new_key] = obj[key]
             del obj[key]
     return obj
 
 
+def drop_null_copy(data):
+    """
+    Copy the JSON data with the null items dropped from each dict,
+    the same as a round-trip through JSON with :func:`drop_null_items`
+
+    :type data: dict, list, element
+    :param data: JSON data
+
+    :rtype: dict, list, element
+    :return: a new copy of the data
+    """
+    if isinstance(data, dict):
+        result = {}
+        for key, value in data.iteritems():
+            value = drop_null_copy(value)
+            # The longs are read back as ints, so they are kept like ints
+            if isinstance(value, numbers.Integral) or value:
+                if not isinstance(key, basestring):
+                    # JSON object keys are always strings
+                    key = json.dumps(key)
+                result[key] = value
+        return result
+    elif isinstance(data, (list, tuple)):
+        return [drop_null_copy(item) for item in data]
+    return data
+
+
 def keyname_format(fp_json):
     """
     Convert the key name of JSON data: from camel case to a "pythonic" name.
@@ -538,15 +787,14 @@ def keyname_formatd(dict_json):
     :type dict_json: dict
     :param dict_json: JSON data
     """
-    return convert_keyname(json.loads(json.dumps(dict_json),
-                           object_hook=drop_null_items))
+    return convert_keyname(drop_null_copy(dict_json))
 
 
 def clean_empty_items(dict_json):
     """
     Clean Empty Items in the Dictionary: None, {}, [], ""
     """
-    return json.loads(json.dumps(dict_json), object_hook=drop_null_items)
+    return drop_null_copy(dict_json)
 
 
 def get_search_path(search_paths):
@@ -667,10 +915,7 @@ def fetch_used_params(service_name, cmd_name, params):
     """
     if not isinstance(params, dict):
         return None
-    path = '/'.join(['aws', service_name, 'operations',
-                    cmd_name, 'input', 'members'])
-    session = botocore.session.get_session()
-    required_params = get_botocore_data(session, path)
+    required_params = get_operation_members(service_name, cmd_name)
     used_params = {}
     for key, value in params.iteritems():
         if key in required_params:
@@ -678,6 +923,38 @@ def fetch_used_params(service_name, cmd_name, params):
     return keyname_formatd(used_params)
 
 
+def write_file_atomic(path, data, mode=None):
+    """
+    Write the file atomically: the data is written into a temporary file
+    in the same directory, which is then renamed, so that readers never
+    see a partial file
+
+    :type path: string
+    :param path: the file path
+
+    :type data: string
+    :param data: the file contents
+
+    :type mode: int
+    :param mode: the file permission, 0600 of the temporary file if None
+    """
+    dirname = os.path.dirname(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(
+        dir=dirname, prefix=".%s." % os.path.basename(path))
+    try:
+        with os.fdopen(fd, 'wb') as fp:
+            fp.write(data)
+            fp.flush()
+            os.fsync(fp.fileno())
+        if mode is not None:
+            os.chmod(tmp_path, mode)
+        os.rename(tmp_path, path)
+    except Exception:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
 def gen_timestamp(format="%Y%m%d-%H%M%S"):
     return strftime(format, gmtime())
 
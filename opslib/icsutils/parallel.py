@@ -0,0 +1,284 @@
+"""
+Parallel: Library for Parallel
+------------------------------
+
++--------------------------+-----------+
+| This is the Parallel common library. |
++--------------------------+-----------+
+"""
+
+import sys
+import time
+import threading
+from Queue import Queue
+
+from opslib.icsexception import IcsException
+
+import logging
+log = logging.getLogger(__name__)
+
+# Marks the end of the input stream for a worker thread
+_SENTINEL = object()
+
+
+class TaskResult(object):
+
+    """
+    Outcome of a single task run by the thread pool
+    """
+
+    def __init__(self, item, result=None, error=None, elapsed=0.0):
+        self.item = item
+        self.result = result
+        self.error = error
+        self.elapsed = elapsed
+
+    @property
+    def ok(self):
+        return self.error is None
+
+    def __repr__(self):
+        if self.ok:
+            return '<TaskResult:%s OK %.3fs>' % (self.item, self.elapsed)
+        return '<TaskResult:%s ERROR %s>' % (self.item, self.error)
+
+
+class RateLimiter(object):
+
+    """
+    Token bucket shared by threads, to limit the rate of API calls
+    """
+
+    def __init__(self, rate, burst=None):
+        """
+        :type rate: float
+        :param rate: the number of calls allowed per second,
+            no limit if it is 0 or None
+
+        :type burst: int
+        :param burst: the number of calls allowed at once, ``rate`` by default
+        """
+        self.rate = float(rate or 0)
+        if burst is None:
+            burst = max(self.rate, 1)
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.time()
+        self.lock = threading.Lock()
+
+    def acquire(self, block=True):
+        """
+        Take one token, waiting for it if needed
+
+        :type block: bool
+        :param block: whether to wait when no token left
+
+        :rtype: bool
+        :return: True if the call is allowed
+        """
+        if self.rate <= 0:
+            return True
+        while True:
+            with self.lock:
+                now = time.time()
+                self.tokens = min(self.burst, self.tokens +
+                                  (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return True
+                if not block:
+                    return False
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+    def wrap(self, func):
+        """
+        Wrap the function, so that each call takes one token first
+        """
+        def limited(*args, **kwargs):
+            self.acquire()
+            return func(*args, **kwargs)
+        return limited
+
+
+def run_task(func, item):
+    """
+    Run the function on one item and record the outcome
+
+    :type func: callable
+    :param func: the function taking the item as its only argument
+
+    :param item: the item to process
+
+    :rtype: class
+    :return: the :class:`TaskResult` for this item
+    """
+    start = time.time()
+    try:
+        result = func(item)
+    except Exception, e:
+        log.debug("task '%s' failed: %s" % (item, e))
+        return TaskResult(item, error=e, elapsed=time.time() - start)
+    return TaskResult(item, result=result, elapsed=time.time() - start)
+
+
+def iter_parallel(func, items, workers=4, queue_size=None):
+    """
+    Run the function over the items with a bounded pool of threads,
+    yielding the results in the order they complete
+
+    The items are consumed lazily, so at most ``workers + queue_size``
+    items are held in memory at any time.  Exceptions raised by the
+    function are recorded in :class:`TaskResult` and do not stop the pool.
+
+    :type func: callable
+    :param func: the function taking one item as its only argument
+
+    :type items: iterable
+    :param items: the items to process, can be a generator
+
+    :type workers: int
+    :param workers: the number of concurrent threads
+
+    :type queue_size: int
+    :param queue_size: the number of items prefetched, ``workers`` by default
+
+    :rtype: generator
+    :return: a generator of :class:`TaskResult`
+    """
+    workers = max(int(workers), 1)
+    if queue_size is None:
+        queue_size = workers
+    inbox = Queue(maxsize=queue_size)
+    outbox = Queue(maxsize=workers)
+    stopped = threading.Event()
+    failure = []
+
+    def feed():
+        try:
+            for item in items:
+                if stopped.isSet():
+                    break
+                inbox.put(item)
+        except Exception:
+            failure.append(sys.exc_info())
+        for i in xrange(workers):
+            inbox.put(_SENTINEL)
+
+    def work():
+        while True:
+            item = inbox.get()
+            if item is _SENTINEL:
+                break
+            if not stopped.isSet():
+                outbox.put(run_task(func, item))
+        outbox.put(_SENTINEL)
+
+    threads = [threading.Thread(target=feed)]
+    threads.extend([threading.Thread(target=work) for i in xrange(workers)])
+    for thread in threads:
+        thread.setDaemon(True)
+        thread.start()
+
+    running = workers
+    try:
+        while running:
+            result = outbox.get()
+            if result is _SENTINEL:
+                running -= 1
+            else:
+                yield result
+    finally:
+        # Consumer exits early: drain the pool without running new tasks
+        stopped.set()
+        while running:
+            if outbox.get() is _SENTINEL:
+                running -= 1
+
+    if failure:
+        exc_type, exc_value, exc_tb = failure[0]
+        raise exc_type, exc_value, exc_tb
+
+
+def run_parallel(func, items, workers=4):
+    """
+    Run the function over the items with a bounded pool of threads
+
+    :type func: callable
+    :param func: the function taking one item as its only argument
+
+    :type items: iterable
+    :param items: the items to process
+
+    :type workers: int
+    :param workers: the number of concurrent threads
+
+    :rtype: list
+    :return: a list of :class:`TaskResult`, in the order of the items
+    """
+    items = list(items)
+    results = [None] * len(items)
+    indexed = lambda pair: func(pair[1])
+    for task in iter_parallel(indexed, enumerate(items), workers=workers):
+        index, item = task.item
+        task.item = item
+        results[index] = task
+    return results
+
+
+def run_ordered(func, items, depends=None, workers=4):
+    """
+    Run the function over the items with a bounded pool of threads,
+    starting each item only after all the items it depends on succeeded
+
+    The items are run in waves: each wave contains all the items whose
+    dependencies have completed.  An item is not run if any of its
+    dependencies failed, and gets an :class:`IcsException` instead.
+
+    :type func: callable
+    :param func: the function taking one item as its only argument
+
+    :type items: iterable
+    :param items: the items to process, should be hashable like names
+
+    :type depends: dict
+    :param depends: a dict of item to the list of items it depends on,
+        the dependencies not in the items are ignored
+
+    :type workers: int
+    :param workers: the number of concurrent threads
+
+    :rtype: dict
+    :return: a dict of item to its :class:`TaskResult`
+    """
+    items = list(items)
+    if depends is None:
+        depends = {}
+    known = set(items)
+    results = {}
+    pending = items
+    while pending:
+        ready, waiting = [], []
+        for item in pending:
+            deps = [d for d in depends.get(item, []) if d in known]
+            failed = [d for d in deps if d in results and not results[d].ok]
+            if failed:
+                results[item] = TaskResult(item, error=IcsException(
+                    "dependency failed: %s" % ", ".join(map(str, failed))))
+            elif all(d in results for d in deps):
+                ready.append(item)
+            else:
+                waiting.append(item)
+        if not ready:
+            if waiting and len(waiting) == len(pending):
+                raise IcsException("circular dependencies among: %s" %
+                                   ", ".join(map(str, waiting)))
+            pending = waiting
+            continue
+        for result in run_parallel(func, ready, workers=workers):
+            results[result.item] = result
+        pending = waiting
+    return results
+
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
@@ -0,0 +1,238 @@
+"""
+Profiler: Library for Profiler
+------------------------------
+
++--------------------------+-----------+
+| This is the Profiler common library. |
++--------------------------+-----------+
+"""
+
+import sys
+import json
+import time
+import atexit
+import threading
+from functools import wraps
+
+import boto.utils
+import boto.connection
+
+from opslib.icsutils import misc
+
+import logging
+log = logging.getLogger(__name__)
+
+# The profiler enabled in this process, None if disabled
+_profiler = None
+
+
+class Profiler(object):
+
+    """
+    Record the wall time, the API calls and the bytes received of the
+    steps run in this process, e.g. the boot steps of :class:`IcsMeta`
+
+    The calls made by the boto connections and the metadata requests are
+    counted for all the steps running at that time, including the calls
+    from other threads, so the counts of a step include its sub-steps.
+    """
+
+    def __init__(self, path=None):
+        """
+        :type path: string
+        :param path: the JSON file to write the timeline into,
+            the standard error if None
+        """
+        self.path = path
+        self.started = time.time()
+        self.steps = []
+        self.calls = 0
+        self.bytes = 0
+        self._active = []
+        self._lock = threading.Lock()
+        self._originals = None
+
+    def record_call(self, nbytes=0):
+        """
+        Count one API call with the bytes received
+
+        :type nbytes: int
+        :param nbytes: the bytes received
+        """
+        with self._lock:
+            self.calls += 1
+            self.bytes += nbytes
+            for step in self._active:
+                step['calls'] += 1
+                step['bytes'] += nbytes
+
+    def step(self, name):
+        """
+        Run a step, to be used in the ``with`` statement
+
+        :type name: string
+        :param name: the step name
+        """
+        return _Step(self, name)
+
+    def timeline(self):
+        """
+        Get the timeline of the completed steps
+
+        :rtype: dict
+        :return: the 'steps' ordered by their 'start' offset in seconds,
+            each with its 'elapsed' seconds, 'calls' and 'bytes', and the
+            totals of this process
+        """
+        with self._lock:
+            steps = sorted(self.steps, key=lambda step: step['start'])
+            return {'started': self.started,
+                    'elapsed': time.time() - self.started,
+                    'calls': self.calls,
+                    'bytes': self.bytes,
+                    'steps': steps}
+
+    def dump(self):
+        """
+        Write the timeline as JSON into the file or the standard error
+        """
+        data = json.dumps(self.timeline(), indent=2, sort_keys=True)
+        if self.path is None:
+            sys.stderr.write(data + "\n")
+            return
+        try:
+            misc.write_file_atomic(self.path, data, mode=0644)
+        except (IOError, OSError), e:
+            log.error("Failed to write the timeline into '%s': %s" %
+                      (self.path, e))
+
+    def install(self):
+        """
+        Hook the boto connections and the metadata requests to count
+        the API calls
+        """
+        if self._originals is not None:
+            return
+        mexe = boto.connection.AWSAuthConnection._mexe
+        retry_url = boto.utils.retry_url
+        misc_retry_url = misc.retry_url
+        self._originals = (mexe, retry_url, misc_retry_url)
+        profiler = self
+
+        def counted_mexe(conn, *args, **kwargs):
+            response = mexe(conn, *args, **kwargs)
+            try:
+                nbytes = int(response.getheader('content-length') or 0)
+            except (AttributeError, ValueError):
+                nbytes = 0
+            profiler.record_call(nbytes)
+            return response
+
+        def counted_retry_url(retry_url):
+            def fn(*args, **kwargs):
+                result = retry_url(*args, **kwargs)
+                profiler.record_call(len(result or ''))
+                return result
+            return fn
+
+        boto.connection.AWSAuthConnection._mexe = counted_mexe
+        boto.utils.retry_url = counted_retry_url(retry_url)
+        misc.retry_url = counted_retry_url(misc_retry_url)
+
+    def uninstall(self):
+        """
+        Remove the hooks set by :meth:`install`
+        """
+        if self._originals is None:
+            return
+        mexe, retry_url, misc_retry_url = self._originals
+        boto.connection.AWSAuthConnection._mexe = mexe
+        boto.utils.retry_url = retry_url
+        misc.retry_url = misc_retry_url
+        self._originals = None
+
+
+class _Step(object):
+
+    """
+    Context of one step recorded by :class:`Profiler`
+    """
+
+    def __init__(self, profiler, name):
+        self.profiler = profiler
+        self.name = name
+
+    def __enter__(self):
+        profiler = self.profiler
+        self.entry = {'step': self.name,
+                      'thread': threading.current_thread().name,
+                      'start': time.time() - profiler.started,
+                      'calls': 0, 'bytes': 0}
+        with profiler._lock:
+            profiler._active.append(self.entry)
+        return self.entry
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        profiler = self.profiler
+        entry = self.entry
+        entry['elapsed'] = time.time() - profiler.started - entry['start']
+        if exc_type is not None:
+            entry['error'] = str(exc_value)
+        with profiler._lock:
+            profiler._active.remove(entry)
+            profiler.steps.append(entry)
+        log.debug("step '%s' took %.3fs with %s calls" %
+                  (self.name, entry['elapsed'], entry['calls']))
+        return False
+
+
+def enable_profiler(path=None):
+    """
+    Enable the profiler in this process, whose timeline is written
+    when the process exits
+
+    :type path: string
+    :param path: the JSON file to write the timeline into,
+        the standard error if None
+
+    :rtype: class
+    :return: the :class:`Profiler`
+    """
+    global _profiler
+    if _profiler is None:
+        _profiler = Profiler(path)
+        _profiler.install()
+        atexit.register(_profiler.dump)
+    return _profiler
+
+
+def get_profiler():
+    """
+    Get the profiler enabled in this process
+
+    :rtype: class
+    :return: the :class:`Profiler`, None if disabled
+    """
+    return _profiler
+
+
+def profile_step(name):
+    """
+    Decorator recording each call of the function as a step of the
+    profiler, doing nothing if the profiler is disabled
+
+    :type name: string
+    :param name: the step name
+    """
+    def decorator(func):
+        @wraps(func)
+        def fn(*args, **kwargs):
+            profiler = _profiler
+            if profiler is None:
+                return func(*args, **kwargs)
+            with profiler.step(name):
+                return func(*args, **kwargs)
+        return fn
+    return decorator
+
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
@@ -11,6 +11,7 @@ from StringIO import StringIO
 
 import errno
 import glob
+import hashlib
 import os
 import os.path
 import platform
@@ -126,6 +127,22 @@ def copy(src, dest):
     shutil.copy2(src, dest)
 
 
+def md5sum(path, chunk_size=65536):
+    """
+    Get the MD5 hex digest of the file, None if it does not exist
+    """
+    md5 = hashlib.md5()
+    try:
+        with open(path, 'rb') as fh:
+            for chunk in iter(lambda: fh.read(chunk_size), ''):
+                md5.update(chunk)
+    except IOError as e:
+        if e.errno != errno.ENOENT:
+            raise e
+        return None
+    return md5.hexdigest()
+
+
 def chmod(path, mode):
     real_mode = safe_int(mode)
     if path and real_mode:
@@ -25,9 +25,173 @@
 default_ttl = 60
 
 import copy
+import json
 from boto.exception import TooManyRecordsException
 from boto.route53.record import ResourceRecordSets
 from boto.route53.status import Status
+from opslib.icsutils.parallel import iter_parallel
+
+
+def record_to_dict(record):
+    """
+    Convert a boto Record into a dict in the Route53 API layout
+
+    :type record: Record
+    :param record: A ResourceRecord (e.g. returned by find_records)
+
+    :rtype: dict
+    :return: a dict like ``{"Name": ..., "Type": ..., "TTL": ...}``
+    """
+    data = {'Name': record.name, 'Type': record.type}
+    if record.alias_dns_name:
+        data['AliasTarget'] = {'HostedZoneId': record.alias_hosted_zone_id,
+                               'DNSName': record.alias_dns_name,
+                               'EvaluateTargetHealth':
+                               bool(record.alias_evaluate_target_health)}
+    else:
+        data['TTL'] = int(record.ttl)
+        data['ResourceRecords'] = list(record.resource_records)
+    if record.identifier is not None:
+        data['SetIdentifier'] = record.identifier
+    if record.weight is not None:
+        data['Weight'] = record.weight
+    if record.region is not None:
+        data['Region'] = record.region
+    if record.failover is not None:
+        data['Failover'] = record.failover
+    if record.health_check is not None:
+        data['HealthCheckId'] = record.health_check
+    return data
+
+
+def record_to_bind(record):
+    """
+    Convert a boto Record into lines of a BIND zone file
+
+    Alias and routing policy records have no BIND representation,
+    so they are written as comments.
+
+    :type record: Record
+    :param record: A ResourceRecord (e.g. returned by find_records)
+
+    :rtype: list
+    :return: a list of strings, one for each line
+    """
+    if record.alias_dns_name or record.identifier is not None:
+        return ["; %s" % json.dumps(record_to_dict(record), sort_keys=True)]
+    return ["%s\t%s\tIN\t%s\t%s" % (record.name, record.ttl,
+                                        record.type, value)
+            for value in record.resource_records]
+
+
+def parse_jsonl(fp):
+    """
+    Read the records from a JSON Lines file, one record per line
+
+    :type fp: file
+    :param fp: opened file object
+
+    :rtype: generator
+    :return: a generator of record dicts
+    """
+    for line in fp:
+        line = line.strip()
+        if line:
+            yield json.loads(line)
+
+
+def _strip_comment(line):
+    """
+    Strip the comment from a line of BIND zone file, except in quotes
+    """
+    quoted = False
+    for index, char in enumerate(line):
+        if char == '"':
+            quoted = not quoted
+        elif char == ';' and not quoted:
+            return line[:index]
+    return line
+
+
+def parse_bind(fp, origin=None, ttl=default_ttl):
+    """
+    Read the records from a BIND zone file
+
+    Only one record per line is supported, and the lines of the same
+    record set should be adjacent, as written by :func:`record_to_bind`.
+
+    :type fp: file
+    :param fp: opened file object
+
+    :type origin: str
+    :param origin: the default ``$ORIGIN`` of this zone
+
+    :type ttl: int
+    :param ttl: the default ``$TTL`` of this zone
+
+    :rtype: generator
+    :return: a generator of record dicts
+    """
+    current = None
+    for line in fp:
+        line = _strip_comment(line).strip()
+        if not line:
+            continue
+        name, rest = (line.split(None, 1) + [''])[:2]
+        if name.upper() == '$ORIGIN':
+            origin = rest.strip()
+            continue
+        elif name.upper() == '$TTL':
+            ttl = int(rest)
+            continue
+
+        if name == '@':
+            name = origin
+        elif not name.endswith('.') and origin:
+            name = '.'.join([name, origin])
+        record_ttl = ttl
+        field, rest = rest.split(None, 1)
+        if field.isdigit():
+            record_ttl = int(field)
+            field, rest = rest.split(None, 1)
+        if field.upper() == 'IN':
+            field, rest = rest.split(None, 1)
+        record_type = field.upper()
+        value = rest.strip()
+
+        if current is not None and current['Name'] == name \
+                and current['Type'] == record_type:
+            current['ResourceRecords'].append(value)
+            continue
+        if current is not None:
+            yield current
+        current = {'Name': name, 'Type': record_type, 'TTL': record_ttl,
+                   'ResourceRecords': [value]}
+    if current is not None:
+        yield current
+
+
+def batch_records(records, size):
+    """
+    Group the records into lists of the given size
+
+    :type records: iterable
+    :param records: the record dicts
+
+    :type size: int
+    :param size: the maximum number of records in each batch
+
+    :rtype: generator
+    :return: a generator of lists
+    """
+    batch = []
+    for record in records:
+        batch.append(record)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
 
 
 class Zone(object):
@@ -296,6 +460,154 @@ class Zone(object):
                                identifier=identifier,
                                comment=comment)
 
+    def iter_records(self, page_size=100):
+        """
+        Iterate all records in this zone, one page at a time, so that
+        only one page of records is held in memory.
+
+        :type page_size: int
+        :param page_size: the number of records fetched in each request
+
+        :rtype: generator
+        :return: a generator of ResourceRecord
+        """
+        kwargs = {}
+        while True:
+            page = self.route53connection.get_all_rrsets(
+                self.id, maxitems=page_size, **kwargs)
+            truncated = page.is_truncated
+            # Walk the pages here, not inside ResourceRecordSets.__iter__
+            page.is_truncated = False
+            for record in page:
+                yield record
+            if not truncated:
+                break
+            kwargs = {'name': page.next_record_name,
+                      'type': page.next_record_type,
+                      'identifier': page.next_record_identifier}
+
+    def export_records(self, fp, format="bind", page_size=100):
+        """
+        Export all records in this zone into a file.
+
+        :type fp: file
+        :param fp: opened file object to write
+
+        :type format: str
+        :param format: "bind" for BIND zone file, "jsonl" for JSON Lines.
+            Only JSON Lines keeps the alias, weighted, latency and failover
+            records with their health checks; the geolocation records are
+            not supported by boto.
+
+        :type page_size: int
+        :param page_size: the number of records fetched in each request
+
+        :rtype: int
+        :return: the number of exported records
+        """
+        if format not in ("bind", "jsonl"):
+            raise ValueError("Invalid format: 'bind' or 'jsonl', not '%s'"
+                             % format)
+        if format == "bind":
+            fp.write("$ORIGIN %s\n" % self.name)
+        count = 0
+        for record in self.iter_records(page_size=page_size):
+            if format == "bind":
+                lines = record_to_bind(record)
+            else:
+                lines = [json.dumps(record_to_dict(record), sort_keys=True)]
+            for line in lines:
+                fp.write(line + "\n")
+            count += 1
+        return count
+
+    def _batch_changes(self, batch, action="CREATE", comment=""):
+        """
+        Build the change request of a batch of record dicts.
+        Returns a ResourceRecordSets object.
+        """
+        changes = ResourceRecordSets(self.route53connection, self.id, comment)
+        for data in batch:
+            alias = data.get('AliasTarget')
+            evaluate_target_health = None
+            if alias:
+                # Required by Route53 in each AliasTarget
+                evaluate_target_health = alias.get('EvaluateTargetHealth',
+                                                   False)
+            else:
+                alias = {}
+            change = changes.add_change(
+                action, data['Name'], data['Type'],
+                ttl=data.get('TTL', default_ttl),
+                alias_hosted_zone_id=alias.get('HostedZoneId'),
+                alias_dns_name=alias.get('DNSName'),
+                identifier=data.get('SetIdentifier'),
+                weight=data.get('Weight'),
+                region=data.get('Region'),
+                alias_evaluate_target_health=evaluate_target_health,
+                health_check=data.get('HealthCheckId'),
+                failover=data.get('Failover'))
+            for value in data.get('ResourceRecords', []):
+                change.add_value(value)
+        return changes
+
+    def _commit_batch(self, batch, action="CREATE", comment=""):
+        """
+        Commit a batch of record dicts in one change request.
+        Returns a Status object.
+        """
+        changes = self._batch_changes(batch, action, comment)
+        return Status(self.route53connection, self._commit(changes))
+
+    def import_records(self, fp, format="jsonl", batch_size=100, workers=4,
+                       action="CREATE", comment=""):
+        """
+        Import the records from a file into this zone.
+
+        The file is read lazily and sent as change requests of
+        ``batch_size`` records each, with at most ``workers`` requests
+        committed concurrently.  SOA and NS records of the zone apex are
+        skipped, as they already exist in the hosted zone.
+
+        :type fp: file
+        :param fp: opened file object to read
+
+        :type format: str
+        :param format: "bind" for BIND zone file, "jsonl" for JSON Lines
+
+        :type batch_size: int
+        :param batch_size: the number of records in each change request
+
+        :type workers: int
+        :param workers: the number of concurrent change requests
+
+        :type action: str
+        :param action: the change action, "CREATE" or "UPSERT"
+
+        :type comment: str
+        :param comment: A comment that will be stored with the change.
+
+        :rtype: list
+        :return: a list of :class:`opslib.icsutils.parallel.TaskResult`,
+            one for each batch, with the Status object as the result
+        """
+        if format == "bind":
+            records = parse_bind(fp, origin=self.name)
+        elif format == "jsonl":
+            records = parse_jsonl(fp)
+        else:
+            raise ValueError("Invalid format: 'bind' or 'jsonl', not '%s'"
+                             % format)
+
+        name = self.name.lower()
+        records = (r for r in records
+                   if not (r['Type'] in ('SOA', 'NS')
+                           and r['Name'].lower() == name))
+
+        commit = lambda batch: self._commit_batch(batch, action, comment)
+        return list(iter_parallel(commit, batch_records(records, batch_size),
+                                  workers=workers))
+
     def find_all_records(self):
         """
         Search all records in this zone.
@@ -0,0 +1,92 @@
+#!/usr/bin/env python
+"""
+Benchmark for filtering Auto-Scaling Groups in JSON format
+
+Usage: python test/benchmark/bench_filter.py [--legacy]
+"""
+
+import re
+import sys
+import time
+
+from opslib.icsutils.misc import traverse_json
+from opslib.icsutils.misc import filter_resource_from_json
+
+NAMES = ["AutoScalingGroupName", "LaunchConfigurationName"]
+FILTER = {"Tags": [{"Key": "Owner", "Value": "Production"}]}
+
+
+def make_groups(count, tags=8):
+    # Keep list indexes in one digit: the legacy filter cannot match more
+    groups = []
+    for i in xrange(count):
+        group = {
+            "AutoScalingGroupName": "group-%s" % i,
+            "LaunchConfigurationName": "lc-%s" % i,
+            "MinSize": 1,
+            "MaxSize": 4,
+            "AvailabilityZones": ["us-east-1a", "us-east-1b"],
+            "Instances": [{"InstanceId": "i-%08x" % (i * 4 + n),
+                           "HealthStatus": "Healthy",
+                           "LifecycleState": "InService"}
+                          for n in xrange(4)],
+            "Tags": [{"Key": "Tag%s" % n, "Value": "Value%s" % n}
+                     for n in xrange(tags)],
+        }
+        owner = "Production" if i % 10 == 0 else "Development"
+        group["Tags"].append({"Key": "Owner", "Value": owner})
+        groups.append(group)
+    return {"AutoScalingGroups": groups}
+
+
+def legacy_filter(names, filter, raw_data):
+    # The nested-loop filter before ResourceFilter, kept for comparison
+    data = {}
+    for item in raw_data[raw_data.keys()[0]]:
+        t = tuple([item.get(name, None) for name in names])
+        data[t] = traverse_json(item)
+    finder = traverse_json(filter)
+    resources = []
+    for k1, v1 in data.iteritems():
+        for k2, v2 in finder.iteritems():
+            flag = False
+            for k3, v3 in v1.iteritems():
+                k_1 = re.sub("\/\d\/", "/index/", k2)
+                k_2 = re.sub("\/\d\/", "/index/", k3)
+                if k_1 == k_2 and v2 == v3:
+                    flag = True
+                    break
+            if not flag:
+                break
+        else:
+            resources.append(k1)
+    return resources
+
+
+def timeit(func, *args):
+    start = time.time()
+    result = func(*args)
+    return time.time() - start, result
+
+
+def main(legacy=False):
+    print "%8s %12s %12s %8s" % ("groups", "compiled(s)", "legacy(s)", "matched")
+    for count in (100, 1000, 10000):
+        raw_data = make_groups(count)
+        elapsed, result = timeit(filter_resource_from_json,
+                                 NAMES, FILTER, raw_data)
+        if legacy:
+            old_elapsed, old_result = timeit(legacy_filter,
+                                             NAMES, FILTER, raw_data)
+            assert sorted(old_result) == sorted(result)
+            old_elapsed = "%.4f" % old_elapsed
+        else:
+            old_elapsed = "-"
+        print "%8s %12.4f %12s %8s" % (count, elapsed, old_elapsed,
+                                       len(result))
+
+
+if __name__ == "__main__":
+    main(legacy="--legacy" in sys.argv)
+
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
@@ -0,0 +1,163 @@
+#!/usr/bin/env python
+"""
+Benchmark for the boot path of IcsMeta against the local fake metadata
+service and S3 of fake_imds.py
+
+Usage: python test/benchmark/bench_meta.py [--latency 0.005] [--runs 5]
+           [--files 20] [--json report.json]
+           [--baseline report.json [--tolerance 0.5]]
+
+With a baseline report, the exit status is 1 if any scenario is slower
+than the baseline by more than the tolerance, so it can be run in CI.
+"""
+
+import os
+import sys
+import json
+import time
+import shutil
+import getpass
+import grp
+import tempfile
+import optparse
+import logging
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from fake_imds import FakeServer
+from opslib.icsmeta import IcsMeta
+
+TAGS = {"Role": "web", "Name": "web-1"}
+
+FOLDERS = ("cfg/web", "cfg/web/web-1")
+
+
+def make_bucket(files, dest_dir, inventory):
+    # The inventory files are put in the folders listed in "inventory"
+    bucket = {}
+    owner = getpass.getuser()
+    group = grp.getgrgid(os.getgid()).gr_name
+    for folder in FOLDERS:
+        items = {}
+        for i in xrange(files):
+            fname = "file%s.conf" % i
+            bucket["%s/%s" % (folder, fname)] = "%s %s\n" % (folder, i) * 64
+            items[fname] = {"dest": os.path.join(
+                dest_dir, "%s-%s" % (folder.replace("/", "-"), fname)),
+                "mode": "420", "owner": owner, "group": group}
+        if folder in inventory:
+            bucket["%s/inventory_file" % folder] = json.dumps(items)
+    return bucket
+
+
+def new_meta(server, **kwargs):
+    return IcsMeta(credentials=server.s3_options(), tags=TAGS, **kwargs)
+
+
+def run_scenarios(server, options):
+    cache_dir = tempfile.mkdtemp(prefix="bench-meta-cache")
+    dest_dir = tempfile.mkdtemp(prefix="bench-meta-dest")
+
+    def clean_dest():
+        for name in os.listdir(dest_dir):
+            os.remove(os.path.join(dest_dir, name))
+
+    def download_cfg(inventory, clean):
+        def run():
+            server.buckets["bench-bucket"] = make_bucket(
+                options.files, dest_dir, inventory)
+            if clean:
+                clean_dest()
+            paths = new_meta(server).download_cfg(".*\\.conf$")
+            # Only the folders without inventory are batch downloaded
+            assert len(paths) == options.files * (
+                len(FOLDERS) - len(inventory))
+            for path in paths:
+                os.remove(path)
+        return run
+
+    new_meta(server, cache_dir=cache_dir).init_config()
+    scenarios = [
+        ("construct+region", lambda: new_meta(server).get_region()),
+        ("init_config", lambda: new_meta(server).init_config()),
+        ("init_config (cached)",
+         lambda: new_meta(server, cache_dir=cache_dir).init_config()),
+        ("download_cfg (batch)", download_cfg((), True)),
+        ("download_cfg (role inventory)", download_cfg(FOLDERS[:1], True)),
+        ("download_cfg (inventory)", download_cfg(FOLDERS, True)),
+        ("download_cfg (unchanged)", download_cfg(FOLDERS, False)),
+    ]
+
+    results = {}
+    try:
+        for name, func in scenarios:
+            func()
+            requests = server.requests
+            start = time.time()
+            for i in xrange(options.runs):
+                func()
+            elapsed = (time.time() - start) / options.runs
+            results[name] = {"seconds": elapsed,
+                             "requests": (server.requests - requests) /
+                             float(options.runs)}
+    finally:
+        shutil.rmtree(cache_dir)
+        shutil.rmtree(dest_dir)
+    return scenarios, results
+
+
+def compare(results, baseline, tolerance):
+    slower = []
+    for name, result in results.iteritems():
+        if name not in baseline:
+            continue
+        limit = baseline[name]["seconds"] * (1 + tolerance)
+        if result["seconds"] > limit:
+            slower.append("%s: %.4fs > %.4fs" %
+                          (name, result["seconds"], limit))
+    return slower
+
+
+def main():
+    parser = optparse.OptionParser()
+    parser.add_option("--latency", type="float", default=0.005,
+                      help="seconds added to each request")
+    parser.add_option("--runs", type="int", default=5)
+    parser.add_option("--files", type="int", default=20,
+                      help="configuration files in each folder")
+    parser.add_option("--json", help="write the results into this file")
+    parser.add_option("--baseline", help="compare with this JSON report")
+    parser.add_option("--tolerance", type="float", default=0.5)
+    options, args = parser.parse_args()
+
+    logging.getLogger("opslib").setLevel(logging.ERROR)
+    server = FakeServer(latency=options.latency).start()
+    server.configure_boto()
+    try:
+        scenarios, results = run_scenarios(server, options)
+    finally:
+        server.stop()
+
+    print "%-32s %10s %10s" % ("scenario", "seconds", "requests")
+    for name, func in scenarios:
+        print "%-32s %10.4f %10.1f" % (name, results[name]["seconds"],
+                                       results[name]["requests"])
+
+    if options.json:
+        with open(options.json, "w") as fp:
+            json.dump(results, fp, indent=2, sort_keys=True)
+
+    if options.baseline:
+        with open(options.baseline) as fp:
+            slower = compare(results, json.load(fp), options.tolerance)
+        for line in slower:
+            print "SLOWER %s" % line
+        if slower:
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
+
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
@@ -0,0 +1,258 @@
+#!/usr/bin/env python
+"""
+Local stand-in for the EC2 instance metadata service and S3
+
+It serves the meta-data (including the IAM role credentials), the user-data
+and the objects of S3 buckets from memory, with a configurable latency for
+each request, so that the boot path of IcsMeta can be measured off-instance.
+
+Usage: python test/benchmark/fake_imds.py [--port 8169] [--latency 0.005]
+"""
+
+import sys
+import json
+import time
+import hashlib
+import threading
+import optparse
+from urllib import unquote
+from urlparse import urlparse, parse_qs
+from SocketServer import ThreadingMixIn
+from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+from xml.sax.saxutils import escape
+
+import boto
+from boto.s3.connection import OrdinaryCallingFormat
+
+ROLE = "bench-role"
+
+META_DATA = {
+    "ami-id": "ami-12345678",
+    "hostname": "ip-10-0-0-10.ec2.internal",
+    "instance-id": "i-12345678",
+    "instance-type": "m3.medium",
+    "local-hostname": "ip-10-0-0-10.ec2.internal",
+    "local-ipv4": "10.0.0.10",
+    "public-hostname": "ec2-54-0-0-10.compute-1.amazonaws.com",
+    "public-ipv4": "54.0.0.10",
+    "placement": {"availability-zone": "us-east-1a"},
+    # The key is listed as "0=bench", and served at "0/openssh-key"
+    "public-keys": {"0=bench": {"openssh-key": "ssh-rsa AAAA bench"}},
+    "iam": {
+        "info": json.dumps({"Code": "Success",
+                            "InstanceProfileArn": "arn:aws:iam::1:"
+                                                  "instance-profile/%s" % ROLE,
+                            "InstanceProfileId": "AIPABENCH"}),
+        "security-credentials": {
+            ROLE: json.dumps({"Code": "Success",
+                              "Type": "AWS-HMAC",
+                              "AccessKeyId": "AKIABENCH",
+                              "SecretAccessKey": "bench-secret",
+                              "Token": "bench-token",
+                              "Expiration": "2030-01-01T00:00:00Z"}),
+        },
+    },
+}
+
+USER_DATA = {
+    "Bootstrap": {"SNS_Topic": "bench-topic",
+                  "URL": "s3://bench-bucket/scripts",
+                  "Timezone": "UTC"},
+    "S3": {"CfgURI": "bench-bucket/cfg"},
+}
+
+
+class FakeHandler(BaseHTTPRequestHandler):
+
+    """
+    Serve "/latest/meta-data/...", "/latest/user-data" and S3 requests
+    in the path style: "/<bucket>" and "/<bucket>/<key>"
+    """
+
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def send(self, code, body="", headers=None):
+        self.send_response(code)
+        for name, value in (headers or {}).iteritems():
+            self.send_header(name, value)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        if self.command != "HEAD":
+            self.wfile.write(body)
+
+    def handle_request(self):
+        server = self.server
+        server.count_request()
+        if server.latency:
+            time.sleep(server.latency)
+        url = urlparse(self.path)
+        path = unquote(url.path)
+        if path.startswith("/latest/meta-data"):
+            self.serve_meta_data(path[len("/latest/meta-data"):])
+        elif path.rstrip("/") == "/latest/user-data":
+            self.send(200, server.user_data)
+        else:
+            self.serve_s3(path, parse_qs(url.query))
+
+    do_GET = do_HEAD = handle_request
+
+    def serve_meta_data(self, path):
+        node = self.server.meta_data
+        for name in [n for n in path.split("/") if n]:
+            if not isinstance(node, dict):
+                return self.send(404)
+            matched = [k for k in node
+                       if k == name or k.startswith(name + "=")]
+            if not matched:
+                return self.send(404)
+            node = node[matched[0]]
+        if isinstance(node, dict):
+            lines = [k if "=" in k or not isinstance(v, dict) else k + "/"
+                     for k, v in sorted(node.iteritems())]
+            return self.send(200, "\n".join(lines))
+        self.send(200, node)
+
+    def serve_s3(self, path, query):
+        bucket_name, _, key_name = path.lstrip("/").partition("/")
+        bucket = self.server.buckets.get(bucket_name)
+        if bucket is None:
+            return self.send(404)
+        if key_name:
+            if key_name not in bucket:
+                return self.send(404)
+            data = bucket[key_name]
+            return self.send(200, data, {
+                "ETag": '"%s"' % hashlib.md5(data).hexdigest(),
+                "Content-Type": "application/octet-stream",
+                "Last-Modified": "Wed, 01 Jan 2014 00:00:00 GMT"})
+        prefix = query.get("prefix", [""])[0]
+        delimiter = query.get("delimiter", [""])[0]
+        contents, prefixes = [], set()
+        for name in sorted(bucket):
+            if not name.startswith(prefix):
+                continue
+            rest = name[len(prefix):]
+            if delimiter and delimiter in rest:
+                prefixes.add(prefix + rest.split(delimiter)[0] + delimiter)
+                continue
+            contents.append(
+                "<Contents><Key>%s</Key>"
+                "<LastModified>2014-01-01T00:00:00.000Z</LastModified>"
+                "<ETag>&quot;%s&quot;</ETag><Size>%s</Size>"
+                "<StorageClass>STANDARD</StorageClass></Contents>" %
+                (escape(name), hashlib.md5(bucket[name]).hexdigest(),
+                 len(bucket[name])))
+        body = ('<?xml version="1.0" encoding="UTF-8"?>'
+                '<ListBucketResult '
+                'xmlns="http://s3.amazonaws.com/doc/2006-03-01/">'
+                '<Name>%s</Name><Prefix>%s</Prefix><Marker></Marker>'
+                '<MaxKeys>1000</MaxKeys><IsTruncated>false</IsTruncated>'
+                '%s%s</ListBucketResult>' %
+                (escape(bucket_name), escape(prefix), "".join(contents),
+                 "".join("<CommonPrefixes><Prefix>%s</Prefix>"
+                         "</CommonPrefixes>" % escape(p)
+                         for p in sorted(prefixes))))
+        self.send(200, body, {"Content-Type": "application/xml"})
+
+
+class FakeServer(ThreadingMixIn, HTTPServer):
+
+    """
+    The fake metadata service and S3, running in a background thread
+    """
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, port=0, latency=0, meta_data=None, user_data=None,
+                 buckets=None):
+        """
+        :type port: int
+        :param port: the port listened on 127.0.0.1, any free one if 0
+
+        :type latency: float
+        :param latency: how many seconds each request is delayed
+
+        :type meta_data: dict
+        :param meta_data: the meta-data tree, :data:`META_DATA` by default
+
+        :type user_data: dict
+        :param user_data: the user-data, :data:`USER_DATA` by default
+
+        :type buckets: dict
+        :param buckets: a dict of bucket name to a dict of key to content
+        """
+        HTTPServer.__init__(self, ("127.0.0.1", port), FakeHandler)
+        self.latency = latency
+        self.meta_data = META_DATA if meta_data is None else meta_data
+        self.user_data = json.dumps(USER_DATA if user_data is None
+                                    else user_data)
+        self.buckets = {} if buckets is None else buckets
+        self.requests = 0
+        self._lock = threading.Lock()
+        self._thread = None
+
+    @property
+    def url(self):
+        return "http://127.0.0.1:%s" % self.server_address[1]
+
+    def count_request(self):
+        with self._lock:
+            self.requests += 1
+
+    def start(self):
+        self._thread = threading.Thread(target=self.serve_forever)
+        self._thread.setDaemon(True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+    def s3_options(self):
+        """
+        Get the arguments of the boto S3Connection to use this server
+
+        :rtype: dict
+        :return: the keyword arguments, including fake credentials
+        """
+        return {"aws_access_key_id": "AKIABENCH",
+                "aws_secret_access_key": "bench-secret",
+                "host": "127.0.0.1",
+                "port": self.server_address[1],
+                "is_secure": False,
+                "calling_format": OrdinaryCallingFormat()}
+
+    def configure_boto(self):
+        """
+        Make boto fetch the meta-data and the user-data from this server
+        """
+        if not boto.config.has_section("Boto"):
+            boto.config.add_section("Boto")
+        boto.config.set("Boto", "metadata_service_url", self.url)
+        boto.config.set("Boto", "num_retries", "1")
+        boto.config.set("Boto", "metadata_service_num_attempts", "1")
+
+
+def main():
+    parser = optparse.OptionParser()
+    parser.add_option("--port", type="int", default=8169)
+    parser.add_option("--latency", type="float", default=0.0)
+    options, args = parser.parse_args()
+    server = FakeServer(options.port, options.latency)
+    print "Serving the fake metadata service on %s" % server.url
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.server_close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
+
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
@@ -0,0 +1,43 @@
+import time
+
+from opslib.icsutils.cache import TTLCache
+from unit import unittest
+
+
+class TestTTLCache(unittest.TestCase):
+
+    def test_expire(self):
+        cache = TTLCache(ttl=0.05)
+        cache.set("a", 1)
+        cache.set("b", 2, ttl=60)
+        self.assertEquals(cache.get("a"), 1)
+        time.sleep(0.1)
+        self.assertEquals(cache.get("a"), None)
+        self.assertTrue("b" in cache)
+
+    def test_get_or_load(self):
+        cache = TTLCache(ttl=60)
+        calls = []
+        loader = lambda: calls.append(1) or {"i-1": "web"}
+        self.assertEquals(cache.get_or_load("m", loader), {"i-1": "web"})
+        self.assertEquals(cache.get_or_load("m", loader), {"i-1": "web"})
+        self.assertEquals(len(calls), 1)
+        cache.invalidate("m")
+        cache.get_or_load("m", loader)
+        self.assertEquals(len(calls), 2)
+
+    def test_invalidate_all(self):
+        cache = TTLCache()
+        cache.set("a", 1)
+        cache.set("b", 2)
+        cache.invalidate()
+        self.assertFalse("a" in cache or "b" in cache)
+
+    def test_invalidate_matching(self):
+        cache = TTLCache()
+        cache.set(("us-east-1", "web"), 1)
+        cache.set(("us-east-1", "api"), 2)
+        cache.set(("eu-west-1", "web"), 3)
+        cache.invalidate_matching(lambda key: key[0] == "us-east-1")
+        self.assertFalse(("us-east-1", "web") in cache)
+        self.assertEquals(cache.get(("eu-west-1", "web")), 3)
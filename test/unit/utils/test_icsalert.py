@@ -0,0 +1,57 @@
+import threading
+
+from opslib.icsutils.icsalert import AlertDispatcher
+from unit import unittest
+
+
+class FakeSNS(object):
+
+    def __init__(self):
+        self.published = []
+
+    def publish(self, topic_arn, msg, subj):
+        self.published.append((topic_arn, msg, subj))
+
+
+class BlockingSNS(FakeSNS):
+
+    def __init__(self):
+        FakeSNS.__init__(self)
+        self.entered = threading.Event()
+        self.release = threading.Event()
+
+    def publish(self, topic_arn, msg, subj):
+        self.entered.set()
+        self.release.wait(5)
+        FakeSNS.publish(self, topic_arn, msg, subj)
+
+
+class TestAlertDispatcher(unittest.TestCase):
+
+    def setUp(self):
+        self.sns = FakeSNS()
+
+    def test_coalesce(self):
+        dispatcher = AlertDispatcher(window=60, rate=0)
+        for i in xrange(5):
+            dispatcher.submit(self.sns, "arn", "down %s" % i, "[ERROR] web")
+        dispatcher.submit(self.sns, "arn", "up", "[SUCCESS] web")
+        self.assertTrue(dispatcher.flush())
+        self.assertEquals(len(self.sns.published), 3)
+        self.assertEquals(self.sns.published[0][1], "down 0")
+        self.assertEquals(self.sns.published[2][2], "[ERROR] web [x4]")
+        self.assertTrue("down 4" in self.sns.published[2][1])
+        self.assertEquals(dispatcher.stats['sent'], 3)
+        self.assertEquals(dispatcher.stats['coalesced'], 3)
+
+    def test_drop(self):
+        sns = BlockingSNS()
+        dispatcher = AlertDispatcher(queue_size=1, rate=0)
+        self.assertTrue(dispatcher.submit(sns, "arn", "first", "a"))
+        sns.entered.wait(5)
+        self.assertTrue(dispatcher.submit(sns, "arn", "second", "b"))
+        self.assertFalse(dispatcher.submit(sns, "arn", "third", "c"))
+        sns.release.set()
+        self.assertTrue(dispatcher.flush())
+        self.assertEquals(len(sns.published), 2)
+        self.assertEquals(dispatcher.stats['dropped'], 1)
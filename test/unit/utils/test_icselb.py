@@ -0,0 +1,98 @@
+from opslib.icselb import IcsELB, parse_listener
+from opslib.icsexception import IcsELBException
+from unit import unittest
+
+
+class FakeListener(object):
+
+    def __init__(self, elb_port, instance_port, protocol, cert=None):
+        self.load_balancer_port = elb_port
+        self.instance_port = instance_port
+        self.protocol = protocol
+        self.ssl_certificate_id = cert
+
+
+class FakeLoadBalancer(object):
+
+    def __init__(self, name, listeners):
+        self.name = name
+        self.canonical_hosted_zone_name_id = 'Z123'
+        self.dns_name = '%s.elb.amazonaws.com' % name
+        self.listeners = [FakeListener(*l) for l in listeners]
+        self.instances = []
+
+
+class FakeConn(object):
+
+    def __init__(self, lbs):
+        self.lbs = lbs
+        self.calls = []
+
+    def get_all_load_balancers(self, load_balancer_names=None, marker=None):
+        if load_balancer_names is None:
+            return list(self.lbs)
+        return [lb for lb in self.lbs if lb.name in load_balancer_names]
+
+    def delete_load_balancer_listeners(self, name, ports):
+        self.calls.append(('delete', name, ports))
+
+    def create_load_balancer_listeners(self, name, listeners=None):
+        self.calls.append(('create', name, listeners))
+
+
+class TestParseListener(unittest.TestCase):
+
+    def test_parse(self):
+        self.assertEquals(parse_listener("80,8080,HTTP"), (80, 8080, 'HTTP'))
+        self.assertEquals(parse_listener("443,443,ssl,arn:a"),
+                          (443, 443, 'ssl', 'arn:a'))
+        self.assertEquals(parse_listener("443,80,https,arn:a"),
+                          (443, 80, 'https', 'arn:a'))
+
+    def test_invalid(self):
+        for listener in ["443,443,SSL", "443,80,HTTPS,", "80,80,HTTP,arn:a",
+                         "80,80", "x,80,HTTP", "80,80,UDP"]:
+            self.assertEquals(parse_listener(listener), None)
+
+
+class TestSyncListeners(unittest.TestCase):
+
+    def setUp(self):
+        lb = FakeLoadBalancer('web', [(80, 80, 'HTTP'),
+                                      (443, 443, 'SSL', 'arn:a'),
+                                      (8443, 80, 'HTTPS', 'arn:b')])
+        # A unique access key keeps the shared descriptors of each test apart
+        self.elb = IcsELB('us-east-1', aws_access_key_id=str(id(self)),
+                          aws_secret_access_key='secret')
+        self.elb.conn = self.conn = FakeConn([lb])
+
+    def tearDown(self):
+        self.elb.invalidate()
+
+    def test_unchanged(self):
+        result = self.elb.sync_listeners(
+            'web', ["80,80,http", "443,443,SSL,arn:a", "8443,80,https,arn:b"])
+        self.assertEquals(result, {'added': [], 'removed': []})
+        self.assertEquals(self.conn.calls, [])
+
+    def test_changed_cert(self):
+        result = self.elb.sync_listeners(
+            'web', ["80,80,HTTP", "443,443,SSL,arn:c", "8443,80,HTTPS,arn:b"])
+        self.assertEquals(result, {'added': [(443, 443, 'SSL', 'arn:c')],
+                                   'removed': [443]})
+        self.assertEquals(self.conn.calls, [
+            ('delete', 'web', [443]),
+            ('create', 'web', [(443, 443, 'SSL', 'arn:c')])])
+
+    def test_changed_protocol(self):
+        to_add, to_remove = self.elb.diff_listeners(
+            'web', ["80,80,TCP", "443,443,SSL,arn:a", "8443,80,HTTPS,arn:b"])
+        self.assertEquals(to_add, [(80, 80, 'TCP')])
+        self.assertEquals(to_remove, [80])
+
+    def test_invalid_removes_nothing(self):
+        for desired in (["80,80,TCP", "443,443,SSL"],
+                        ["80,80,HTTP", "80,8080,HTTP"]):
+            self.assertRaises(IcsELBException, self.elb.sync_listeners,
+                              'web', desired)
+        self.assertEquals(self.conn.calls, [])
@@ -0,0 +1,63 @@
+import os
+import shutil
+import logging
+import tempfile
+import threading
+
+from opslib.icslog import AsyncHandler
+from unit import unittest
+
+
+class SlowHandler(logging.Handler):
+
+    def __init__(self):
+        logging.Handler.__init__(self)
+        self.records = []
+        self.entered = threading.Event()
+        self.unblock = threading.Event()
+
+    def emit(self, record):
+        self.entered.set()
+        self.unblock.wait(5)
+        self.records.append(record.getMessage())
+
+
+class TestAsyncHandler(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.logger = logging.getLogger("test_icslog_%s" % id(self))
+        self.logger.propagate = False
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_write(self):
+        path = os.path.join(self.tmpdir, "test.log")
+        handler = AsyncHandler(logging.FileHandler(path),
+                               lock_file=path + ".lock")
+        self.logger.addHandler(handler)
+        for i in xrange(500):
+            self.logger.error("line %s", i)
+        handler.flush()
+        lines = open(path).read().splitlines()
+        self.assertEquals(len(lines), 500)
+        self.assertEquals(lines[-1], "line 499")
+        handler.close()
+        self.logger.removeHandler(handler)
+
+    def test_drop(self):
+        target = SlowHandler()
+        handler = AsyncHandler(target, queue_size=2)
+        self.logger.addHandler(handler)
+        self.logger.error("first")
+        target.entered.wait(5)
+        for i in xrange(10):
+            self.logger.error("line %s", i)
+        self.assertEquals(handler.dropped, 8)
+        target.unblock.set()
+        handler.close()
+        # The first, two queued lines, and the warning on the dropped ones
+        self.assertEquals(len(target.records), 4)
+        self.assertTrue("8 log records dropped" in target.records[-1])
+        self.logger.removeHandler(handler)
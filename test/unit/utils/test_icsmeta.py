@@ -0,0 +1,97 @@
+import os
+import json
+import shutil
+import tempfile
+
+from opslib.icsmeta import IcsMeta
+from unit import unittest
+
+META_DATA = {'instance-id': 'i-12345678',
+             'local-ipv4': '10.0.0.10',
+             'placement': {'availability-zone': 'us-east-1a'},
+             'iam': {'security-credentials': {'role': '{"Token": "x"}'}}}
+
+USER_DATA = {'S3': {'CfgURI': 'bucket/cfg'}}
+
+
+class TestIcsMetaCache(unittest.TestCase):
+
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp(prefix='test-icsmeta')
+        self.fetched = []
+
+    def tearDown(self):
+        shutil.rmtree(self.cache_dir)
+
+    def meta(self, user_data=USER_DATA, **kwargs):
+        meta = IcsMeta(cache_dir=self.cache_dir, **kwargs)
+
+        def fetch(name, value):
+            self.fetched.append(name)
+            return value
+        meta._fetch_meta_data = lambda: fetch('meta_data', META_DATA)
+        meta._fetch_user_data = lambda: fetch('user_data', user_data)
+        return meta
+
+    def read_entry(self, name):
+        with open(os.path.join(self.cache_dir, '%s.json' % name)) as fp:
+            return json.load(fp)
+
+    def write_entry(self, name, entry):
+        with open(os.path.join(self.cache_dir, '%s.json' % name), 'w') as fp:
+            json.dump(entry, fp)
+
+    def test_read_write(self):
+        self.assertEquals(self.meta().user_data, USER_DATA)
+        self.assertEquals(self.meta().user_data, USER_DATA)
+        self.assertEquals(self.fetched, ['user_data'])
+        mode = os.stat(os.path.join(self.cache_dir, 'user_data.json')).st_mode
+        self.assertEquals(mode & 0777, 0600)
+
+    def test_meta_data_keys(self):
+        self.assertEquals(self.meta().get_instance_id(), 'i-12345678')
+        data = self.read_entry('meta_data')['data']
+        self.assertFalse('iam' in data)
+        self.assertEquals(data['placement'],
+                          {'availability-zone': 'us-east-1a'})
+        self.assertEquals(self.meta().get_region(), 'us-east-1')
+        self.assertEquals(self.fetched, ['meta_data'])
+
+    def test_expired(self):
+        self.meta(cache_ttls={'user_data': -1}).user_data
+        self.meta().user_data
+        self.assertEquals(self.fetched, ['user_data', 'user_data'])
+
+    def test_refresh(self):
+        self.meta().user_data
+        changed = {'S3': {'CfgURI': 'other/cfg'}}
+        self.assertEquals(self.meta(changed, refresh=True).user_data,
+                          changed)
+        # The refreshed source is cached for the following objects
+        self.assertEquals(self.meta().user_data, changed)
+        self.assertEquals(self.fetched, ['user_data', 'user_data'])
+
+    def test_reload(self):
+        meta = self.meta()
+        meta.user_data
+        meta.reload(['user_data'])
+        self.assertEquals(self.fetched, ['user_data', 'user_data'])
+
+    def test_empty_not_cached(self):
+        self.meta({}).user_data
+        self.assertFalse(os.path.exists(
+            os.path.join(self.cache_dir, 'user_data.json')))
+
+    def test_other_boot(self):
+        self.meta().user_data
+        entry = self.read_entry('user_data')
+        entry['boot_id'] = 'baked-into-an-ami'
+        self.write_entry('user_data', entry)
+        self.meta().user_data
+        self.assertEquals(self.fetched, ['user_data', 'user_data'])
+
+    def test_no_cache_dir(self):
+        meta = self.meta()
+        meta.cache_dir = None
+        meta.user_data
+        self.assertEquals(os.listdir(self.cache_dir), [])
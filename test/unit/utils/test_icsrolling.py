@@ -0,0 +1,184 @@
+import threading
+
+from opslib import icsrolling
+from opslib.icsrolling import IcsRolling
+from opslib.icsexception import IcsASException
+from unit import unittest
+
+
+class FakeProcess(object):
+
+    def __init__(self, process_name):
+        self.process_name = process_name
+
+
+class FakeInstance(object):
+
+    def __init__(self, instance_id, launch_config_name):
+        self.instance_id = instance_id
+        self.launch_config_name = launch_config_name
+        self.lifecycle_state = 'InService'
+        self.health_status = 'Healthy'
+
+
+class FakeGroup(object):
+
+    def __init__(self, outdated, desired_capacity=None):
+        self.name = 'web'
+        self.launch_config_name = 'new'
+        self.load_balancers = ['web-lb']
+        self.instances = [FakeInstance('i-old%s' % i, 'old')
+                          for i in xrange(outdated)]
+        if desired_capacity is None:
+            desired_capacity = outdated
+        self.desired_capacity = desired_capacity
+        self.suspended_processes = []
+
+
+class FakeAS(object):
+
+    """
+    Auto Scaling launching a new instance for each one terminated, and
+    filling the group up to its desired capacity
+    """
+
+    def __init__(self, group):
+        self.group = group
+        self.batches = []
+        self.suspended = []
+        self.resumed = []
+        self.launched = 0
+        # The instances of a batch are terminated in parallel
+        self.lock = threading.Lock()
+
+    def get_group_from_name(self, name):
+        return [self.group]
+
+    def terminate_group_instance(self, instance_id, decrement_capacity=True):
+        with self.lock:
+            self.group.instances = [i for i in self.group.instances
+                                    if i.instance_id != instance_id]
+            self.batches[-1].append(instance_id)
+
+    def launch(self):
+        while len(self.group.instances) < self.group.desired_capacity:
+            self.launched += 1
+            self.group.instances.append(
+                FakeInstance('i-new%s' % self.launched, 'new'))
+
+    def suspend_scaling_group(self, name, processes):
+        self.suspended.append((name, processes))
+
+    def resume_scaling_group(self, name, processes):
+        self.resumed.append((name, processes))
+
+
+class FakeELB(object):
+
+    def __init__(self):
+        self.out_of_service = set()
+
+    def get_instances_health(self, lb_name, instance_ids):
+        return dict((i, 'OutOfService' if i in self.out_of_service
+                     else 'InService') for i in instance_ids)
+
+
+class FakeEc2(object):
+
+    def __init__(self, status=('ok', 'ok')):
+        self.status = status
+
+    def get_instances_status(self, instance_ids):
+        return dict((i, self.status) for i in instance_ids)
+
+
+class TestIcsRolling(unittest.TestCase):
+
+    def setUp(self):
+        self.originals = (icsrolling.IcsAS, icsrolling.IcsELB,
+                          icsrolling.IcsEc2)
+        self.elb = FakeELB()
+        self.ec2 = FakeEc2()
+        icsrolling.IcsAS = lambda region, **kwargs: self.asg
+        icsrolling.IcsELB = lambda region, **kwargs: self.elb
+        icsrolling.IcsEc2 = lambda region, **kwargs: self.ec2
+
+    def tearDown(self):
+        (icsrolling.IcsAS, icsrolling.IcsELB,
+         icsrolling.IcsEc2) = self.originals
+
+    def rolling(self, group, **kwargs):
+        self.asg = FakeAS(group)
+        kwargs.setdefault('timeout', 5)
+        rolling = IcsRolling('us-east-1', 'web', interval=0.01, **kwargs)
+        terminate = rolling.terminate
+
+        def terminate_and_launch(instance_ids):
+            self.asg.batches.append([])
+            terminate(instance_ids)
+            self.asg.launch()
+        rolling.terminate = terminate_and_launch
+        return rolling
+
+    def test_invalid_sizes(self):
+        self.asg = FakeAS(FakeGroup(1))
+        self.assertRaises(IcsASException, IcsRolling, 'us-east-1', 'web',
+                          batch_size=0)
+        self.assertRaises(IcsASException, IcsRolling, 'us-east-1', 'web',
+                          max_unavailable=0)
+
+    def test_batches(self):
+        rolling = self.rolling(FakeGroup(5), batch_size=2, max_unavailable=2)
+        report = rolling.run()
+        self.assertEquals(report['batches'], 3)
+        self.assertEquals([sorted(b) for b in self.asg.batches],
+                          [['i-old0', 'i-old1'], ['i-old2', 'i-old3'],
+                           ['i-old4']])
+        self.assertEquals(sorted(report['replaced']),
+                          ['i-old%s' % i for i in xrange(5)])
+        processes = ['AZRebalance', 'AlarmNotification', 'ScheduledActions']
+        self.assertEquals(self.asg.suspended, [('web', processes)])
+        self.assertEquals(self.asg.resumed, [('web', processes)])
+
+    def test_unavailable_budget(self):
+        # One instance is missing, so the first batch can only replace one
+        rolling = self.rolling(FakeGroup(4, desired_capacity=5),
+                               batch_size=3, max_unavailable=2)
+        report = rolling.run()
+        self.assertEquals([len(b) for b in self.asg.batches], [1, 2, 1])
+        self.assertEquals(report['batches'], 3)
+        self.assertEquals(len(report['replaced']), 4)
+
+    def test_unhealthy_outdated(self):
+        # Only the replacements are checked, not the outdated instances
+        self.elb.out_of_service.add('i-old2')
+        rolling = self.rolling(FakeGroup(3), timeout=0)
+        report = rolling.run()
+        self.assertEquals(self.asg.batches,
+                          [['i-old0'], ['i-old1'], ['i-old2']])
+        self.assertEquals(report['batches'], 3)
+
+    def test_timeout(self):
+        self.ec2.status = ('impaired', 'ok')
+        rolling = self.rolling(FakeGroup(2), timeout=0)
+        self.assertRaises(IcsASException, rolling.run)
+        self.assertEquals(self.asg.batches, [['i-old0']])
+        self.assertEquals(len(self.asg.resumed), 1)
+
+    def test_suspended_before(self):
+        # The processes suspended by the operator are not resumed
+        group = FakeGroup(1)
+        group.suspended_processes = [FakeProcess('AZRebalance'),
+                                     FakeProcess('Launch')]
+        rolling = self.rolling(group)
+        report = rolling.run()
+        processes = ['AlarmNotification', 'ScheduledActions']
+        self.assertEquals(report['suspended'], processes)
+        self.assertEquals(self.asg.suspended, [('web', processes)])
+        self.assertEquals(self.asg.resumed, [('web', processes)])
+
+        group.suspended_processes = [FakeProcess(p) for p in
+                                     rolling.processes]
+        self.rolling(group).run()
+        self.assertEquals(self.asg.suspended, [])
+        self.assertEquals(self.asg.resumed, [])
@@ -0,0 +1,169 @@
+import time
+import threading
+
+from boto.sqs.message import RawMessage
+
+from opslib.icssqs import IcsSqs
+from opslib.icsexception import IcsSQSException
+from unit import unittest
+
+
+class FakeResult(object):
+
+    def __init__(self):
+        self.results = []
+        self.errors = []
+
+
+class FakeQueue(object):
+
+    """
+    Queue failing the writes of the bodies in "failures" as many times
+    as their count, by the fault of the sender if "sender_fault"
+    """
+
+    name = 'jobs'
+    message_class = RawMessage
+
+    def __init__(self, failures=None, sender_fault='false', messages=(),
+                 stop=None):
+        self.failures = dict(failures or {})
+        self.sender_fault = sender_fault
+        self.messages = list(messages)
+        self.stop = stop
+        self.writes = []
+        self.deletes = []
+        self.extended = []
+        self.lock = threading.Lock()
+
+    def write_batch(self, entries):
+        self.writes.append([body for _, body, _ in entries])
+        result = FakeResult()
+        for entry_id, body, delay in entries:
+            if self.failures.get(body):
+                self.failures[body] -= 1
+                result.errors.append({'id': entry_id,
+                                      'error_message': 'failed %s' % body,
+                                      'sender_fault': self.sender_fault})
+            else:
+                result.results.append({'id': entry_id,
+                                       'message_id': 'm-%s' % body})
+        return result
+
+    def delete_message_batch(self, messages):
+        with self.lock:
+            self.deletes.append([m.get_body() for m in messages])
+        result = FakeResult()
+        for message in messages:
+            if message.get_body() in self.failures:
+                result.errors.append({'id': message.id,
+                                      'error_message': 'not deleted'})
+            else:
+                result.results.append({'id': message.id})
+        return result
+
+    def get_messages(self, num_messages=1, visibility_timeout=None,
+                     wait_time_seconds=None):
+        batch = self.messages[:num_messages]
+        del self.messages[:num_messages]
+        if not self.messages:
+            self.stop.set()
+        return batch
+
+    def change_message_visibility_batch(self, messages):
+        with self.lock:
+            self.extended.append([(m.get_body(), timeout)
+                                  for m, timeout in messages])
+
+
+def new_message(body):
+    message = RawMessage(body=body)
+    message.id = 'id-%s' % body
+    return message
+
+
+class TestIcsSqs(unittest.TestCase):
+
+    def setUp(self):
+        self.sqs = IcsSqs('us-east-1', aws_access_key_id='key',
+                          aws_secret_access_key='secret')
+
+    def test_send_batches(self):
+        queue = FakeQueue()
+        bodies = ['b%s' % i for i in xrange(25)]
+        self.assertEquals(self.sqs.send_messages(queue, bodies),
+                          ['m-%s' % body for body in bodies])
+        self.assertEquals([len(batch) for batch in queue.writes],
+                          [10, 10, 5])
+
+    def test_send_batch_bytes(self):
+        queue = FakeQueue()
+        bodies = ['%s' % i * 100 * 1024 for i in xrange(3)]
+        self.sqs.send_messages(queue, bodies)
+        self.assertEquals([len(batch) for batch in queue.writes], [2, 1])
+
+    def test_send_retry(self):
+        queue = FakeQueue(failures={'b3': 1, 'b7': 2})
+        bodies = ['b%s' % i for i in xrange(10)]
+        self.assertEquals(self.sqs.send_messages(queue, bodies),
+                          ['m-%s' % body for body in bodies])
+        self.assertEquals(queue.writes[1:], [['b3', 'b7'], ['b7']])
+
+    def test_send_failed(self):
+        queue = FakeQueue(failures={'b1': 5})
+        try:
+            self.sqs.send_messages(queue, ['b0', 'b1'], tries=3)
+            self.fail("IcsSQSException not raised")
+        except IcsSQSException, e:
+            self.assertTrue('failed b1' in str(e))
+        self.assertEquals(queue.writes, [['b0', 'b1'], ['b1'], ['b1']])
+
+    def test_send_sender_fault(self):
+        # Not retried, as sending it again fails the same way
+        queue = FakeQueue(failures={'b1': 1}, sender_fault='true')
+        self.assertRaises(IcsSQSException, self.sqs.send_messages,
+                          queue, ['b0', 'b1'])
+        self.assertEquals(queue.writes, [['b0', 'b1']])
+
+    def test_delete_batches(self):
+        queue = FakeQueue()
+        messages = [new_message('b%s' % i) for i in xrange(23)]
+        self.assertEquals(self.sqs.delete_messages(queue, messages), 23)
+        self.assertEquals([len(batch) for batch in queue.deletes],
+                          [10, 10, 3])
+
+    def test_delete_failed(self):
+        queue = FakeQueue(failures={'b1': 1})
+        messages = [new_message('b%s' % i) for i in xrange(3)]
+        try:
+            self.sqs.delete_messages(queue, messages)
+            self.fail("IcsSQSException not raised")
+        except IcsSQSException, e:
+            self.assertTrue(str(e).startswith("1 of 3 messages"))
+
+    def test_consume(self):
+        stop = threading.Event()
+        bodies = ['slow', 'bad'] + ['b%s' % i for i in xrange(8)]
+        queue = FakeQueue(messages=[new_message(body) for body in bodies],
+                          stop=stop)
+        processed = []
+
+        def handler(message):
+            body = message.get_body()
+            if body == 'slow':
+                time.sleep(0.5)
+            elif body == 'bad':
+                raise ValueError("cannot process")
+            processed.append(body)
+
+        stats = self.sqs.consume(queue, handler, workers=2,
+                                 visibility_timeout=30, heartbeat=0.1,
+                                 stop=stop)
+        self.assertEquals(stats, {'received': 10, 'processed': 9,
+                                  'failed': 1, 'deleted': 9})
+        self.assertEquals(sorted(processed), sorted(bodies[:1] + bodies[2:]))
+        deleted = sum(queue.deletes, [])
+        self.assertEquals(sorted(deleted), sorted(processed))
+        # The slow message had its visibility extended while processed
+        extended = sum(queue.extended, [])
+        self.assertTrue(('slow', 30) in extended)
@@ -0,0 +1,121 @@
+import os
+import json
+import shutil
+import tempfile
+
+from opslib.icsutils.misc import ResourceFilter
+from opslib.icsutils.misc import iter_json
+from opslib.icsutils.misc import traverse_json
+from opslib.icsutils.misc import filter_resource_from_json
+from opslib.icsutils.misc import clean_empty_items
+from opslib.icsutils.misc import convert_keyname
+from opslib.icsutils.misc import drop_null_items
+from opslib.icsutils.misc import keyname_formatd
+from opslib.icsutils.misc import write_file_atomic
+from unit import unittest
+
+
+GROUPS = {
+    "AutoScalingGroups": [
+        {"AutoScalingGroupName": "web",
+         "Tags": [{"Key": "Role", "Value": "web"},
+                  {"Key": "Owner", "Value": "Production"}]},
+        {"AutoScalingGroupName": "db",
+         "Tags": [{"Key": "Owner", "Value": "Development"}]},
+    ]
+}
+
+
+class TestResourceFilter(unittest.TestCase):
+
+    def test_match_any_list_index(self):
+        finder = ResourceFilter({"Tags": [{"Key": "Owner",
+                                           "Value": "Production"}]})
+        groups = GROUPS["AutoScalingGroups"]
+        self.assertTrue(finder.match(groups[0]))
+        self.assertFalse(finder.match(groups[1]))
+
+    def test_match_multi_digit_index(self):
+        group = {"Tags": [{"Key": "Tag%s" % i} for i in range(12)]}
+        self.assertTrue(ResourceFilter({"Tags": [{"Key": "Tag11"}]})
+                        .match(group))
+
+    def test_empty_filter_matches_all(self):
+        self.assertEquals(
+            filter_resource_from_json(["AutoScalingGroupName"], {}, GROUPS),
+            [("web",), ("db",)])
+
+    def test_filter_resource_from_json(self):
+        self.assertEquals(
+            filter_resource_from_json(["AutoScalingGroupName"],
+                                      {"Tags": [{"Key": "Role"}]}, GROUPS),
+            [("web",)])
+
+
+class TestTraverseJson(unittest.TestCase):
+
+    def test_duplicate_list_items(self):
+        data = {"Zones": ["us-east-1a", "us-east-1a"], "Empty": []}
+        self.assertEquals(traverse_json(data),
+                          {"/Zones/0": "us-east-1a",
+                           "/Zones/1": "us-east-1a"})
+
+    def test_iter_json_order_and_delimiter(self):
+        data = [{"Key": "a"}, {"Key": "b", "Value": 0}]
+        self.assertEquals(list(iter_json(data, delimiter=".")),
+                          [(".0.Key", "a"), (".1.Key", "b")])
+
+    def test_deep_nesting(self):
+        data = "leaf"
+        for i in range(5000):
+            data = [data]
+        path, value = list(iter_json(data))[0]
+        self.assertEquals(value, "leaf")
+        self.assertEquals(path.count("/"), 5000)
+
+
+class TestKeynameFormat(unittest.TestCase):
+
+    data = {
+        "LaunchConfigurationName": "lc",
+        "UserData": "IyEvYmluL2Jhc2gK",
+        "KernelId": "",
+        "MinSize": 0,
+        "MaxSize": 0L,
+        "EbsOptimized": False,
+        "SpotPrice": None,
+        "SecurityGroups": [],
+        "InstanceMonitoring": {"Enabled": True, "Extra": {"Empty": []}},
+        "BlockDeviceMappings": [{"DeviceName": "/dev/sda1", "Ebs": {}}],
+    }
+
+    def test_same_as_json_round_trip(self):
+        expected = json.loads(json.dumps(self.data),
+                              object_hook=drop_null_items)
+        self.assertEquals(clean_empty_items(self.data), expected)
+        self.assertEquals(keyname_formatd(self.data),
+                          convert_keyname(expected))
+
+    def test_input_not_modified(self):
+        result = clean_empty_items(self.data)
+        result["BlockDeviceMappings"][0]["DeviceName"] = "/dev/sdb"
+        self.assertEquals(self.data["BlockDeviceMappings"][0]["DeviceName"],
+                          "/dev/sda1")
+        self.assertTrue("KernelId" in self.data)
+
+
+class TestWriteFileAtomic(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmpdir, "data.json")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_replace(self):
+        write_file_atomic(self.path, "old")
+        write_file_atomic(self.path, "new", mode=0644)
+        self.assertEquals(open(self.path).read(), "new")
+        self.assertEquals(os.stat(self.path).st_mode & 0777, 0644)
+        self.assertEquals(os.listdir(self.tmpdir), ["data.json"])
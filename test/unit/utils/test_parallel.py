@@ -0,0 +1,82 @@
+import time
+
+from opslib.icsexception import IcsException
+from opslib.icsutils.parallel import iter_parallel, run_parallel
+from opslib.icsutils.parallel import run_ordered, RateLimiter
+from unit import unittest
+
+
+def double(x):
+    if x == 3:
+        raise ValueError("bad item")
+    time.sleep(0.01)
+    return x * 2
+
+
+class TestParallel(unittest.TestCase):
+
+    def test_run_parallel_keeps_order(self):
+        results = run_parallel(double, range(10), workers=4)
+        self.assertEquals([r.item for r in results], range(10))
+        self.assertEquals(results[5].result, 10)
+
+    def test_run_parallel_records_errors(self):
+        results = run_parallel(double, range(5), workers=2)
+        self.assertFalse(results[3].ok)
+        self.assertTrue(isinstance(results[3].error, ValueError))
+        self.assertEquals(len([r for r in results if r.ok]), 4)
+
+    def test_iter_parallel_early_exit(self):
+        results = iter_parallel(double, iter(xrange(100000)), workers=2)
+        first = results.next()
+        results.close()
+        self.assertTrue(first.ok)
+
+    def test_iter_parallel_raises_input_error(self):
+        def items():
+            yield 1
+            raise KeyError("broken input")
+        self.assertRaises(KeyError, list, iter_parallel(double, items()))
+
+
+class TestRunOrdered(unittest.TestCase):
+
+    def test_dependencies_run_first(self):
+        finished = []
+
+        def launch(name):
+            if name == "bad":
+                raise ValueError(name)
+            finished.append(name)
+            return name
+
+        depends = {"app": ["db", "cache"], "web": ["app"], "cron": ["bad"]}
+        results = run_ordered(launch, ["web", "app", "db", "cache",
+                                       "bad", "cron"],
+                              depends=depends, workers=4)
+        self.assertTrue(finished.index("app") > finished.index("db"))
+        self.assertTrue(finished.index("web") > finished.index("app"))
+        self.assertTrue(results["web"].ok)
+        self.assertFalse(results["cron"].ok)
+        self.assertFalse("cron" in finished)
+
+    def test_circular_dependencies(self):
+        self.assertRaises(IcsException, run_ordered, str, ["a", "b"],
+                          {"a": ["b"], "b": ["a"]})
+
+
+class TestRateLimiter(unittest.TestCase):
+
+    def test_burst_then_limited(self):
+        limiter = RateLimiter(50, burst=5)
+        self.assertTrue(all([limiter.acquire(block=False)
+                             for i in range(5)]))
+        self.assertFalse(limiter.acquire(block=False))
+        start = time.time()
+        limiter.acquire()
+        self.assertTrue(time.time() - start > 0.005)
+
+    def test_no_limit(self):
+        limiter = RateLimiter(0)
+        self.assertTrue(all([limiter.acquire(block=False)
+                             for i in range(1000)]))
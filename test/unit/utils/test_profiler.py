@@ -0,0 +1,32 @@
+from opslib.icsutils.profiler import Profiler
+from unit import unittest
+
+
+class TestProfiler(unittest.TestCase):
+
+    def test_steps(self):
+        profiler = Profiler()
+        with profiler.step("outer"):
+            profiler.record_call(10)
+            with profiler.step("inner"):
+                profiler.record_call(5)
+        profiler.record_call(1)
+
+        timeline = profiler.timeline()
+        self.assertEquals(timeline['calls'], 3)
+        self.assertEquals(timeline['bytes'], 16)
+        steps = dict((s['step'], s) for s in timeline['steps'])
+        self.assertEquals(steps['outer']['calls'], 2)
+        self.assertEquals(steps['outer']['bytes'], 15)
+        self.assertEquals(steps['inner']['calls'], 1)
+        self.assertEquals([s['step'] for s in timeline['steps']],
+                          ['outer', 'inner'])
+
+    def test_error(self):
+        profiler = Profiler()
+        try:
+            with profiler.step("failed"):
+                raise ValueError("boom")
+        except ValueError:
+            pass
+        self.assertEquals(profiler.timeline()['steps'][0]['error'], "boom")
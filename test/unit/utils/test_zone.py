@@ -0,0 +1,126 @@
+from StringIO import StringIO
+
+from boto.route53.record import Record
+
+from opslib.zone import Zone, record_to_dict, parse_bind, parse_jsonl
+from opslib.zone import batch_records
+from unit import unittest
+
+
+class TestParseBind(unittest.TestCase):
+
+    def test_records(self):
+        zone = StringIO("$ORIGIN example.com.\n"
+                        "$TTL 300\n"
+                        "@\tIN\tA\t10.0.0.1 ; apex\n"
+                        "www 60 IN CNAME web.example.com.\n"
+                        "mail\tIN\tMX\t10 mx1.example.com.\n"
+                        "mail\tIN\tMX\t20 mx2.example.com.\n"
+                        "txt.example.com. IN TXT \"a;b\"\n")
+        records = list(parse_bind(zone))
+        self.assertEquals(records, [
+            {'Name': 'example.com.', 'Type': 'A', 'TTL': 300,
+             'ResourceRecords': ['10.0.0.1']},
+            {'Name': 'www.example.com.', 'Type': 'CNAME', 'TTL': 60,
+             'ResourceRecords': ['web.example.com.']},
+            {'Name': 'mail.example.com.', 'Type': 'MX', 'TTL': 300,
+             'ResourceRecords': ['10 mx1.example.com.',
+                                 '20 mx2.example.com.']},
+            {'Name': 'txt.example.com.', 'Type': 'TXT', 'TTL': 300,
+             'ResourceRecords': ['"a;b"']}])
+
+    def test_origin_argument(self):
+        records = list(parse_bind(StringIO("www A 10.0.0.2\n"),
+                                  origin="example.com.", ttl=120))
+        self.assertEquals(records, [
+            {'Name': 'www.example.com.', 'Type': 'A', 'TTL': 120,
+             'ResourceRecords': ['10.0.0.2']}])
+
+
+class TestRecordToDict(unittest.TestCase):
+
+    def test_plain(self):
+        record = Record('www.example.com.', 'A', '60',
+                        resource_records=['10.0.0.1', '10.0.0.2'])
+        self.assertEquals(record_to_dict(record), {
+            'Name': 'www.example.com.', 'Type': 'A', 'TTL': 60,
+            'ResourceRecords': ['10.0.0.1', '10.0.0.2']})
+
+    def test_alias_failover(self):
+        record = Record('www.example.com.', 'A',
+                        alias_hosted_zone_id='Z123',
+                        alias_dns_name='lb.amazonaws.com.',
+                        alias_evaluate_target_health=True,
+                        identifier='primary', failover='PRIMARY',
+                        health_check='hc-1')
+        self.assertEquals(record_to_dict(record), {
+            'Name': 'www.example.com.', 'Type': 'A',
+            'AliasTarget': {'HostedZoneId': 'Z123',
+                            'DNSName': 'lb.amazonaws.com.',
+                            'EvaluateTargetHealth': True},
+            'SetIdentifier': 'primary', 'Failover': 'PRIMARY',
+            'HealthCheckId': 'hc-1'})
+
+    def test_weighted(self):
+        record = Record('www.example.com.', 'CNAME', '60',
+                        resource_records=['a.example.com.'],
+                        identifier='a', weight='10')
+        data = record_to_dict(record)
+        self.assertEquals(data['SetIdentifier'], 'a')
+        self.assertEquals(data['Weight'], '10')
+        self.assertFalse('Failover' in data)
+
+
+class TestBatches(unittest.TestCase):
+
+    def setUp(self):
+        self.zone = Zone(None, {'Id': '/hostedzone/Z1',
+                                'Name': 'example.com.'})
+
+    def test_batch_records(self):
+        self.assertEquals(list(batch_records(xrange(5), 2)),
+                          [[0, 1], [2, 3], [4]])
+
+    def test_round_trip(self):
+        records = [
+            {'Name': 'www.example.com.', 'Type': 'A', 'TTL': 60,
+             'ResourceRecords': ['10.0.0.1']},
+            {'Name': 'lb.example.com.', 'Type': 'A',
+             'AliasTarget': {'HostedZoneId': 'Z123',
+                             'DNSName': 'lb.amazonaws.com.'},
+             'SetIdentifier': 'primary', 'Failover': 'PRIMARY',
+             'HealthCheckId': 'hc-1'},
+            {'Name': 'w.example.com.', 'Type': 'A', 'TTL': 60,
+             'ResourceRecords': ['10.0.0.2'],
+             'SetIdentifier': 'w', 'Weight': 10}]
+        changes = self.zone._batch_changes(records, "UPSERT")
+        self.assertEquals(len(changes.changes), 3)
+        self.assertEquals([action for action, _ in changes.changes],
+                          ["UPSERT"] * 3)
+
+        plain = changes.changes[0][1]
+        self.assertEquals(plain.resource_records, ['10.0.0.1'])
+        self.assertEquals(plain.alias_evaluate_target_health, None)
+
+        alias = changes.changes[1][1]
+        self.assertEquals(alias.alias_evaluate_target_health, False)
+        self.assertEquals(alias.failover, 'PRIMARY')
+        self.assertEquals(alias.health_check, 'hc-1')
+        xml = alias.to_xml()
+        self.assertTrue('<EvaluateTargetHealth>false'
+                        '</EvaluateTargetHealth>' in xml)
+        self.assertTrue('<Failover>PRIMARY</Failover>' in xml)
+        self.assertTrue('<HealthCheckId>hc-1</HealthCheckId>' in xml)
+
+        # What is exported is imported unchanged
+        for data, (action, record) in zip(records, changes.changes):
+            expected = dict(data)
+            if 'AliasTarget' in expected:
+                expected['AliasTarget'] = dict(expected['AliasTarget'],
+                                               EvaluateTargetHealth=False)
+            self.assertEquals(record_to_dict(record), expected)
+
+    def test_parse_jsonl(self):
+        fp = StringIO('{"Name": "a.", "Type": "A"}\n\n'
+                      '{"Name": "b.", "Type": "A"}\n')
+        self.assertEquals([r['Name'] for r in parse_jsonl(fp)], ['a.', 'b.'])